@@ -23,7 +23,7 @@ EOF
 # 2. CREACIÓN DEL SCRIPT PROXY CON VIRTUDES
 # ======================================================
 cat <<EOF > /opt/advanced-proxy/proxy.py
-import asyncio, hashlib, base64, gc, socket, collections, time
+import asyncio, hashlib, base64, gc, socket, collections, time, os, fcntl
 
 # ==============================================================================
 # ⚙️ BLOQUE DE PARÁMETROS - Optimizado para Túnel SSH (300 conexiones)
@@ -52,6 +52,11 @@ TCP_KEEPCNT     = 3               # 3            Intentos antes de marcar muerto
 # Cerrar túnel tras N seg sin datos (0=desactivado). Si usas limitador SSH y cuesta reconectar,
 # pon ej. 300 para cerrar idle y liberar sesiones; el limitador tiene gracia para proxy (127.0.0.1).
 IDLE_CLOSE_SEC  = 0               # 0            Desactivado. 300=cierra tras 5 min sin datos.
+
+# Relay splice (Linux, Python 3.10+): tras el 101 el kernel mueve los bytes socket->pipe->socket
+# con os.splice, sin copiarlos a Python. Sin os.splice se usa forward() (copia).
+SPLICE_RELAY    = True            # True         False = siempre forward()
+SPLICE_PIPE     = 262144          # 262144       Capacidad de cada pipe (256KB)
 # ==============================================================================
 
 # Guía para HTTP Custom:
@@ -149,6 +154,147 @@ async def forward(reader, writer, idle_close_sec=0):
                 await writer.wait_closed()
         except Exception: pass
 
+_SPLICE_OK = SPLICE_RELAY and hasattr(os, 'splice')
+_SPLICE_FLAGS = getattr(os, 'SPLICE_F_MOVE', 0) | getattr(os, 'SPLICE_F_NONBLOCK', 0)
+_F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+class _SpliceHalf:
+    """Una dirección del relay splice: src -> pipe -> dst."""
+    def __init__(self, relay, src, dst):
+        self.relay = relay
+        self.src = src
+        self.dst = dst
+        self.rfd, self.wfd = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        try: fcntl.fcntl(self.wfd, _F_SETPIPE_SZ, SPLICE_PIPE)
+        except OSError: pass
+        self.pending = 0        # bytes en el pipe aún no entregados a dst
+        self.eof = False
+        self.blocked = False    # dst lleno: esperando a que sea escribible
+        self.closed = False
+
+    def on_readable(self):
+        try:
+            n = os.splice(self.src.fileno(), self.wfd, SPLICE_PIPE, flags=_SPLICE_FLAGS)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.relay.finish(e)
+            return
+        if n:
+            self.pending += n
+            self.relay.last = time.monotonic()
+        else:
+            self.eof = True
+            self.relay.loop.remove_reader(self.src.fileno())
+        self.flush()
+
+    def flush(self):
+        loop = self.relay.loop
+        while self.pending:
+            try:
+                n = os.splice(self.rfd, self.dst.fileno(), self.pending, flags=_SPLICE_FLAGS)
+            except BlockingIOError:
+                if not self.blocked:
+                    # Back-pressure: no leer más de src hasta vaciar el pipe
+                    self.blocked = True
+                    if not self.eof:
+                        loop.remove_reader(self.src.fileno())
+                    loop.add_writer(self.dst.fileno(), self.flush)
+                return
+            except OSError as e:
+                self.relay.finish(e)
+                return
+            self.pending -= n
+        if self.blocked:
+            self.blocked = False
+            loop.remove_writer(self.dst.fileno())
+            if not self.eof:
+                loop.add_reader(self.src.fileno(), self.on_readable)
+        if self.eof and not self.closed:
+            self.closed = True
+            try: self.dst.shutdown(socket.SHUT_WR)
+            except OSError: pass
+            self.relay.half_closed()
+
+class SpliceRelay:
+    """Relay bidireccional con un pipe por dirección, dirigido por el epoll del event loop."""
+    def __init__(self, a, b):
+        self.loop = asyncio.get_running_loop()
+        self.last = time.monotonic()
+        self.done = self.loop.create_future()
+        self.halves = []
+        try:
+            self.halves.append(_SpliceHalf(self, a, b))
+            self.halves.append(_SpliceHalf(self, b, a))
+        except OSError:
+            self.close()
+            raise
+
+    def start(self):
+        for h in self.halves:
+            self.loop.add_reader(h.src.fileno(), h.on_readable)
+
+    def half_closed(self):
+        # Como forward(): el primer EOF (ya entregado al otro lado) termina la
+        # sesión; esperar el FIN contrario la dejaría abierta sin límite.
+        self.finish(None)
+
+    def finish(self, exc):
+        if not self.done.done():
+            self.done.set_result(exc)
+        self.close()
+
+    def close(self):
+        halves, self.halves = self.halves, []
+        for h in halves:
+            self.loop.remove_reader(h.src.fileno())
+            self.loop.remove_writer(h.dst.fileno())
+            os.close(h.rfd)
+            os.close(h.wfd)
+
+def splice_ready(*writers):
+    """True si los transportes pueden cederse a splice (nada pendiente de escribir)."""
+    for w in writers:
+        if w.transport.is_closing() or w.transport.get_write_buffer_size():
+            return False
+        if w.get_extra_info('socket') is None:
+            return False
+    return True
+
+def _detach(reader, writer):
+    """Saca el socket de asyncio (fd duplicado) junto con lo ya leído en el StreamReader."""
+    sock = socket.socket(fileno=os.dup(writer.get_extra_info('socket').fileno()))
+    sock.setblocking(False)
+    writer.transport.pause_reading()
+    buf = getattr(reader, '_buffer', None)
+    pending = bytes(buf) if buf else b''
+    if buf: buf.clear()
+    # abort() solo cierra el fd original; la conexión sigue viva en el dup
+    writer.transport.abort()
+    return sock, pending
+
+async def relay_splice(a_r, a_w, b_r, b_w, idle_close_sec=0):
+    """Relay a<->b por splice hasta el primer FIN, error o idle_close_sec sin datos."""
+    loop = asyncio.get_running_loop()
+    a = b = relay = None
+    try:
+        a, a_pending = _detach(a_r, a_w)
+        b, b_pending = _detach(b_r, b_w)
+        if a_pending: await loop.sock_sendall(b, a_pending)
+        if b_pending: await loop.sock_sendall(a, b_pending)
+        relay = SpliceRelay(a, b)
+        relay.start()
+        while not relay.done.done():
+            wait = None
+            if idle_close_sec:
+                wait = relay.last + idle_close_sec - time.monotonic()
+                if wait <= 0: break
+            await asyncio.wait([relay.done], timeout=wait)
+    finally:
+        if relay is not None: relay.close()
+        for sock in (a, b):
+            if sock is not None: sock.close()
+
 async def connect_with_retry(host, port, max_retries=3):
     """Conecta con reintentos exponenciales para túneles SSH."""
     last_error = None
@@ -250,6 +396,9 @@ async def handle(client_reader, client_writer):
         await client_writer.drain()
 
         idle = IDLE_CLOSE_SEC if IDLE_CLOSE_SEC else 0
+        if _SPLICE_OK and splice_ready(client_writer, target_writer):
+            await relay_splice(client_reader, client_writer, target_reader, target_writer, idle)
+            return
         t1 = asyncio.create_task(forward(client_reader, target_writer, idle))
         t2 = asyncio.create_task(forward(target_reader, client_writer, idle))
         done, _ = await asyncio.wait([t1, t2], return_when=asyncio.FIRST_COMPLETED)
@@ -8,12 +8,17 @@ Escucha en TCP y reenvía paquetes UDP sobre el túnel.
 import socket
 import struct
 import threading
+import json
 import logging
+import multiprocessing
+import os
+import selectors
 import signal
 import sys
 import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
 from typing import Optional, Dict, Tuple
-from dataclasses import dataclass
 
 # Constantes del protocolo UDPGW
 FLAG_KEEPALIVE = 1 << 0
@@ -28,17 +33,66 @@ MAX_PREAMBLE_SIZE = 23
 MAX_PAYLOAD_SIZE = 32768
 MAX_MESSAGE_SIZE = MAX_PREAMBLE_SIZE + MAX_PAYLOAD_SIZE
 
+# Modo hilos: mensajes pendientes hacia un cliente (al llenarse se descarta el más antiguo)
+# y cuántos se juntan como máximo en una llamada a sendmsg.
+DEFAULT_CLIENT_QUEUE = 1024
+SENDMSG_BATCH = 64
 
-@dataclass
-class UdpgwMessage:
-    """Mensaje del protocolo UDPGW."""
-    conn_id: int
-    remote_ip: bytes
-    remote_port: int
-    discard_existing: bool
-    forward_dns: bool
-    packet: bytes
-    preamble_size: int
+# Modo reactor: lecturas por socket listo antes de atender a los demás.
+REACTOR_RECV_BUDGET = 32
+# Modo reactor: bytes pendientes hacia un cliente TCP a partir de los cuales
+# se descartan datagramas de bajada (como haría la red con UDP).
+REACTOR_MAX_PENDING = 4 * 1024 * 1024
+
+# Intervalo de --stats-file cuando no se indica --stats-interval.
+DEFAULT_STATS_FILE_INTERVAL = 10
+
+# --processes: un hijo que muere antes de estos segundos indica un error de
+# configuración y detiene todo en lugar de relanzarse en bucle.
+PREFORK_MIN_UPTIME = 2.0
+
+# --dns: segundos de espera por respuesta del resolver, consultas en vuelo como
+# máximo (el ID de transacción es de 16 bits), entradas de la caché y TTL máximo
+# que se respeta en ella.
+DNS_TIMEOUT = 5.0
+DNS_MAX_PENDING = 16384
+DNS_CACHE_SIZE = 4096
+DNS_CACHE_MAX_TTL = 300
+# Buffer del socket compartido con el resolver: recibe las respuestas de todos los
+# clientes en ráfaga (el kernel lo limita a net.core.rmem_max).
+DNS_SOCKET_BUFFER = 4 * 1024 * 1024
+
+
+class TrafficStats:
+    """
+    Contadores de tráfico de un cliente (o de un port forward en modo hilos).
+
+    Cada instancia la escribe un solo hilo (lector del cliente, hilo de relay o
+    reactor), así que se incrementan sin locks y los relays no se serializan.
+    Las estadísticas suman instancias y pueden ir algún paquete por detrás.
+    """
+
+    __slots__ = ("up_packets", "up_bytes", "down_packets", "down_bytes",
+                 "oversize", "cap_hits", "send_errors", "queue_drops")
+
+    def __init__(self):
+        self.up_packets = 0
+        self.up_bytes = 0
+        self.down_packets = 0
+        self.down_bytes = 0
+        # Descartes: datagrama de bajada > MAX_PAYLOAD_SIZE, port forward reciclado
+        # por max_connections, error al enviar por UDP y cola hacia el cliente llena.
+        self.oversize = 0
+        self.cap_hits = 0
+        self.send_errors = 0
+        self.queue_drops = 0
+
+    def add(self, other: "TrafficStats"):
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
 
 
 def _configure_socket_stability(
@@ -60,62 +114,78 @@ def _configure_socket_stability(
         pass
 
 
-def read_udpgw_message(conn: socket.socket, buffer: bytearray) -> Optional[UdpgwMessage]:
+class UdpgwReader:
     """
-    Lee un mensaje UDPGW del socket.
+    Lector de mensajes UDPGW sobre un buffer preasignado.
     Formato: | 2 bytes size (LE) | 1 byte flags | 2 bytes connID (LE) | 6/18 bytes addr | packet |
+
+    fill() hace un solo recv_into con todo el espacio libre, así que una lectura
+    suele traer varios mensajes; messages() los recorre sin copiar el payload.
+    Las vistas entregadas solo son válidas hasta la siguiente llamada a fill().
     """
-    try:
-        header = conn.recv(2)
-        if len(header) < 2:
-            return None
-        size = struct.unpack_from("<H", header)[0]
 
-        if size < 3 or size > len(buffer) - 2:
-            return None
+    __slots__ = ("buf", "view", "start", "end")
 
-        data = b""
-        while len(data) < size:
-            chunk = conn.recv(size - len(data))
-            if not chunk:
-                return None
-            data += chunk
-
-        flags = data[0]
-        conn_id = struct.unpack_from("<H", data, 1)[0]
-
-        # Ignorar keepalive
-        if flags & FLAG_KEEPALIVE:
-            return read_udpgw_message(conn, buffer)
-
-        if flags & FLAG_IPV6:
-            if size < 21:
-                return None
-            remote_ip = bytes(data[5:21])
-            remote_port = struct.unpack_from(">H", data, 21)[0]
-            header_len = 21  # 1 + 2 + 16 + 2
-        else:
-            if size < 9:
-                return None
-            remote_ip = bytes(data[5:9])
-            remote_port = struct.unpack_from(">H", data, 9)[0]
-            header_len = 9   # 1 + 2 + 4 + 2
-
-        packet = bytes(data[header_len:size])
-        # preamble_size = 2 (size) + 1 (flags) + 2 (connID) + addr = 7 + len(remote_ip)
-        preamble_size = 7 + len(remote_ip)
-
-        return UdpgwMessage(
-            conn_id=conn_id,
-            remote_ip=remote_ip,
-            remote_port=remote_port,
-            discard_existing=bool(flags & FLAG_REBIND),
-            forward_dns=bool(flags & FLAG_DNS),
-            packet=packet,
-            preamble_size=preamble_size
-        )
-    except (socket.error, struct.error, OSError):
-        return None
+    def __init__(self, size: int = 0):
+        # Cabe al menos un mensaje máximo además de lo ya leído.
+        self.buf = bytearray(max(size, 2 * MAX_MESSAGE_SIZE))
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+
+    def fill(self, conn: socket.socket) -> int:
+        """Lee lo disponible del socket. Retorna bytes leídos (0 = conexión cerrada)."""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif len(self.buf) - self.end < MAX_MESSAGE_SIZE:
+            # Mover el mensaje incompleto al principio (copia: origen y destino se solapan).
+            pending = self.end - self.start
+            self.buf[:pending] = bytes(self.view[self.start:self.end])
+            self.start, self.end = 0, pending
+        n = conn.recv_into(self.view[self.end:])
+        self.end += n
+        return n
+
+    def messages(self):
+        """
+        Genera (conn_id, flags, remote_ip, remote_port, packet, preamble_size) por
+        cada mensaje completo; remote_ip y packet son memoryview. Los keepalive se
+        saltan. ValueError si un mensaje no es válido.
+        """
+        buf = self.buf
+        view = self.view
+        pos = self.start
+        end = self.end
+        try:
+            while end - pos >= 2:
+                size = buf[pos] | (buf[pos + 1] << 8)
+                if size < 3 or size > MAX_MESSAGE_SIZE - 2:
+                    raise ValueError("tamaño de mensaje inválido")
+                body = pos + 2
+                nxt = body + size
+                if nxt > end:
+                    break
+                flags = buf[body]
+                pos = nxt
+                # Ignorar keepalive
+                if flags & FLAG_KEEPALIVE:
+                    continue
+                if flags & FLAG_IPV6:
+                    if size < 21:
+                        raise ValueError("mensaje IPv6 corto")
+                    addr_len = 16
+                else:
+                    if size < 9:
+                        raise ValueError("mensaje IPv4 corto")
+                    addr_len = 4
+                conn_id = buf[body + 1] | (buf[body + 2] << 8)
+                ip_end = body + 3 + addr_len
+                remote_port = (buf[ip_end] << 8) | buf[ip_end + 1]
+                # preamble_size = 2 (size) + 1 (flags) + 2 (connID) + addr = 7 + len(remote_ip)
+                yield (conn_id, flags, view[body + 3:ip_end], remote_port,
+                       view[ip_end + 2:nxt], 7 + addr_len)
+        finally:
+            self.start = pos
 
 
 def write_udpgw_response(
@@ -137,6 +207,311 @@ def write_udpgw_response(
     return preamble_size + packet_size
 
 
+class ClientWriter:
+    """
+    Cola de salida de un cliente con un único hilo escritor (modo hilos).
+
+    Los hilos de PortForward solo encolan (deque.append es atómico en CPython,
+    sin lock); el escritor junta lo pendiente en una llamada a sendmsg. La cola
+    está acotada: si el cliente no lee, se descarta el mensaje más antiguo y
+    los hilos de relay nunca se bloquean.
+    """
+
+    def __init__(self, conn: socket.socket, max_queue: int = DEFAULT_CLIENT_QUEUE):
+        self.conn = conn
+        self.queue: deque = deque(maxlen=max(1, max_queue))
+        self._wakeup = threading.Event()
+        self._closed = False
+        self.failed = False
+        # Contadores (los de descarte son aproximados: se actualizan sin lock).
+        self.dropped = 0
+        self.sent_frames = 0
+        self.sent_bytes = 0
+        self.sendmsg_calls = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def put(self, frame: bytes):
+        q = self.queue
+        if len(q) == q.maxlen:
+            self.dropped += 1
+        q.append(frame)
+        if not self._wakeup.is_set():
+            self._wakeup.set()
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+
+    def _run(self):
+        q = self.queue
+        conn = self.conn
+        batch = []
+        try:
+            while True:
+                self._wakeup.wait()
+                # Limpiar antes de vaciar: un put() posterior vuelve a despertar.
+                self._wakeup.clear()
+                if self._closed:
+                    return
+                while q:
+                    try:
+                        while q and len(batch) < SENDMSG_BATCH:
+                            batch.append(q.popleft())
+                    except IndexError:
+                        pass
+                    total = sum(len(b) for b in batch)
+                    sent = conn.sendmsg(batch)
+                    if sent < total:
+                        conn.sendall(b"".join(batch)[sent:])
+                    self.sendmsg_calls += 1
+                    self.sent_frames += len(batch)
+                    self.sent_bytes += total
+                    batch.clear()
+        except OSError:
+            # Cliente caído o sin leer durante --client-timeout: despertar al lector
+            # para que cierre la sesión completa.
+            self.failed = True
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def build_udpgw_frame(conn_id: int, remote_ip: bytes, remote_port: int, payload: bytes) -> bytes:
+    """Mensaje UDPGW completo (con el campo size) hacia el cliente."""
+    flags = FLAG_IPV6 if len(remote_ip) == 16 else 0
+    return (
+        struct.pack("<HBH", 5 + len(remote_ip) + len(payload), flags, conn_id)
+        + remote_ip + struct.pack(">H", remote_port) + payload
+    )
+
+
+def _dns_skip_name(data, pos: int) -> int:
+    """Posición tras un nombre DNS (etiquetas o puntero de compresión)."""
+    n = len(data)
+    while pos < n:
+        length = data[pos]
+        if length == 0:
+            return pos + 1
+        if length & 0xC0 == 0xC0:
+            return pos + 2
+        if length & 0xC0:
+            break
+        pos += 1 + length
+    raise ValueError("nombre DNS inválido")
+
+
+def _dns_question(data) -> bytes:
+    """Sección de pregunta (una sola) en minúsculas; ValueError si no es simple."""
+    if len(data) < 12 or data[4] != 0 or data[5] != 1:
+        raise ValueError("se espera una sola pregunta")
+    end = _dns_skip_name(data, 12) + 4
+    if end > len(data):
+        raise ValueError("pregunta DNS truncada")
+    return bytes(data[12:end]).lower()
+
+
+def _dns_ttls(data) -> list:
+    """(offset, ttl) de cada registro de la respuesta, salvo OPT (su TTL son flags EDNS)."""
+    qd, an, ns, ar = struct.unpack_from(">HHHH", data, 4)
+    pos = 12
+    for _ in range(qd):
+        pos = _dns_skip_name(data, pos) + 4
+    ttls = []
+    for _ in range(an + ns + ar):
+        pos = _dns_skip_name(data, pos)
+        rtype, _, ttl, rdlength = struct.unpack_from(">HHIH", data, pos)
+        if rtype != 41:
+            ttls.append((pos + 4, ttl))
+        pos += 10 + rdlength
+    if pos > len(data):
+        raise ValueError("respuesta DNS truncada")
+    return ttls
+
+
+class DnsForwarder:
+    """
+    Reenvío DNS compartido (--dns). Las consultas con FLAG_DNS de todos los
+    clientes salen por un único socket UDP hacia el resolver con el ID de
+    transacción reasignado; un solo hilo lee las respuestas y las devuelve al
+    cliente y conid de origen con su ID original.
+
+    Las respuestas NOERROR/NXDOMAIN se guardan en una caché LRU pequeña durante
+    su TTL (como máximo DNS_CACHE_MAX_TTL) y se sirven con los TTL descontados.
+
+    Quien consulta implementa dns_reply(conn_id, remote_ip, remote_port, payload),
+    que se llama desde el hilo del forwarder.
+    """
+
+    def __init__(self, host: str, port: int):
+        family, _, _, _, addr = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+        self.server = addr
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, DNS_SOCKET_BUFFER)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, DNS_SOCKET_BUFFER)
+        except OSError:
+            pass
+        # connect: solo se aceptan datagramas del resolver configurado.
+        self.sock.connect(addr)
+        self.sock.settimeout(1.0)
+        self._lock = threading.Lock()
+        # ID reasignado -> (ID original, clave de caché, destino, conn_id, ip, puerto, t).
+        # Orden de inserción = orden de envío: vencer DNS_TIMEOUT es O(1) por consulta.
+        self._pending: "OrderedDict[int, tuple]" = OrderedDict()
+        # clave -> (vence, respuesta, [(offset, ttl)], guardada)
+        self._cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self.queries = 0
+        self.cache_hits = 0
+        self.replies = 0
+        self.timeouts = 0
+        self.dropped = 0
+        self.errors = 0
+        self.thread = threading.Thread(target=self._run, name="dns", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stats(self) -> dict:
+        return {
+            "server": "%s:%s" % self.server[:2],
+            "queries": self.queries,
+            "cache_hits": self.cache_hits,
+            "replies": self.replies,
+            "timeouts": self.timeouts,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "pending": len(self._pending),
+            "cached": len(self._cache),
+        }
+
+    def query(self, data, sink, conn_id: int, remote_ip: bytes, remote_port: int) -> Optional[bytes]:
+        """
+        Envía una consulta al resolver. Si está en caché retorna la respuesta ya
+        lista (con el ID de la consulta) para que el llamador la entregue en su
+        propio hilo; si no, retorna None y la respuesta llegará por sink.dns_reply.
+        """
+        if len(data) < 12:
+            return None
+        try:
+            # Bit RD + pregunta: la respuesta depende de ambos.
+            key = bytes((data[2] & 1,)) + _dns_question(data)
+        except ValueError:
+            key = None
+        now = time.monotonic()
+        with self._lock:
+            self.queries += 1
+            if key is not None:
+                hit = self._cache.get(key)
+                if hit is not None:
+                    if now < hit[0]:
+                        self._cache.move_to_end(key)
+                        self.cache_hits += 1
+                    else:
+                        del self._cache[key]
+                        hit = None
+            else:
+                hit = None
+            if hit is None:
+                self._expire(now)
+                if len(self._pending) >= DNS_MAX_PENDING:
+                    self.dropped += 1
+                    return None
+                new_id = int.from_bytes(os.urandom(2), "big")
+                while new_id in self._pending:
+                    new_id = int.from_bytes(os.urandom(2), "big")
+                self._pending[new_id] = (bytes(data[:2]), key, sink, conn_id, remote_ip, remote_port, now)
+        if hit is not None:
+            _, stored, ttls, saved = hit
+            reply = bytearray(stored)
+            reply[:2] = data[:2]
+            elapsed = int(now - saved)
+            for offset, ttl in ttls:
+                struct.pack_into(">I", reply, offset, max(ttl - elapsed, 0))
+            return bytes(reply)
+        try:
+            self.sock.send(struct.pack(">H", new_id) + data[2:])
+        except OSError:
+            with self._lock:
+                self._pending.pop(new_id, None)
+                self.errors += 1
+        return None
+
+    def _expire(self, now: float):
+        """Descarta consultas sin respuesta tras DNS_TIMEOUT (con _lock tomado)."""
+        pending = self._pending
+        while pending:
+            new_id, entry = next(iter(pending.items()))
+            if now - entry[6] < DNS_TIMEOUT:
+                break
+            del pending[new_id]
+            self.timeouts += 1
+
+    def _store(self, key: bytes, reply: bytes, now: float):
+        # Solo NOERROR/NXDOMAIN completas (sin TC) con al menos un registro.
+        if reply[2] & 0x02 or reply[3] & 0x0F not in (0, 3):
+            return
+        try:
+            ttls = _dns_ttls(reply)
+        except (ValueError, struct.error):
+            return
+        if not ttls:
+            return
+        ttl = min(min(t for _, t in ttls), DNS_CACHE_MAX_TTL)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._cache[key] = (now + ttl, reply, ttls, now)
+            self._cache.move_to_end(key)
+            while len(self._cache) > DNS_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def _run(self):
+        buf = bytearray(65535)
+        view = memoryview(buf)
+        sock = self.sock
+        while True:
+            try:
+                n = sock.recv_into(buf)
+            except socket.timeout:
+                with self._lock:
+                    self._expire(time.monotonic())
+                continue
+            except OSError as e:
+                # ECONNREFUSED (ICMP) si el resolver no escucha: las consultas vencerán.
+                if sock.fileno() < 0:
+                    return
+                logging.debug("DNS %s: %s", self.server, e)
+                continue
+            if n < 12:
+                continue
+            with self._lock:
+                entry = self._pending.pop((buf[0] << 8) | buf[1], None)
+            if entry is None:
+                continue
+            orig_id, key, sink, conn_id, remote_ip, remote_port, _ = entry
+            if key is not None:
+                try:
+                    if _dns_question(view[:n]) != key[1:]:
+                        # No corresponde a la consulta (respuesta tardía o falsificada).
+                        continue
+                except ValueError:
+                    continue
+            reply = orig_id + bytes(view[2:n])
+            self.replies += 1
+            if key is not None:
+                self._store(key, reply, time.monotonic())
+            try:
+                sink.dns_reply(conn_id, remote_ip, remote_port, reply)
+            except Exception:
+                logging.exception("Error entregando respuesta DNS")
+
+
 class PortForward:
     """Mantiene un port forward UDP activo."""
 
@@ -147,41 +522,89 @@ class PortForward:
         remote_ip: bytes,
         remote_port: int,
         udp_socket: socket.socket,
-        client_conn: socket.socket,
-        write_lock: threading.Lock,
-        client_addr: str
+        writer: ClientWriter,
+        client_addr: str,
+        idle_timeout: float = 30.0,
+        on_closed=None
     ):
         self.conn_id = conn_id
         self.preamble_size = preamble_size
         self.remote_ip = remote_ip
         self.remote_port = remote_port
         self.udp_socket = udp_socket
-        self.client_conn = client_conn
-        self.write_lock = write_lock
+        self.writer = writer
         self.client_addr = client_addr
+        self.dest = (
+            socket.inet_ntop(
+                socket.AF_INET6 if len(remote_ip) == 16 else socket.AF_INET,
+                remote_ip
+            ),
+            remote_port
+        )
+        self.idle_timeout = idle_timeout
+        self.on_closed = on_closed
+        # Última actividad en cualquier sentido; decide el vencimiento y el LRU.
+        self.last_activity = time.monotonic()
+        self.stats = TrafficStats()
+        # Sus contadores ya se sumaron a los del cliente (ver UdpgwHandler._retire).
+        self.retired = False
         self._closed = False
         self.relay_thread: Optional[threading.Thread] = None
 
     def close(self):
+        """
+        Marca el port forward como cerrado y despierta a su hilo de relay, que es
+        quien cierra el socket. Cerrarlo desde otro hilo no despierta el recv
+        bloqueado (tampoco shutdown en UDP sin connect) y el número de fd podría
+        reutilizarse para otro flujo mientras el hilo viejo sigue esperando en él.
+        """
+        if self._closed:
+            return
         self._closed = True
+        if self.relay_thread is None or self.relay_thread is threading.current_thread():
+            self._close_socket()
+            return
+        try:
+            port = self.udp_socket.getsockname()[1]
+            loopback = "::1" if self.udp_socket.family == socket.AF_INET6 else "127.0.0.1"
+            self.udp_socket.sendto(b"", (loopback, port))
+        except OSError:
+            self._close_socket()
+
+    def _close_socket(self):
         try:
             self.udp_socket.close()
         except OSError:
             pass
 
     def relay_downstream(self):
-        """Lee paquetes UDP del destino y los envía al cliente."""
+        """Lee paquetes UDP del destino y los encola hacia el cliente."""
         buffer = bytearray(MAX_MESSAGE_SIZE)
-        packet_buffer = buffer[self.preamble_size:MAX_MESSAGE_SIZE]
+        # Vista, no copia: el payload debe quedar detrás del preámbulo en buffer.
+        packet_buffer = memoryview(buffer)[self.preamble_size:MAX_MESSAGE_SIZE]
+        stats = self.stats
         try:
             while not self._closed:
                 try:
                     size = self.udp_socket.recv_into(packet_buffer)
+                except socket.timeout:
+                    # Sin respuestas, pero el cliente puede seguir enviando: solo se
+                    # cierra si no hubo actividad en ningún sentido durante idle_timeout.
+                    idle = time.monotonic() - self.last_activity
+                    if idle >= self.idle_timeout:
+                        break
+                    try:
+                        self.udp_socket.settimeout(self.idle_timeout - idle)
+                    except OSError:
+                        break
+                    continue
                 except (OSError, ConnectionResetError):
                     break
                 if size <= 0:
                     break
+                self.last_activity = time.monotonic()
                 if size > MAX_PAYLOAD_SIZE:
+                    stats.oversize += 1
                     if logging.getLogger().level <= logging.DEBUG:
                         logging.debug("Paquete UDP descartado (size=%d > %d)", size, MAX_PAYLOAD_SIZE)
                     continue
@@ -190,13 +613,16 @@ class PortForward:
                     buffer, self.preamble_size, 0,
                     self.conn_id, self.remote_ip, self.remote_port, size
                 )
-                with self.write_lock:
-                    try:
-                        self.client_conn.sendall(buffer[:total])
-                    except (OSError, BrokenPipeError):
-                        break
+                if self.writer.failed:
+                    break
+                self.writer.put(bytes(buffer[:total]))
+                stats.down_packets += 1
+                stats.down_bytes += size
         finally:
-            self.close()
+            self._closed = True
+            self._close_socket()
+            if self.on_closed is not None:
+                self.on_closed(self)
 
 
 class UdpgwHandler:
@@ -208,99 +634,586 @@ class UdpgwHandler:
         self.config = config
         self.port_forwards: Dict[int, PortForward] = {}
         self.port_forwards_lock = threading.Lock()
-        self.write_lock = threading.Lock()
+        self.writer = ClientWriter(client_conn, config.get("client_queue", DEFAULT_CLIENT_QUEUE))
         self.last_activity = time.monotonic()
+        self.since = time.time()
+        # stats la escribe solo el hilo lector; retired acumula los port forwards
+        # cerrados (con port_forwards_lock).
+        self.stats = TrafficStats()
+        self.retired = TrafficStats()
+        # Respuestas de --dns: las cuenta solo el hilo del DnsForwarder.
+        self.dns_stats = TrafficStats()
+        self.dns: Optional[DnsForwarder] = config.get("dns_forwarder")
 
     def run(self):
-        buffer = bytearray(MAX_MESSAGE_SIZE)
+        reader = UdpgwReader()
+        self.writer.start()
         try:
             # Timeout para evitar bloqueo por clientes lentos o inactivos
             ct = self.config.get("client_timeout")
             if ct is not None:
                 self.client_conn.settimeout(ct)
             while True:
-                msg = read_udpgw_message(self.client_conn, buffer)
-                if msg is None:
+                try:
+                    if reader.fill(self.client_conn) == 0:
+                        break
+                except OSError:
                     break
                 self.last_activity = time.monotonic()
-
-                with self.port_forwards_lock:
-                    pf = self.port_forwards.get(msg.conn_id)
-
-                if pf is not None and (
-                    msg.discard_existing or
-                    pf.remote_ip != msg.remote_ip or
-                    pf.remote_port != msg.remote_port
-                ):
-                    pf.close()
-                    if pf.relay_thread and pf.relay_thread.is_alive():
-                        pf.relay_thread.join(timeout=2)
-                    with self.port_forwards_lock:
-                        self.port_forwards.pop(msg.conn_id, None)
-                    pf = None
-
-                if pf is None:
-                    # Respetar límite de conexiones por cliente
-                    max_conn = self.config.get("max_connections", 10)
-                    if len(self.port_forwards) >= max_conn:
-                        logging.warning("Cliente %s excede max_connections=%d (aumentar para juegos: Free Fire, etc.)", self.client_addr, max_conn)
-                        continue
-                    try:
-                        udp = socket.socket(
-                            socket.AF_INET6 if len(msg.remote_ip) == 16 else socket.AF_INET,
-                            socket.SOCK_DGRAM
-                        )
-                        udp.settimeout(self.config.get("udp_timeout", 30.0))
-                        # Buffer mayor para evitar pérdida en picos de tráfico
-                        ub = self.config.get("udp_buffer_size", 0)
-                        if ub > 0:
-                            try:
-                                udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, ub)
-                                udp.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, ub)
-                            except OSError:
-                                pass
-                    except (OSError, ValueError):
-                        continue
-
-                    pf = PortForward(
-                        msg.conn_id, msg.preamble_size,
-                        msg.remote_ip, msg.remote_port,
-                        udp, self.client_conn, self.write_lock, str(self.client_addr)
-                    )
-                    t = threading.Thread(target=pf.relay_downstream, daemon=True)
-                    pf.relay_thread = t
-                    with self.port_forwards_lock:
-                        self.port_forwards[msg.conn_id] = pf
-                    t.start()
-
                 try:
-                    pf.udp_socket.sendto(msg.packet, (
-                        socket.inet_ntop(
-                            socket.AF_INET6 if len(msg.remote_ip) == 16 else socket.AF_INET,
-                            msg.remote_ip
-                        ),
-                        msg.remote_port
-                    ))
-                except OSError:
-                    pf.close()
+                    for conn_id, flags, remote_ip, remote_port, packet, preamble_size in reader.messages():
+                        self._handle_message(conn_id, flags, remote_ip, remote_port, packet, preamble_size)
+                except ValueError:
+                    break
         finally:
+            # Sin join: cada hilo de relay termina solo al cerrarse su socket.
             with self.port_forwards_lock:
-                for pf in list(self.port_forwards.values()):
-                    pf.close()
-                    if pf.relay_thread and pf.relay_thread.is_alive():
-                        pf.relay_thread.join(timeout=2)
+                forwards = list(self.port_forwards.values())
                 self.port_forwards.clear()
+                for pf in forwards:
+                    self._retire(pf)
+            for pf in forwards:
+                pf.close()
+            self.writer.close()
+            w = self.writer
+            if w.dropped:
+                logging.info(
+                    "Cliente %s: %d mensajes descartados por cola llena (%d enviados en %d sendmsg)",
+                    self.client_addr, w.dropped, w.sent_frames, w.sendmsg_calls
+                )
+            if self.stats.cap_hits:
+                logging.info("Cliente %s: %d port-forwards reciclados por max_connections", self.client_addr, self.stats.cap_hits)
             try:
                 self.client_conn.close()
             except OSError:
                 pass
 
+    def traffic(self) -> Tuple[TrafficStats, int]:
+        """Contadores acumulados del cliente y número de port forwards activos."""
+        total = TrafficStats()
+        with self.port_forwards_lock:
+            total.add(self.retired)
+            forwards = [pf for pf in self.port_forwards.values() if not pf.retired]
+        total.add(self.stats)
+        total.add(self.dns_stats)
+        for pf in forwards:
+            total.add(pf.stats)
+        total.queue_drops = self.writer.dropped
+        return total, len(forwards)
+
+    def dns_reply(self, conn_id: int, remote_ip: bytes, remote_port: int, payload: bytes):
+        """Respuesta del DnsForwarder (su hilo): se encola como cualquier datagrama de bajada."""
+        if self.writer.failed:
+            return
+        self.writer.put(build_udpgw_frame(conn_id, remote_ip, remote_port, payload))
+        self.dns_stats.down_packets += 1
+        self.dns_stats.down_bytes += len(payload)
+
+    def _retire(self, pf: PortForward):
+        """Suma los contadores de un port forward cerrado (con port_forwards_lock)."""
+        if not pf.retired:
+            pf.retired = True
+            self.retired.add(pf.stats)
+
+    def _forward_closed(self, pf: PortForward):
+        """Llamado por el hilo de relay al terminar: libera su hueco en la tabla."""
+        with self.port_forwards_lock:
+            if self.port_forwards.get(pf.conn_id) is pf:
+                del self.port_forwards[pf.conn_id]
+            self._retire(pf)
+
+    def _evict_lru(self) -> bool:
+        """Cierra el port forward con actividad más antigua para dejar sitio a uno nuevo."""
+        with self.port_forwards_lock:
+            if not self.port_forwards:
+                return False
+            pf = min(self.port_forwards.values(), key=lambda f: f.last_activity)
+            del self.port_forwards[pf.conn_id]
+        if not self.stats.cap_hits:
+            logging.warning(
+                "Cliente %s alcanzó max_connections=%d: se reciclan los port-forwards menos usados (aumentar para juegos: Free Fire, etc.)",
+                self.client_addr, self.config.get("max_connections", 10)
+            )
+        self.stats.cap_hits += 1
+        pf.close()
+        return True
+
+    def _handle_message(self, conn_id, flags, remote_ip, remote_port, packet, preamble_size):
+        stats = self.stats
+        stats.up_packets += 1
+        stats.up_bytes += len(packet)
+        if flags & FLAG_DNS and self.dns is not None:
+            # Socket compartido del resolver en lugar de un port forward por consulta.
+            remote_ip = bytes(remote_ip)
+            reply = self.dns.query(packet, self, conn_id, remote_ip, remote_port)
+            if reply is not None:
+                self.writer.put(build_udpgw_frame(conn_id, remote_ip, remote_port, reply))
+                stats.down_packets += 1
+                stats.down_bytes += len(reply)
+            return
+        with self.port_forwards_lock:
+            pf = self.port_forwards.get(conn_id)
+
+        if pf is not None and (
+            pf._closed or
+            flags & FLAG_REBIND or
+            pf.remote_ip != remote_ip or
+            pf.remote_port != remote_port
+        ):
+            with self.port_forwards_lock:
+                if self.port_forwards.get(conn_id) is pf:
+                    del self.port_forwards[conn_id]
+            pf.close()
+            pf = None
+
+        if pf is None:
+            # Respetar límite de conexiones por cliente: al llenarse se recicla
+            # el menos usado en lugar de descartar el paquete nuevo.
+            max_conn = self.config.get("max_connections", 10)
+            while len(self.port_forwards) >= max_conn:
+                if not self._evict_lru():
+                    break
+            try:
+                udp = socket.socket(
+                    socket.AF_INET6 if len(remote_ip) == 16 else socket.AF_INET,
+                    socket.SOCK_DGRAM
+                )
+                # Puerto local fijo desde el inicio: PortForward.close lo usa para
+                # despertar al hilo de relay.
+                udp.bind(("::" if len(remote_ip) == 16 else "0.0.0.0", 0))
+                udp.settimeout(self.config.get("udp_timeout", 30.0))
+                # Buffer mayor para evitar pérdida en picos de tráfico
+                ub = self.config.get("udp_buffer_size", 0)
+                if ub > 0:
+                    try:
+                        udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, ub)
+                        udp.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, ub)
+                    except OSError:
+                        pass
+            except (OSError, ValueError):
+                stats.send_errors += 1
+                return
+
+            pf = PortForward(
+                conn_id, preamble_size,
+                bytes(remote_ip), remote_port,
+                udp, self.writer, str(self.client_addr),
+                self.config.get("udp_timeout", 30.0), self._forward_closed
+            )
+            t = threading.Thread(target=pf.relay_downstream, daemon=True)
+            pf.relay_thread = t
+            with self.port_forwards_lock:
+                self.port_forwards[conn_id] = pf
+            try:
+                t.start()
+            except RuntimeError:
+                # Sin recursos para otro hilo: el paquete se pierde, la sesión sigue.
+                logging.warning("Cliente %s: no se pudo crear hilo para port forward", self.client_addr)
+                pf.relay_thread = None
+                with self.port_forwards_lock:
+                    self.port_forwards.pop(conn_id, None)
+                pf.close()
+                stats.send_errors += 1
+                return
+
+        pf.last_activity = time.monotonic()
+        try:
+            pf.udp_socket.sendto(packet, pf.dest)
+        except OSError:
+            stats.send_errors += 1
+            pf.close()
+
+
+class ReactorPortForward:
+    """Port forward UDP del modo reactor: el socket lo atiende el Reactor, sin hilo propio."""
+
+    __slots__ = ("client", "conn_id", "preamble_size", "remote_ip", "remote_port",
+                 "udp_socket", "dest", "last_activity")
+
+    def __init__(self, client: "ReactorClient", conn_id: int, preamble_size: int,
+                 remote_ip: bytes, remote_port: int, udp_socket: socket.socket, now: float):
+        self.client = client
+        self.conn_id = conn_id
+        self.preamble_size = preamble_size
+        self.remote_ip = remote_ip
+        self.remote_port = remote_port
+        self.udp_socket = udp_socket
+        self.dest = (
+            socket.inet_ntop(
+                socket.AF_INET6 if len(remote_ip) == 16 else socket.AF_INET,
+                remote_ip
+            ),
+            remote_port
+        )
+        # Última actividad en cualquier sentido: se cierra tras udp_timeout sin tráfico.
+        self.last_activity = now
+
+
+class ReactorClient:
+    """Cliente TCP del modo reactor: buffers de entrada/salida y sus port forwards."""
+
+    __slots__ = ("reactor", "conn", "addr", "reader", "tx", "port_forwards", "last_activity",
+                 "writing", "closed", "since", "stats")
+
+    def __init__(self, reactor: "Reactor", conn: socket.socket, addr: Tuple, now: float):
+        self.reactor = reactor
+        self.conn = conn
+        self.addr = addr
+        self.reader = UdpgwReader()
+        self.tx = bytearray()
+        self.port_forwards: Dict[int, ReactorPortForward] = {}
+        self.last_activity = now
+        # EVENT_WRITE registrado (hay datos pendientes en tx).
+        self.writing = False
+        self.closed = False
+        self.since = time.time()
+        self.stats = TrafficStats()
+
+    def traffic(self) -> Tuple[TrafficStats, int]:
+        """Contadores del cliente y número de port forwards activos."""
+        return self.stats, len(self.port_forwards)
+
+    def dns_reply(self, conn_id: int, remote_ip: bytes, remote_port: int, payload: bytes):
+        """Respuesta del DnsForwarder (su hilo): la entrega el hilo del reactor."""
+        self.reactor.post_frame(self, build_udpgw_frame(conn_id, remote_ip, remote_port, payload), len(payload))
+
+
+class Reactor:
+    """
+    Bucle de eventos (selectors/epoll) que atiende clientes TCP y sus sockets UDP
+    sin un hilo por conexión. El hilo que acepta entrega clientes con add_client()
+    y el DnsForwarder sus respuestas con post_frame(); todo lo demás ocurre en el
+    hilo del reactor, así que no hacen falta locks.
+
+    Los port forwards y los clientes se guardan en OrderedDict por orden de última
+    actividad, así que vencer udp_timeout y client_timeout es O(1) por cierre.
+    """
+
+    def __init__(self, config: dict, on_client_opened, on_client_closed, name: str = "reactor"):
+        self.config = config
+        self._on_client_opened = on_client_opened
+        self._on_client_closed = on_client_closed
+        self._sel = selectors.DefaultSelector()
+        self._incoming: deque = deque()
+        self._frames: deque = deque()
+        self.dns: Optional[DnsForwarder] = config.get("dns_forwarder")
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._sel.register(self._wake_r, selectors.EVENT_READ, None)
+        self._clients: "OrderedDict[ReactorClient, None]" = OrderedDict()
+        self._forwards: "OrderedDict[ReactorPortForward, None]" = OrderedDict()
+        self._buffer = bytearray(MAX_MESSAGE_SIZE)
+        self._view = memoryview(self._buffer)
+        self._now = time.monotonic()
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def add_client(self, conn: socket.socket, addr: Tuple):
+        """Llamado desde el hilo que acepta: encola el cliente y despierta al reactor."""
+        self._incoming.append((conn, addr))
+        self._wakeup()
+
+    def post_frame(self, client: ReactorClient, frame: bytes, payload_size: int):
+        """Llamado desde otro hilo: encola un mensaje ya enmarcado hacia el cliente."""
+        self._frames.append((client, frame, payload_size))
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def run(self):
+        while True:
+            try:
+                events = self._sel.select(1.0)
+            except InterruptedError:
+                events = []
+            self._now = time.monotonic()
+            for key, mask in events:
+                obj = key.data
+                if obj is None:
+                    self._accept_incoming()
+                    self._deliver_frames()
+                elif obj.__class__ is ReactorPortForward:
+                    self._relay_downstream(obj)
+                else:
+                    if mask & selectors.EVENT_WRITE and not obj.closed:
+                        self._flush(obj)
+                    if mask & selectors.EVENT_READ and not obj.closed:
+                        self._read_client(obj)
+            self._expire()
+
+    def _accept_incoming(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        while self._incoming:
+            conn, addr = self._incoming.popleft()
+            try:
+                conn.setblocking(False)
+            except OSError:
+                conn.close()
+                self._on_client_closed(None)
+                continue
+            client = ReactorClient(self, conn, addr, self._now)
+            self._on_client_opened(client)
+            self._clients[client] = None
+            self._sel.register(conn, selectors.EVENT_READ, client)
+
+    def _deliver_frames(self):
+        while self._frames:
+            client, frame, payload_size = self._frames.popleft()
+            if not client.closed:
+                self._queue_frame(client, frame, payload_size)
+                if not client.writing:
+                    self._flush(client)
+
+    def _queue_frame(self, client: ReactorClient, frame: bytes, payload_size: int):
+        stats = client.stats
+        if len(client.tx) >= REACTOR_MAX_PENDING:
+            stats.queue_drops += 1
+            return
+        client.tx += frame
+        stats.down_packets += 1
+        stats.down_bytes += payload_size
+
+    def _expire(self):
+        now = self._now
+        ct = self.config.get("client_timeout")
+        if ct is not None:
+            while self._clients:
+                client = next(iter(self._clients))
+                if now - client.last_activity < ct:
+                    break
+                logging.debug("Cliente %s inactivo, se cierra", client.addr)
+                self._close_client(client)
+        ut = self.config.get("udp_timeout", 30.0)
+        while self._forwards:
+            pf = next(iter(self._forwards))
+            if now - pf.last_activity < ut:
+                break
+            self._close_forward(pf)
+
+    def _read_client(self, client: ReactorClient):
+        # Mismo lector que el modo hilos: recv_into sobre el buffer del cliente y
+        # mensajes como memoryview, sin copia ni objeto por paquete. Cada lectura
+        # se procesa antes de la siguiente (las vistas caducan con fill()).
+        reader = client.reader
+        read = False
+        for _ in range(REACTOR_RECV_BUDGET):
+            try:
+                n = reader.fill(client.conn)
+            except BlockingIOError:
+                break
+            except OSError:
+                self._close_client(client)
+                return
+            if not n:
+                self._close_client(client)
+                return
+            if not read:
+                read = True
+                client.last_activity = self._now
+                self._clients.move_to_end(client)
+            try:
+                for conn_id, flags, remote_ip, remote_port, packet, preamble_size in reader.messages():
+                    self._handle_message(client, conn_id, flags, remote_ip, remote_port, packet, preamble_size)
+                    if client.closed:
+                        return
+            except ValueError:
+                logging.debug("Mensaje inválido de %s, se cierra", client.addr)
+                self._close_client(client)
+                return
+            if reader.end < len(reader.buf):
+                # recv_into no llenó el buffer: el socket quedó vacío.
+                break
+
+    def _handle_message(self, client: ReactorClient, conn_id, flags, remote_ip, remote_port, packet, preamble_size):
+        stats = client.stats
+        stats.up_packets += 1
+        stats.up_bytes += len(packet)
+        if flags & FLAG_DNS and self.dns is not None:
+            # Socket compartido del resolver en lugar de un port forward por consulta.
+            remote_ip = bytes(remote_ip)
+            reply = self.dns.query(packet, client, conn_id, remote_ip, remote_port)
+            if reply is not None:
+                self._queue_frame(
+                    client, build_udpgw_frame(conn_id, remote_ip, remote_port, reply), len(reply)
+                )
+                if not client.writing:
+                    self._flush(client)
+            return
+        pf = client.port_forwards.get(conn_id)
+        if pf is not None and (
+            flags & FLAG_REBIND or
+            pf.remote_ip != remote_ip or
+            pf.remote_port != remote_port
+        ):
+            self._close_forward(pf)
+            pf = None
+
+        if pf is None:
+            # Respetar límite de conexiones por cliente: al llenarse se recicla
+            # el menos usado en lugar de descartar el paquete nuevo.
+            max_conn = self.config.get("max_connections", 10)
+            while len(client.port_forwards) >= max_conn:
+                lru = min(client.port_forwards.values(), key=lambda f: f.last_activity)
+                if not stats.cap_hits:
+                    logging.warning(
+                        "Cliente %s alcanzó max_connections=%d: se reciclan los port-forwards menos usados (aumentar para juegos: Free Fire, etc.)",
+                        client.addr, max_conn
+                    )
+                stats.cap_hits += 1
+                self._close_forward(lru)
+            try:
+                udp = socket.socket(
+                    socket.AF_INET6 if len(remote_ip) == 16 else socket.AF_INET,
+                    socket.SOCK_DGRAM
+                )
+                udp.setblocking(False)
+                # Buffer mayor para evitar pérdida en picos de tráfico
+                ub = self.config.get("udp_buffer_size", 0)
+                if ub > 0:
+                    try:
+                        udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, ub)
+                        udp.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, ub)
+                    except OSError:
+                        pass
+                pf = ReactorPortForward(
+                    client, conn_id, preamble_size, bytes(remote_ip), remote_port, udp, self._now
+                )
+            except (OSError, ValueError):
+                stats.send_errors += 1
+                return
+            self._sel.register(udp, selectors.EVENT_READ, pf)
+            client.port_forwards[conn_id] = pf
+            self._forwards[pf] = None
+        elif pf.last_activity != self._now:
+            pf.last_activity = self._now
+            self._forwards.move_to_end(pf)
+
+        try:
+            pf.udp_socket.sendto(packet, pf.dest)
+        except BlockingIOError:
+            stats.send_errors += 1
+        except OSError:
+            stats.send_errors += 1
+            self._close_forward(pf)
+
+    def _relay_downstream(self, pf: ReactorPortForward):
+        """Lee paquetes UDP del destino y los encola hacia el cliente."""
+        client = pf.client
+        if client.closed or pf.udp_socket.fileno() < 0:
+            return
+        stats = client.stats
+        buffer = self._buffer
+        packet_view = self._view[pf.preamble_size:MAX_MESSAGE_SIZE]
+        got = False
+        for _ in range(REACTOR_RECV_BUDGET):
+            try:
+                size = pf.udp_socket.recv_into(packet_view)
+            except BlockingIOError:
+                break
+            except OSError:
+                # p. ej. ECONNREFUSED por ICMP: el modo hilos también cierra aquí.
+                self._close_forward(pf)
+                return
+            got = True
+            if size > MAX_PAYLOAD_SIZE:
+                stats.oversize += 1
+                if logging.getLogger().level <= logging.DEBUG:
+                    logging.debug("Paquete UDP descartado (size=%d > %d)", size, MAX_PAYLOAD_SIZE)
+                continue
+            if len(client.tx) >= REACTOR_MAX_PENDING:
+                stats.queue_drops += 1
+                continue
+            total = write_udpgw_response(
+                buffer, pf.preamble_size, 0,
+                pf.conn_id, pf.remote_ip, pf.remote_port, size
+            )
+            client.tx += self._view[:total]
+            stats.down_packets += 1
+            stats.down_bytes += size
+        if got:
+            pf.last_activity = self._now
+            self._forwards.move_to_end(pf)
+            if not client.writing:
+                self._flush(client)
+
+    def _flush(self, client: ReactorClient):
+        tx = client.tx
+        try:
+            while tx:
+                n = client.conn.send(tx)
+                del tx[:n]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._close_client(client)
+            return
+        want_write = bool(tx)
+        if want_write != client.writing:
+            client.writing = want_write
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if want_write else 0)
+            self._sel.modify(client.conn, events, client)
+
+    def _close_forward(self, pf: ReactorPortForward):
+        self._forwards.pop(pf, None)
+        if pf.client.port_forwards.get(pf.conn_id) is pf:
+            del pf.client.port_forwards[pf.conn_id]
+        try:
+            self._sel.unregister(pf.udp_socket)
+        except (KeyError, ValueError):
+            pass
+        try:
+            pf.udp_socket.close()
+        except OSError:
+            pass
+
+    def _close_client(self, client: ReactorClient):
+        if client.closed:
+            return
+        client.closed = True
+        for pf in list(client.port_forwards.values()):
+            self._close_forward(pf)
+        self._clients.pop(client, None)
+        try:
+            self._sel.unregister(client.conn)
+        except (KeyError, ValueError):
+            pass
+        try:
+            client.conn.close()
+        except OSError:
+            pass
+        stats = client.stats
+        if stats.queue_drops:
+            logging.info("Cliente %s: %d datagramas descartados por cola TCP llena", client.addr, stats.queue_drops)
+        if stats.cap_hits:
+            logging.info("Cliente %s: %d port-forwards reciclados por max_connections", client.addr, stats.cap_hits)
+        self._on_client_closed(client)
+
 
 _shutdown = False
 _client_count = 0
 _total_connections = 0
+_rejected_total = 0
 _client_count_lock = threading.Lock()
-_last_stats_time = 0
+_started = time.time()
+# Clientes activos (UdpgwHandler o ReactorClient) y contadores de los ya cerrados.
+_clients: Dict[int, object] = {}
+_closed_traffic = TrafficStats()
+_dns: Optional[DnsForwarder] = None
+# --processes: clientes activos por hijo en memoria compartida (el límite
+# --max-clients es la suma) y posición de este proceso en el array.
+_budget = None
+_worker_slot = 0
 
 
 def _signal_handler(signum, frame):
@@ -308,9 +1221,376 @@ def _signal_handler(signum, frame):
     _shutdown = True
 
 
+def client_opened(client):
+    with _client_count_lock:
+        _clients[id(client)] = client
+
+
+def client_closed(client=None):
+    global _client_count
+    traffic = client.traffic()[0] if client is not None else None
+    with _client_count_lock:
+        _client_count -= 1
+        if client is not None and _clients.pop(id(client), None) is not None:
+            _closed_traffic.add(traffic)
+    if _budget is not None:
+        with _budget.get_lock():
+            _budget.get_obj()[_worker_slot] -= 1
+
+
+def _take_client_slot(max_clients: int) -> bool:
+    """Reserva un hueco de --max-clients (con _client_count_lock tomado)."""
+    if _budget is None:
+        return _client_count < max_clients
+    with _budget.get_lock():
+        counts = _budget.get_obj()
+        if sum(counts) >= max_clients:
+            return False
+        counts[_worker_slot] += 1
+    return True
+
+
+def stats_snapshot(mode: str) -> dict:
+    """Estadísticas globales y por cliente (los clientes cerrados solo suman al total)."""
+    with _client_count_lock:
+        clients = list(_clients.values())
+        totals = TrafficStats()
+        totals.add(_closed_traffic)
+        active, total_conn, rejected = _client_count, _total_connections, _rejected_total
+    rows = []
+    forwards = 0
+    for client in clients:
+        traffic, n = client.traffic()
+        totals.add(traffic)
+        forwards += n
+        addr = client.client_addr if isinstance(client, UdpgwHandler) else client.addr
+        row = {"addr": "%s:%s" % (addr[0], addr[1]), "since": round(client.since, 3), "forwards": n}
+        row.update(traffic.as_dict())
+        rows.append(row)
+    rows.sort(key=lambda r: r["up_bytes"] + r["down_bytes"], reverse=True)
+    now = time.time()
+    return {
+        "time": round(now, 3),
+        "uptime": round(now - _started, 3),
+        "mode": mode,
+        "threads": threading.active_count(),
+        "clients_active": active,
+        "clients_total": total_conn,
+        "clients_rejected": rejected,
+        "forwards": forwards,
+        "totals": totals.as_dict(),
+        "dns": _dns.stats() if _dns is not None else None,
+        "clients": rows,
+    }
+
+
+def write_json_atomic(path: str, data: dict):
+    """Escribe JSON vía archivo temporal + rename: quien lee nunca ve un archivo a medias."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+        f.write("\n")
+    os.replace(tmp, path)
+
+
+def _log_stats(snap: dict):
+    t = snap["totals"]
+    logging.info(
+        "Stats: activos=%d total=%d port-forwards=%d hilos=%d "
+        "subida=%d/%dB bajada=%d/%dB descartados=%d grandes=%d reciclados=%d errores=%d",
+        snap["clients_active"], snap["clients_total"], snap["forwards"], snap["threads"],
+        t["up_packets"], t["up_bytes"], t["down_packets"], t["down_bytes"],
+        t["queue_drops"], t["oversize"], t["cap_hits"], t["send_errors"]
+    )
+
+
+def _stats_loop(mode: str, interval: int, log_interval: int, path: Optional[str],
+                report_fd: Optional[int] = None):
+    """
+    Hilo de estadísticas: línea de log cada log_interval y snapshot JSON en path.
+    En un hijo de --processes solo envía el snapshot al padre por report_fd.
+    """
+    last_log = time.monotonic()
+    while not _shutdown:
+        time.sleep(interval)
+        snap = stats_snapshot(mode)
+        if report_fd is not None:
+            data = json.dumps(snap, separators=(",", ":")).encode() + b"\n"
+            try:
+                while data:
+                    data = data[os.write(report_fd, data):]
+            except OSError:
+                return
+            continue
+        if path:
+            try:
+                write_json_atomic(path, snap)
+            except OSError as e:
+                logging.warning("No se pudo escribir %s: %s", path, e)
+        now = time.monotonic()
+        if log_interval > 0 and now - last_log >= log_interval - 0.5:
+            last_log = now
+            _log_stats(snap)
+
+
+class _StatsHTTPHandler(BaseHTTPRequestHandler):
+    """GET / o /stats: snapshot JSON que da server.snapshot()."""
+
+    # Un cliente HTTP lento no retiene al servidor de estadísticas.
+    timeout = 5
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/stats"):
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.snapshot(), separators=(",", ":")).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("HTTP stats %s: " + format, self.client_address[0], *args)
+
+
+def _start_stats_http(addr: str, mode: str) -> ThreadingHTTPServer:
+    host, port_str = addr.rsplit(":", 1)
+    httpd = ThreadingHTTPServer((host.strip("[]"), int(port_str)), _StatsHTTPHandler)
+    httpd.daemon_threads = True
+    httpd.snapshot = lambda: stats_snapshot(mode)
+    threading.Thread(target=httpd.serve_forever, name="stats-http", daemon=True).start()
+    return httpd
+
+
+class Prefork:
+    """
+    Proceso padre de --processes: crea el socket de escucha y lanza N hijos con
+    fork que aceptan sobre él con el bucle normal (_serve), cada uno con su GIL.
+    --max-clients se reparte entre todos con un contador por hijo en memoria
+    compartida. Los hijos que mueren se relanzan.
+
+    Cada hijo envía su snapshot de estadísticas como una línea JSON por un pipe;
+    el padre guarda el último de cada uno y se encarga del log, --stats-file y
+    --stats-http con el agregado. El padre no crea hilos (se sigue haciendo fork).
+    """
+
+    def __init__(self, args, config: dict, server: socket.socket):
+        self.args = args
+        self.config = config
+        self.server = server
+        self.n = args.processes
+        self.budget = multiprocessing.get_context("fork").Array("i", self.n)
+        self._sel = selectors.DefaultSelector()
+        # hijo -> (pid, inicio, lectura del pipe)
+        self._workers: Dict[int, Tuple[int, float, int]] = {}
+        self._bufs: Dict[int, bytes] = {}
+        self._latest: Dict[int, dict] = {}
+        # Contadores acumulados de hijos que ya terminaron.
+        self._retired = {"clients_total": 0, "clients_rejected": 0, "totals": TrafficStats().as_dict()}
+        self._httpd: Optional[HTTPServer] = None
+        self._stopping = False
+        self._failed = False
+        self.restarts = 0
+
+    def run(self) -> int:
+        args = self.args
+        if args.stats_http:
+            try:
+                host, port_str = args.stats_http.rsplit(":", 1)
+                self._httpd = HTTPServer((host.strip("[]"), int(port_str)), _StatsHTTPHandler)
+            except (OSError, ValueError) as e:
+                logging.error("No se pudo abrir --stats-http %s: %s", args.stats_http, e)
+                return 1
+            self._httpd.snapshot = self.snapshot
+            self._httpd.timeout = 0
+            self._sel.register(self._httpd.socket, selectors.EVENT_READ, "http")
+            logging.info("Estadísticas HTTP en http://%s/stats", args.stats_http)
+        for slot in range(self.n):
+            self._spawn(slot)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        logging.info("Prefork: %d procesos aceptando en %s", self.n, args.listen_addr)
+
+        log_interval = args.stats_interval if args.loglevel != "none" else 0
+        interval = args.stats_interval or DEFAULT_STATS_FILE_INTERVAL
+        next_stats = time.monotonic() + interval
+        while not self._stopping:
+            try:
+                events = self._sel.select(1.0)
+            except InterruptedError:
+                events = []
+            for key, _ in events:
+                if key.data == "http":
+                    self._httpd.handle_request()
+                else:
+                    self._read_report(key.data, key.fd)
+            self._reap()
+            now = time.monotonic()
+            if (log_interval > 0 or args.stats_file) and now >= next_stats:
+                next_stats = now + interval
+                snap = self.snapshot()
+                if args.stats_file:
+                    try:
+                        write_json_atomic(args.stats_file, snap)
+                    except OSError as e:
+                        logging.warning("No se pudo escribir %s: %s", args.stats_file, e)
+                if log_interval > 0:
+                    _log_stats(snap)
+
+        for pid, _, _ in self._workers.values():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid, _, _ in self._workers.values():
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.server.close()
+        if self._httpd is not None:
+            self._httpd.server_close()
+        return 1 if self._failed else 0
+
+    def _on_stop(self, *_):
+        self._stopping = True
+
+    def _spawn(self, slot: int):
+        with self.budget.get_lock():
+            self.budget.get_obj()[slot] = 0
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # El hijo no debe volver nunca al bucle del padre.
+            code = 0
+            try:
+                os.close(r)
+                self._worker_main(slot, w)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                logging.exception("Proceso %d", slot)
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        os.close(w)
+        os.set_blocking(r, False)
+        self._sel.register(r, selectors.EVENT_READ, slot)
+        self._workers[slot] = (pid, time.monotonic(), r)
+        self._bufs[slot] = b""
+
+    def _worker_main(self, slot: int, wfd: int):
+        global _budget, _worker_slot
+        # El selector, los pipes de lectura y el HTTP son del padre.
+        self._sel.close()
+        for _, _, rfd in self._workers.values():
+            os.close(rfd)
+        if self._httpd is not None:
+            self._httpd.server_close()
+        _budget = self.budget
+        _worker_slot = slot
+        args = self.args
+        report = args.stats_interval > 0 or args.stats_file or args.stats_http
+        _serve(args, self.config, self.server, report_fd=wfd if report else None)
+
+    def _read_report(self, slot: int, fd: int):
+        try:
+            chunk = os.read(fd, 1 << 20)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b""
+        if not chunk:
+            self._sel.unregister(fd)
+            return
+        buf = self._bufs.get(slot, b"") + chunk
+        *lines, buf = buf.split(b"\n")
+        self._bufs[slot] = buf
+        if lines:
+            try:
+                self._latest[slot] = json.loads(lines[-1])
+            except ValueError:
+                pass
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            for slot, (wpid, started, rfd) in list(self._workers.items()):
+                if wpid != pid:
+                    continue
+                try:
+                    self._sel.unregister(rfd)
+                except (KeyError, ValueError):
+                    pass
+                os.close(rfd)
+                del self._workers[slot]
+                last = self._latest.pop(slot, None)
+                if last is not None:
+                    self._retired["clients_total"] += last["clients_total"]
+                    self._retired["clients_rejected"] += last["clients_rejected"]
+                    for k, v in last["totals"].items():
+                        self._retired["totals"][k] += v
+                if self._stopping:
+                    break
+                code = os.waitstatus_to_exitcode(status)
+                if time.monotonic() - started < PREFORK_MIN_UPTIME:
+                    logging.error("Proceso %d terminó al arrancar (código %s); se detiene todo", slot, code)
+                    self._failed = True
+                    self._stopping = True
+                else:
+                    logging.warning("Proceso %d (pid %d) terminó (código %s); se relanza", slot, pid, code)
+                    self.restarts += 1
+                    self._spawn(slot)
+                break
+
+    def snapshot(self) -> dict:
+        """Suma de los últimos snapshots de cada hijo (más lo acumulado por hijos ya terminados)."""
+        now = time.time()
+        snap = {
+            "time": round(now, 3),
+            "uptime": round(now - _started, 3),
+            "mode": self.args.mode,
+            "processes": len(self._workers),
+            "restarts": self.restarts,
+            "threads": 0,
+            "clients_active": 0,
+            "clients_total": self._retired["clients_total"],
+            "clients_rejected": self._retired["clients_rejected"],
+            "forwards": 0,
+            "totals": dict(self._retired["totals"]),
+            "dns": None,
+            "clients": [],
+        }
+        for slot, st in sorted(self._latest.items()):
+            for k in ("threads", "clients_active", "clients_total", "clients_rejected", "forwards"):
+                snap[k] += st[k]
+            for k, v in st["totals"].items():
+                snap["totals"][k] += v
+            if st.get("dns"):
+                # Un socket por proceso: se suman los contadores.
+                dns = snap["dns"] or {"server": st["dns"]["server"]}
+                for k, v in st["dns"].items():
+                    if k != "server":
+                        dns[k] = dns.get(k, 0) + v
+                snap["dns"] = dns
+            for row in st["clients"]:
+                row["process"] = slot
+                snap["clients"].append(row)
+        snap["clients"].sort(key=lambda r: r["up_bytes"] + r["down_bytes"], reverse=True)
+        return snap
+
+
 def main():
     import argparse
-    global _shutdown, _client_count, _total_connections, _last_stats_time
     parser = argparse.ArgumentParser(description="UDPGW Server en Python")
     parser.add_argument("--listen-addr", default="127.0.0.1:8443", help="Dirección:puerto para escuchar")
     parser.add_argument("--loglevel", default="error", choices=["debug", "info", "warning", "error", "none"])
@@ -322,6 +1602,11 @@ def main():
                         help="Timeout en socket UDP para respuestas (segundos)")
     parser.add_argument("--stats-interval", type=int, default=0,
                         help="Intervalo en segundos para mostrar estadísticas (0=desactivado)")
+    parser.add_argument("--stats-file", metavar="RUTA",
+                        help="Escribir estadísticas globales y por cliente en JSON cada --stats-interval "
+                             f"(o cada {DEFAULT_STATS_FILE_INTERVAL} s si no se indica)")
+    parser.add_argument("--stats-http", metavar="HOST:PUERTO",
+                        help="Servir las mismas estadísticas por HTTP (GET /stats), p. ej. 127.0.0.1:9100")
     parser.add_argument("--tcp-buffer", type=int, default=DEFAULT_TCP_BUFFER,
                         help="Buffer TCP en bytes (0=default del SO). Recomendado: 262144")
     parser.add_argument("--udp-buffer", type=int, default=DEFAULT_UDP_BUFFER,
@@ -330,7 +1615,27 @@ def main():
                         help="Desactivar TCP_NODELAY (Nagle). Por defecto está activo para menor latencia")
     parser.add_argument("--no-keepalive", action="store_true",
                         help="Desactivar TCP keepalive (detección de conexiones muertas)")
+    parser.add_argument("--client-queue", type=int, default=DEFAULT_CLIENT_QUEUE,
+                        help="Mensajes pendientes por cliente en modo hilos; al llenarse se descarta el más antiguo")
+    parser.add_argument("--dns", metavar="HOST:PUERTO",
+                        help="Enviar las consultas DNS (FLAG_DNS) de todos los clientes a este resolver "
+                             "por un socket compartido, con caché por TTL")
+    parser.add_argument("--mode", default="threads", choices=["threads", "reactor"],
+                        help="threads: un hilo por cliente y por port forward; "
+                             "reactor: bucles epoll con número fijo de hilos")
+    parser.add_argument("--reactor-threads", type=int, default=1,
+                        help="Hilos de bucle de eventos en --mode reactor (default: 1)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Procesos que aceptan clientes sobre el mismo socket (prefork), cada uno "
+                             "con su GIL; --max-clients es el total entre todos (default: 1)")
     args = parser.parse_args()
+    if args.processes < 1:
+        parser.error("--processes debe ser >= 1")
+    if args.dns:
+        try:
+            int(args.dns.rsplit(":", 1)[1])
+        except (IndexError, ValueError):
+            parser.error(f"--dns {args.dns}: se espera HOST:PUERTO")
 
     if args.loglevel != "none":
         logging.basicConfig(
@@ -352,11 +1657,9 @@ def main():
         "udp_buffer_size": args.udp_buffer,
         "tcp_nodelay": not args.no_tcp_nodelay,
         "tcp_keepalive": not args.no_keepalive,
+        "client_queue": args.client_queue,
     }
 
-    signal.signal(signal.SIGTERM, _signal_handler)
-    signal.signal(signal.SIGINT, _signal_handler)
-
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     sb = args.tcp_buffer
@@ -371,20 +1674,65 @@ def main():
     if args.loglevel != "none":
         logging.info("UDPGW Server escuchando en %s:%d", host, port)
 
-    stats_interval = args.stats_interval
-    _last_stats_time = time.monotonic()
+    if args.processes > 1:
+        code = Prefork(args, config, server).run()
+        if args.loglevel != "none":
+            logging.info("Servidor detenido correctamente (SIGTERM/SIGINT)")
+        sys.exit(code)
+    _serve(args, config, server)
+
+
+def _serve(args, config: dict, server: socket.socket, report_fd: Optional[int] = None):
+    """Bucle de accept de un proceso (el único, o cada hijo de --processes)."""
+    global _client_count, _total_connections, _rejected_total, _dns
+    signal.signal(signal.SIGTERM, _signal_handler)
+    signal.signal(signal.SIGINT, _signal_handler)
+
+    if args.dns:
+        dns_host, dns_port = args.dns.rsplit(":", 1)
+        try:
+            _dns = DnsForwarder(dns_host.strip("[]"), int(dns_port))
+        except OSError as e:
+            logging.error("--dns %s: %s", args.dns, e)
+            sys.exit(1)
+        _dns.start()
+        config["dns_forwarder"] = _dns
+
+    reactors = []
+    if args.mode == "reactor":
+        for i in range(max(1, args.reactor_threads)):
+            r = Reactor(config, client_opened, client_closed, name=f"reactor-{i}")
+            r.start()
+            reactors.append(r)
+    next_reactor = 0
+
+    if args.loglevel != "none" and _worker_slot == 0:
+        if reactors:
+            logging.info("Modo reactor: %d hilos de eventos", len(reactors))
+        if _dns is not None:
+            logging.info("DNS de los clientes vía %s:%s (socket compartido)", *_dns.server[:2])
+
+    log_interval = args.stats_interval if args.loglevel != "none" else 0
+    if log_interval > 0 or args.stats_file or report_fd is not None:
+        interval = args.stats_interval or DEFAULT_STATS_FILE_INTERVAL
+        threading.Thread(
+            target=_stats_loop, args=(args.mode, interval, log_interval, args.stats_file, report_fd),
+            name="stats", daemon=True
+        ).start()
+    httpd = None
+    if args.stats_http and report_fd is None and _budget is None:
+        try:
+            httpd = _start_stats_http(args.stats_http, args.mode)
+        except (OSError, ValueError) as e:
+            logging.error("No se pudo abrir --stats-http %s: %s", args.stats_http, e)
+            sys.exit(1)
+        logging.info("Estadísticas HTTP en http://%s/stats", args.stats_http)
+
     while not _shutdown:
         try:
             server.settimeout(1.0)  # Permite revisar _shutdown cada segundo
             conn, addr = server.accept()
         except socket.timeout:
-            # Estadísticas periódicas
-            if stats_interval > 0 and args.loglevel != "none":
-                now = time.monotonic()
-                if now - _last_stats_time >= stats_interval:
-                    _last_stats_time = now
-                    with _client_count_lock:
-                        logging.info("Stats: activos=%d total=%d", _client_count, _total_connections)
             continue
         except OSError as e:
             if _shutdown:
@@ -394,7 +1742,8 @@ def main():
             continue
 
         with _client_count_lock:
-            if _client_count >= args.max_clients:
+            if not _take_client_slot(args.max_clients):
+                _rejected_total += 1
                 if args.loglevel != "none":
                     logging.warning("Max clientes (%d) alcanzado, rechazando %s", args.max_clients, addr)
                 try:
@@ -418,20 +1767,26 @@ def main():
             for h in logging.root.handlers:
                 h.flush()
 
+        if reactors:
+            reactors[next_reactor].add_client(conn, addr)
+            next_reactor = (next_reactor + 1) % len(reactors)
+            continue
+
         def run_and_decrement():
-            global _client_count
+            handler = UdpgwHandler(conn, addr, config)
+            client_opened(handler)
             try:
-                handler = UdpgwHandler(conn, addr, config)
                 handler.run()
             finally:
-                with _client_count_lock:
-                    _client_count -= 1
+                client_closed(handler)
 
         t = threading.Thread(target=run_and_decrement, daemon=True)
         t.start()
 
     server.close()
-    if args.loglevel != "none":
+    if httpd is not None:
+        httpd.shutdown()
+    if args.loglevel != "none" and _budget is None:
         logging.info("Servidor detenido correctamente (SIGTERM/SIGINT)")
 
 
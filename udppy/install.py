@@ -174,13 +174,21 @@ def check_project_modules() -> bool:
     root = _root()
     if str(root) not in sys.path:
         sys.path.insert(0, str(root))
-    for name in ("udppy_proto", "linux_tune", "udppy_server"):
+    for name in (
+        "udppy_proto",
+        "linux_tune",
+        "udppy_metrics",
+        "udppy_log",
+        "udppy_capture",
+        "udppy_admin",
+        "udppy_server",
+    ):
         try:
             __import__(name)
         except ImportError as e:
             _fail(f"import {name}: {e}")
             return False
-    _ok("udppy_proto, linux_tune, udppy_server")
+    _ok("udppy_proto, linux_tune, udppy_metrics, udppy_log, udppy_capture, udppy_admin, udppy_server")
     return True
 
 
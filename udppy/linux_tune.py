@@ -2,21 +2,161 @@
 Ajustes opcionales de sockets para Linux (AlmaLinux, RHEL, Fedora, etc.):
 menor latencia en el túnel TCP y buffers más amplios para muchos datagramas UDP.
 
+Los tamaños de buffer se adaptan a los límites del kernel (net.core.rmem_max /
+wmem_max, leídos una vez en init()) y, en los clientes TCP, al producto
+ancho de banda × RTT medido con TCP_INFO (adapt_tcp_client()).
+
 No tiene efecto en Windows u otros sistemas.
 """
 
 from __future__ import annotations
 
+import logging
+import os
 import socket
+import struct
 import sys
+from typing import NamedTuple, Optional
 
 _TCP_QUICKACK = getattr(socket, "TCP_QUICKACK", 12)
+_TCP_INFO = getattr(socket, "TCP_INFO", 11)
+_SO_RCVBUFFORCE = getattr(socket, "SO_RCVBUFFORCE", 33)
+_SO_SNDBUFFORCE = getattr(socket, "SO_SNDBUFFORCE", 32)
+# ioctl de cola de envío (linux/sockios.h): SIOCOUTQNSD = bytes aún no enviados;
+# SIOCOUTQ (= TIOCOUTQ) = no enviados + enviados sin ACK.
+_SIOCOUTQNSD = 0x894B
+_SIOCOUTQ = 0x5411
+_SO_PRIORITY = getattr(socket, "SO_PRIORITY", 12)
+_IP_TOS = getattr(socket, "IP_TOS", 1)
+_IPV6_TCLASS = getattr(socket, "IPV6_TCLASS", 67)
+
+# Clases DSCP (RFC 2474/2597/3246) -> valor de 6 bits.
+DSCP_CLASSES = {
+    "CS0": 0, "CS1": 8, "CS2": 16, "CS3": 24, "CS4": 32, "CS5": 40, "CS6": 48, "CS7": 56,
+    "AF11": 10, "AF12": 12, "AF13": 14,
+    "AF21": 18, "AF22": 20, "AF23": 22,
+    "AF31": 26, "AF32": 28, "AF33": 30,
+    "AF41": 34, "AF42": 36, "AF43": 38,
+    "EF": 46,
+}
+
+# Tamaño inicial de los buffers (antes 4 MB fijos para todos los sockets).
+TCP_CLIENT_BUF = 1024 * 1024
+UDP_RELAY_BUF = 1024 * 1024
+# Límites del ajuste adaptativo de SO_SNDBUF en clientes TCP.
+TCP_SNDBUF_MIN = 64 * 1024
+TCP_SNDBUF_MAX = 8 * 1024 * 1024
+# Marca de agua de escritura (bytes en el transporte asyncio antes de drain()).
+DRAIN_WATERMARK_MIN = 16 * 1024
+DRAIN_WATERMARK_MAX = 1024 * 1024
+# Solo se reajusta SO_SNDBUF si el objetivo difiere más de este factor.
+_RESIZE_HYSTERESIS = 1.25
+
+# struct tcp_info (linux/tcp.h) hasta tcpi_delivery_rate: 8 u8, 24 u32,
+# 4 u64, 6 u32, 1 u64. Kernels antiguos devuelven menos bytes (se rellena con 0).
+_TCP_INFO_FMT = struct.Struct("<8B24I4Q6IQ")
+
+_rmem_max: Optional[int] = None
+_wmem_max: Optional[int] = None
+_force = False
+
+
+class TcpInfo(NamedTuple):
+    rtt_us: int
+    rttvar_us: int
+    snd_mss: int
+    snd_cwnd: int
+    unacked: int
+    total_retrans: int
+    notsent_bytes: int
+    delivery_rate: int  # bytes/s (0 si el kernel no lo informa)
+
+    def throughput(self) -> float:
+        """Bytes/s estimados: delivery_rate o, si falta, cwnd·mss/RTT."""
+        if self.delivery_rate:
+            return float(self.delivery_rate)
+        if self.rtt_us:
+            return self.snd_cwnd * self.snd_mss * 1_000_000 / self.rtt_us
+        return 0.0
+
+    def bdp(self) -> int:
+        """Producto ancho de banda × retardo (bytes)."""
+        return int(self.throughput() * self.rtt_us / 1_000_000)
 
 
 def is_linux() -> bool:
     return sys.platform.startswith("linux")
 
 
+def _read_proc_int(path: str) -> Optional[int]:
+    try:
+        with open(path, encoding="ascii") as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def init(*, force_buffers: bool = False) -> dict:
+    """
+    Lee net.core.{r,w}mem_max una sola vez y devuelve los tamaños efectivos que
+    obtendrán los sockets. Con force_buffers y root se usa SO_*BUFFORCE, que
+    ignora esos límites.
+    """
+    global _rmem_max, _wmem_max, _force
+    _rmem_max = _read_proc_int("/proc/sys/net/core/rmem_max")
+    _wmem_max = _read_proc_int("/proc/sys/net/core/wmem_max")
+    _force = False
+    if force_buffers:
+        try:
+            _force = os.geteuid() == 0
+        except AttributeError:
+            _force = False
+        if not _force:
+            logging.warning("linux_tune: SO_RCVBUFFORCE requiere root; se usan límites del kernel")
+    report = {
+        "rmem_max": _rmem_max,
+        "wmem_max": _wmem_max,
+        "force": _force,
+    }
+    for kind, fam, size in (
+        ("tcp", socket.SOCK_STREAM, TCP_CLIENT_BUF),
+        ("udp", socket.SOCK_DGRAM, UDP_RELAY_BUF),
+    ):
+        try:
+            with socket.socket(socket.AF_INET, fam) as s:
+                report[f"{kind}_rcvbuf"] = set_rcvbuf(s, size)
+                report[f"{kind}_sndbuf"] = set_sndbuf(s, size)
+        except OSError:
+            pass
+    return report
+
+
+def _limit(size: int, kmax: Optional[int]) -> int:
+    if _force or kmax is None:
+        return size
+    return min(size, kmax)
+
+
+def _set_buf(sock: socket.socket, opt: int, force_opt: int, size: int) -> int:
+    """Aplica el tamaño y devuelve el valor efectivo (getsockopt; el kernel lo duplica)."""
+    if _force:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, force_opt, size)
+        except OSError:
+            sock.setsockopt(socket.SOL_SOCKET, opt, size)
+    else:
+        sock.setsockopt(socket.SOL_SOCKET, opt, size)
+    return sock.getsockopt(socket.SOL_SOCKET, opt)
+
+
+def set_rcvbuf(sock: socket.socket, size: int) -> int:
+    return _set_buf(sock, socket.SO_RCVBUF, _SO_RCVBUFFORCE, _limit(size, _rmem_max))
+
+
+def set_sndbuf(sock: socket.socket, size: int) -> int:
+    return _set_buf(sock, socket.SO_SNDBUF, _SO_SNDBUFFORCE, _limit(size, _wmem_max))
+
+
 def tune_tcp_client_for_udppy(sock: socket.socket) -> None:
     """Conexión TCP hacia tun2socks (udppy): paquetes pequeños, ida y vuelta frecuente."""
     if not is_linux():
@@ -30,9 +170,8 @@ def tune_tcp_client_for_udppy(sock: socket.socket) -> None:
     except OSError:
         pass
     try:
-        size = 4 * 1024 * 1024
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, size)
+        set_rcvbuf(sock, TCP_CLIENT_BUF)
+        set_sndbuf(sock, TCP_CLIENT_BUF)
     except OSError:
         pass
 
@@ -42,8 +181,176 @@ def tune_udp_relay_socket(sock: socket.socket) -> None:
     if not is_linux():
         return
     try:
-        size = 4 * 1024 * 1024
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, size)
+        set_rcvbuf(sock, UDP_RELAY_BUF)
+        set_sndbuf(sock, UDP_RELAY_BUF)
+    except OSError:
+        pass
+
+
+def tcp_info(sock: socket.socket) -> Optional[TcpInfo]:
+    """Lee TCP_INFO del socket (None si no está disponible)."""
+    if not is_linux():
+        return None
+    try:
+        raw = sock.getsockopt(socket.IPPROTO_TCP, _TCP_INFO, _TCP_INFO_FMT.size)
+    except OSError:
+        return None
+    if len(raw) < _TCP_INFO_FMT.size:
+        raw = raw + bytes(_TCP_INFO_FMT.size - len(raw))
+    v = _TCP_INFO_FMT.unpack(raw)
+    u32 = v[8:32]
+    return TcpInfo(
+        rtt_us=u32[15],
+        rttvar_us=u32[16],
+        snd_mss=u32[2],
+        snd_cwnd=u32[18],
+        unacked=u32[4],
+        total_retrans=u32[23],
+        notsent_bytes=v[38],
+        delivery_rate=v[42],
+    )
+
+
+def send_queue_bytes(sock: socket.socket) -> Optional[int]:
+    """Bytes pendientes en la cola de envío del kernel (no enviados; None si no se puede leer)."""
+    if not is_linux():
+        return None
+    try:
+        import fcntl
+    except ImportError:
+        return None
+    fd = sock.fileno()
+    if fd < 0:
+        return None
+    for req in (_SIOCOUTQNSD, _SIOCOUTQ):
+        try:
+            buf = fcntl.ioctl(fd, req, b"\0\0\0\0")
+        except OSError:
+            continue
+        return struct.unpack("i", buf)[0]
+    return None
+
+
+class TrafficClass(NamedTuple):
+    name: str
+    dscp: int
+    priority: int  # SO_PRIORITY (0-6 sin CAP_NET_ADMIN)
+
+
+class MarkingRule(NamedTuple):
+    """Regla de marcado: tráfico DNS (dns=True) o rango de puertos destino."""
+
+    dns: bool
+    port_lo: int
+    port_hi: int
+    tclass: TrafficClass
+
+
+def _default_priority(dscp: int) -> int:
+    """SO_PRIORITY por defecto según la precedencia IP (3 bits altos del DSCP)."""
+    return min(dscp >> 3, 6)
+
+
+def parse_traffic_class(s: str) -> TrafficClass:
+    """'EF', 'AF41:5' (prioridad explícita) o un número DSCP ('46')."""
+    name, _, prio_s = s.strip().partition(":")
+    name = name.upper()
+    if name in DSCP_CLASSES:
+        dscp = DSCP_CLASSES[name]
+    else:
+        try:
+            dscp = int(name, 0)
+        except ValueError:
+            raise ValueError(f"clase DSCP desconocida: {s!r}") from None
+        if not 0 <= dscp <= 63:
+            raise ValueError(f"DSCP fuera de rango (0-63): {s!r}")
+    prio = int(prio_s) if prio_s else _default_priority(dscp)
+    if not 0 <= prio <= 7:
+        raise ValueError(f"prioridad fuera de rango (0-7): {s!r}")
+    return TrafficClass(name, dscp, prio)
+
+
+def parse_marking_rule(s: str) -> MarkingRule:
+    """'dns=AF41', '53=AF41', '10000-20000=EF', '443=AF21:3'."""
+    sel, sep, cls = s.partition("=")
+    if not sep:
+        raise ValueError(f"regla DSCP sin '=': {s!r}")
+    tclass = parse_traffic_class(cls)
+    sel = sel.strip().lower()
+    if sel == "dns":
+        return MarkingRule(True, 0, 0, tclass)
+    lo_s, _, hi_s = sel.partition("-")
+    try:
+        lo = int(lo_s)
+        hi = int(hi_s) if hi_s else lo
+    except ValueError:
+        raise ValueError(f"puertos inválidos en regla DSCP: {s!r}") from None
+    if not (0 <= lo <= hi <= 65535):
+        raise ValueError(f"rango de puertos inválido: {s!r}")
+    return MarkingRule(False, lo, hi, tclass)
+
+
+def match_traffic_class(
+    rules: list[MarkingRule], port: int, is_dns: bool
+) -> Optional[TrafficClass]:
+    """Primera regla que coincide (DNS por flag; el resto por puerto destino)."""
+    for r in rules:
+        if r.dns:
+            if is_dns:
+                return r.tclass
+        elif r.port_lo <= port <= r.port_hi:
+            return r.tclass
+    return None
+
+
+def apply_traffic_class(sock: socket.socket, tc: TrafficClass) -> None:
+    """
+    Marca IP_TOS / IPV6_TCLASS y SO_PRIORITY. En sockets AF_INET6 se fijan
+    ambos: IPV6_TCLASS para IPv6 e IP_TOS para destinos IPv4 mapeados.
+    """
+    if not is_linux():
+        return
+    tos = tc.dscp << 2
+    if sock.family == socket.AF_INET6:
+        opts = ((socket.IPPROTO_IPV6, _IPV6_TCLASS), (socket.IPPROTO_IP, _IP_TOS))
+    else:
+        opts = ((socket.IPPROTO_IP, _IP_TOS),)
+    for level, opt in opts:
+        try:
+            sock.setsockopt(level, opt, tos)
+        except OSError:
+            pass
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, _SO_PRIORITY, tc.priority)
     except OSError:
         pass
+
+
+class TcpAdaptation(NamedTuple):
+    sndbuf: int
+    drain_watermark: int
+
+
+def adapt_tcp_client(
+    sock: socket.socket, info: TcpInfo, current_sndbuf: int
+) -> Optional[TcpAdaptation]:
+    """
+    Dimensiona SO_SNDBUF (2×BDP) y la marca de agua de escritura (1×BDP) para un
+    cliente según su RTT y caudal. Devuelve None si no hay datos o no hace falta
+    cambiar nada.
+    """
+    if not info.rtt_us:
+        return None
+    bdp = info.bdp()
+    target = min(max(2 * bdp, TCP_SNDBUF_MIN), TCP_SNDBUF_MAX)
+    # getsockopt devuelve el doble de lo pedido: comparar en la misma escala.
+    if current_sndbuf and (
+        current_sndbuf / _RESIZE_HYSTERESIS <= 2 * target <= current_sndbuf * _RESIZE_HYSTERESIS
+    ):
+        return None
+    try:
+        applied = set_sndbuf(sock, target)
+    except OSError:
+        return None
+    watermark = min(max(bdp, DRAIN_WATERMARK_MIN), DRAIN_WATERMARK_MAX)
+    return TcpAdaptation(applied, watermark)
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-Redirección UDP (relé): reenvía datagramas entre clientes locales y un destino fijo.
+Redirección UDP (relé): reenvía datagramas entre clientes locales y uno o varios destinos.
 
 Nota (badvpn/udpgw): el daemon oficial usa un protocolo TCP propio para tunelar
 UDP a través de SOCKS. Este script hace reenvío UDP directo (puerto a puerto), útil
@@ -8,20 +8,186 @@ como proxy/relay en la misma red o cuando no hace falta pasar por SOCKS.
 
 Uso:
   python udp_redirect.py --lport 5353 --target 8.8.8.8 --tport 53
+  python udp_redirect.py --lport 5353 --target 8.8.8.8 --tport 53 --idle-timeout 60 --max-clients 20000
+  python udp_redirect.py --lport 5353 --target 8.8.8.8:53 --target 1.1.1.1:53 --hedge
+  python udp_redirect.py --lport 27015 --target 10.0.0.5 --tport 27015 --workers 4 --cpu-affinity auto
+  python udp_redirect.py --map-file /etc/udppy/redirect.map
+
+Las asociaciones cliente -> upstream inactivas se cierran tras --idle-timeout y,
+con --max-clients, se desaloja la menos usada recientemente. Con --stats-interval
+(o enviando SIGUSR1) se registran los contadores.
+
+Con varios --target, cada cliente queda fijado a un destino por hashing
+consistente de su dirección. La salud de cada destino se mide de forma pasiva
+(latencia de la primera respuesta tras un envío y envíos sin respuesta): un
+destino con pérdidas seguidas se aparta durante un tiempo y sus clientes pasan
+al siguiente del anillo; uno mucho más lento que el mejor deja de recibir
+clientes nuevos. --hedge (solo petición/respuesta tipo DNS) envía cada petición
+a dos destinos y devuelve la primera respuesta, emparejando por los 2 primeros
+bytes del payload (ID de transacción DNS).
+
+Con --workers N, N procesos enlazan el mismo puerto con SO_REUSEPORT: el kernel
+reparte los clientes por hash de su 4-tupla y cada worker tiene su propio bucle
+epoll y tabla de upstreams. El proceso padre solo vigila a los workers (los
+relanza si mueren), recibe sus contadores por un pipe y registra el agregado.
+
+--map-file sirve muchos puertos (o rangos) en un solo proceso y un solo bucle,
+con la tabla de asociaciones, el límite --max-clients y la salud de destinos
+compartidos. Formato, una regla por línea:
+
+  # puerto(s) local(es)   destino(s)
+  5353                    8.8.8.8:53 1.1.1.1:53
+  27015-27020             10.0.0.5          # mismo puerto que el local
+  7000-7010               10.0.0.6:8000     # rango desplazado: 7000->8000 ... 7010->8010
+
+Con SIGHUP se relee el archivo: los puertos cuya regla no cambió conservan su
+socket y sus asociaciones; solo se abren, cierran o rehacen los demás.
 """
 
 from __future__ import annotations
 
 import argparse
+import bisect
+import hashlib
+import json
 import logging
-import select
+import os
+import selectors
+import signal
 import socket
 import sys
-import threading
-from typing import Dict
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Optional
 
 # Clave: dirección tal como la devuelve recvfrom (IPv4 o IPv6 con scope).
 
+# Datagramas leídos de un mismo socket por despertar antes de atender a los demás.
+_RECV_BUDGET = 64
+_SELECT_TIMEOUT = 60.0
+# Como mucho, cada cuánto se revisan asociaciones inactivas (segundos).
+_EXPIRE_CHECK_MAX = 5.0
+
+# Puntos por destino en el anillo de hashing consistente.
+_RING_VNODES = 64
+# Un envío sin respuesta en este tiempo cuenta como pérdida para el destino.
+_PROBE_TIMEOUT = 2.0
+# Pérdidas seguidas que apartan un destino y durante cuánto (luego se reintenta).
+_DOWN_AFTER_LOSSES = 5
+_DOWN_SECONDS = 10.0
+# Un destino con SRTT > _SLOW_FACTOR * mejor SRTT + _SLOW_SLACK no recibe clientes nuevos.
+_SLOW_FACTOR = 4.0
+_SLOW_SLACK = 0.020
+# Peticiones pendientes de respuesta por cliente en modo --hedge.
+_HEDGE_PENDING_MAX = 64
+# Con --workers: cada cuánto envía contadores cada worker al padre si no hay --stats-interval.
+_WORKER_REPORT_INTERVAL = 5.0
+# Un worker que muere antes de esto se considera fallo de arranque (no se relanza).
+_WORKER_MIN_UPTIME = 2.0
+
+
+def _parse_target(spec: str, default_port: Optional[int]) -> tuple[str, int]:
+    """'host', 'host:puerto', '[v6]:puerto' o 'v6' sin corchetes."""
+    host = spec
+    port = default_port
+    if spec.startswith("["):
+        end = spec.find("]")
+        if end < 0:
+            raise ValueError(f"destino inválido: {spec}")
+        host = spec[1:end]
+        rest = spec[end + 1 :]
+        if rest:
+            if not rest.startswith(":"):
+                raise ValueError(f"destino inválido: {spec}")
+            port = int(rest[1:])
+    elif spec.count(":") == 1:
+        host, port_s = spec.split(":")
+        port = int(port_s)
+    if port is None:
+        raise ValueError(f"{spec}: falta el puerto (usa HOST:PUERTO o --tport)")
+    if not 0 <= port < 65536:
+        raise ValueError(f"{spec}: puerto fuera de rango")
+    return host, port
+
+
+def load_map_file(path: str) -> dict[int, list[tuple[str, int]]]:
+    """
+    Lee un --map-file: puerto local -> [(host, puerto)]. En un rango local, un
+    destino sin puerto usa el mismo puerto local y uno con puerto se desplaza
+    igual que el local. ValueError (con número de línea) si algo no es válido.
+    """
+    mapping: dict[int, list[tuple[str, int]]] = {}
+    with open(path, encoding="utf-8") as f:
+        for lineno, raw in enumerate(f, 1):
+            line = raw.split("#", 1)[0].strip()
+            if not line:
+                continue
+            words = line.split()
+            if len(words) < 2:
+                raise ValueError(f"{path}:{lineno}: falta el destino")
+            try:
+                lo_s, _, hi_s = words[0].partition("-")
+                if not lo_s.isdigit() or not (hi_s or lo_s).isdigit():
+                    raise ValueError(f"puerto local inválido: {words[0]!r}")
+                lo, hi = int(lo_s), int(hi_s or lo_s)
+                if not 0 < lo <= hi < 65536:
+                    raise ValueError("puerto local fuera de rango")
+                # Puerto 0 = "el mismo que el local".
+                dests = [_parse_target(w, 0) for w in words[1:]]
+                for lport in range(lo, hi + 1):
+                    if lport in mapping:
+                        raise ValueError(f"puerto {lport} repetido")
+                    shifted = []
+                    for host, port in dests:
+                        tport = lport if port == 0 else port + (lport - lo)
+                        if tport > 65535:
+                            raise ValueError(f"{host}: puerto destino {tport} fuera de rango")
+                        shifted.append((host, tport))
+                    mapping[lport] = shifted
+            except ValueError as e:
+                raise ValueError(f"{path}:{lineno}: {e}") from e
+    if not mapping:
+        raise ValueError(f"{path}: sin reglas")
+    return mapping
+
+
+def resolve_mapping(
+    mapping: dict[int, list[tuple[str, int]]]
+) -> dict[int, list[tuple[int, tuple]]]:
+    """Resuelve cada destino una vez: puerto local -> [(familia, sockaddr)] (OSError si falla)."""
+    cache: dict[tuple[str, int], tuple[int, tuple]] = {}
+    out: dict[int, list[tuple[int, tuple]]] = {}
+    for lport, dests in mapping.items():
+        resolved = []
+        for dest in dests:
+            addr = cache.get(dest)
+            if addr is None:
+                try:
+                    ai = socket.getaddrinfo(dest[0], dest[1], type=socket.SOCK_DGRAM)[0]
+                except OSError as e:
+                    raise OSError(f"{dest[0]}:{dest[1]}: {e}") from e
+                addr = cache[dest] = (ai[0], ai[4])
+            resolved.append(addr)
+        out[lport] = resolved
+    return out
+
+
+def _parse_cpu_list(spec: str) -> list[int]:
+    """'0,2,4-7' -> [0, 2, 4, 5, 6, 7]."""
+    cpus: list[int] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    if not cpus or min(cpus) < 0:
+        raise ValueError(f"lista de CPUs inválida: {spec}")
+    return cpus
+
 
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser(
@@ -36,22 +202,67 @@ def parse_args() -> argparse.Namespace:
     p.add_argument(
         "--lport",
         type=int,
-        required=True,
+        default=None,
         metavar="PUERTO",
         help="Puerto local de escucha",
     )
     p.add_argument(
         "--target",
-        required=True,
-        metavar="HOST",
-        help="Host o IP de destino",
+        action="append",
+        metavar="HOST[:PUERTO]",
+        help="Destino (repetible: reparte clientes por hashing consistente; IPv6 como [addr]:puerto)",
     )
     p.add_argument(
         "--tport",
         type=int,
-        required=True,
+        default=None,
         metavar="PUERTO",
-        help="Puerto UDP de destino",
+        help="Puerto UDP de destino para los --target sin puerto (no aplica a --map-file)",
+    )
+    p.add_argument(
+        "--hedge",
+        action="store_true",
+        help="Enviar cada petición a dos destinos y devolver la primera respuesta (DNS)",
+    )
+    p.add_argument(
+        "--map-file",
+        default=None,
+        metavar="RUTA",
+        help="Tabla de puertos/rangos locales -> destinos (en lugar de --lport/--target; SIGHUP relee)",
+    )
+    p.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=120.0,
+        metavar="SEG",
+        help="Cerrar el upstream de un cliente sin tráfico en SEG segundos (0 = nunca; default: 120)",
+    )
+    p.add_argument(
+        "--max-clients",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Máximo de clientes con upstream; al superarlo se cierra el menos usado (0 = sin límite)",
+    )
+    p.add_argument(
+        "--stats-interval",
+        type=float,
+        default=0.0,
+        metavar="SEG",
+        help="Registrar contadores de asociaciones cada SEG segundos (0 = solo con SIGUSR1)",
+    )
+    p.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Procesos que comparten el puerto con SO_REUSEPORT (default: 1)",
+    )
+    p.add_argument(
+        "--cpu-affinity",
+        default=None,
+        metavar="auto|LISTA",
+        help="Fijar cada worker a una CPU: 'auto' (worker i -> CPU i) o lista '0,2,4-7'",
     )
     p.add_argument(
         "-v",
@@ -59,7 +270,13 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Log de cada datagrama",
     )
-    return p.parse_args()
+    args = p.parse_args()
+    if args.map_file:
+        if args.lport is not None or args.target:
+            p.error("--map-file no se combina con --lport/--target")
+    elif args.lport is None or not args.target:
+        p.error("hacen falta --lport y --target (o --map-file)")
+    return args
 
 
 def main() -> None:
@@ -69,86 +286,769 @@ def main() -> None:
         format="%(asctime)s %(levelname)s %(message)s",
     )
 
-    try:
-        target_ai = socket.getaddrinfo(
-            args.target, args.tport, type=socket.SOCK_DGRAM
-        )[0]
-    except OSError as e:
-        logging.error("No se pudo resolver destino %s:%s: %s", args.target, args.tport, e)
-        sys.exit(1)
+    loader: Optional[Callable[[], dict[int, list[tuple[int, tuple]]]]] = None
+    if args.map_file:
+        def load_map() -> dict[int, list[tuple[int, tuple]]]:
+            return resolve_mapping(load_map_file(args.map_file))
 
-    family = target_ai[0]
-    target_sockaddr = target_ai[4]
+        loader = load_map
+        try:
+            mapping = loader()
+        except (OSError, ValueError) as e:
+            logging.error("--map-file: %s", e)
+            sys.exit(1)
+    else:
+        targets: list[tuple[int, tuple]] = []
+        for spec in args.target:
+            try:
+                host, port = _parse_target(spec, args.tport)
+                if not port:
+                    raise ValueError(f"{spec}: falta el puerto (usa HOST:PUERTO o --tport)")
+                target_ai = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+            except ValueError as e:
+                logging.error("--target: %s", e)
+                sys.exit(2)
+            except OSError as e:
+                logging.error("No se pudo resolver destino %s: %s", spec, e)
+                sys.exit(1)
+            targets.append((target_ai[0], target_ai[4]))
+        mapping = {args.lport: targets}
+    if args.hedge and all(len(t) < 2 for t in mapping.values()):
+        logging.warning("--hedge necesita al menos dos destinos por puerto; se ignora")
+
+    cpus: Optional[list[int]] = None
+    if args.cpu_affinity:
+        if not hasattr(os, "sched_setaffinity"):
+            logging.warning("--cpu-affinity no disponible en esta plataforma; se ignora")
+        elif args.cpu_affinity == "auto":
+            cpus = sorted(os.sched_getaffinity(0))
+        else:
+            try:
+                cpus = _parse_cpu_list(args.cpu_affinity)
+            except ValueError as e:
+                logging.error("--cpu-affinity: %s", e)
+                sys.exit(2)
+
+    def make_relay(stats_interval: float, reuse_port: bool = False, stats_sink=None) -> UdpRelay:
+        current = mapping
+        if loader is not None and reuse_port:
+            # Worker (re)lanzado: relee el mapa para no volver al de arranque tras un SIGHUP.
+            try:
+                current = loader()
+            except (OSError, ValueError) as e:
+                logging.error("--map-file: %s; se usa el mapa de arranque", e)
+        return UdpRelay(
+            args.listen,
+            current,
+            loader=loader,
+            hedge=args.hedge,
+            idle_timeout=max(0.0, args.idle_timeout),
+            max_clients=max(0, args.max_clients),
+            stats_interval=stats_interval,
+            reuse_port=reuse_port,
+            stats_sink=stats_sink,
+        )
+
+    if args.workers > 1:
+        if not hasattr(socket, "SO_REUSEPORT") or not hasattr(os, "fork"):
+            logging.error("--workers necesita SO_REUSEPORT y fork (Linux)")
+            sys.exit(1)
+        sys.exit(
+            WorkerPool(args.workers, make_relay, cpus, max(0.0, args.stats_interval)).run()
+        )
 
-    relay = UdpRelay(args.listen, args.lport, family, target_sockaddr)
+    if cpus:
+        os.sched_setaffinity(0, {cpus[0]})
+    relay = make_relay(max(0.0, args.stats_interval))
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda *_: relay.request_stats())
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda *_: relay.request_reload())
     relay.run()
 
 
+class WorkerPool:
+    """
+    Proceso padre de --workers: lanza N hijos con fork, cada uno con su UdpRelay
+    sobre el mismo puerto (SO_REUSEPORT). Cada hijo escribe sus contadores como
+    una línea JSON en un pipe; el padre guarda el último de cada uno y registra
+    el agregado con --stats-interval o SIGUSR1.
+    """
+
+    def __init__(
+        self,
+        n: int,
+        make_relay: Callable[..., "UdpRelay"],
+        cpus: Optional[list[int]],
+        stats_interval: float,
+    ) -> None:
+        self._n = n
+        self._make_relay = make_relay
+        self._cpus = cpus
+        self._stats_interval = stats_interval
+        self._report_interval = stats_interval or _WORKER_REPORT_INTERVAL
+        self._sel = selectors.DefaultSelector()
+        # índice de worker -> (pid, inicio, lectura del pipe)
+        self._workers: dict[int, tuple[int, float, int]] = {}
+        self._latest: dict[int, dict] = {}
+        self._bufs: dict[int, bytes] = {}
+        self._stats_due = False
+        self._stopping = False
+        self._failed = False
+
+    def run(self) -> int:
+        for i in range(self._n):
+            self._spawn(i)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda *_: setattr(self, "_stats_due", True))
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self._on_hup)
+        logging.info("%s workers con SO_REUSEPORT", self._n)
+
+        next_stats = time.monotonic() + (self._stats_interval or _SELECT_TIMEOUT)
+        while not self._stopping:
+            try:
+                events = self._sel.select(1.0)
+            except InterruptedError:
+                events = []
+            for key, _ in events:
+                self._read_report(key.data, key.fd)
+            self._reap()
+            now = time.monotonic()
+            if self._stats_due or (self._stats_interval and now >= next_stats):
+                self._stats_due = False
+                next_stats = now + (self._stats_interval or _SELECT_TIMEOUT)
+                self._log_stats()
+
+        for pid, _, _ in self._workers.values():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid, _, _ in self._workers.values():
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        return 1 if self._failed else 0
+
+    def _on_stop(self, *_: object) -> None:
+        self._stopping = True
+
+    def _on_hup(self, *_: object) -> None:
+        # Cada worker relee --map-file por su cuenta.
+        for pid, _, _ in self._workers.values():
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    def _spawn(self, idx: int) -> None:
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # El hijo no debe volver nunca al bucle del padre.
+            code = 0
+            try:
+                os.close(r)
+                self._worker_main(idx, w)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                logging.exception("worker %s", idx)
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        os.close(w)
+        os.set_blocking(r, False)
+        self._sel.register(r, selectors.EVENT_READ, idx)
+        self._workers[idx] = (pid, time.monotonic(), r)
+        self._bufs[idx] = b""
+
+    def _worker_main(self, idx: int, wfd: int) -> None:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        # El selector y los pipes de lectura son del padre.
+        self._sel.close()
+        for _, _, rfd in self._workers.values():
+            os.close(rfd)
+        if self._cpus:
+            cpu = self._cpus[idx % len(self._cpus)]
+            try:
+                os.sched_setaffinity(0, {cpu})
+            except OSError as e:
+                logging.warning("worker %s: CPU %s: %s", idx, cpu, e)
+        os.set_blocking(wfd, False)
+
+        def sink(stats: dict) -> None:
+            try:
+                os.write(wfd, json.dumps(stats, separators=(",", ":")).encode() + b"\n")
+            except BlockingIOError:
+                pass
+
+        relay = self._make_relay(self._report_interval, reuse_port=True, stats_sink=sink)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, lambda *_: relay.request_reload())
+        relay.run()
+
+    def _read_report(self, idx: int, fd: int) -> None:
+        try:
+            chunk = os.read(fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b""
+        if not chunk:
+            self._sel.unregister(fd)
+            return
+        buf = self._bufs.get(idx, b"") + chunk
+        *lines, buf = buf.split(b"\n")
+        self._bufs[idx] = buf
+        if lines:
+            try:
+                self._latest[idx] = json.loads(lines[-1])
+            except ValueError:
+                pass
+
+    def _reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            for idx, (wpid, started, rfd) in list(self._workers.items()):
+                if wpid != pid:
+                    continue
+                try:
+                    self._sel.unregister(rfd)
+                except (KeyError, ValueError):
+                    pass
+                os.close(rfd)
+                self._latest.pop(idx, None)
+                del self._workers[idx]
+                if self._stopping:
+                    break
+                code = os.waitstatus_to_exitcode(status)
+                if time.monotonic() - started < _WORKER_MIN_UPTIME:
+                    logging.error("worker %s terminó al arrancar (código %s); se detiene todo", idx, code)
+                    self._failed = True
+                    self._stopping = True
+                else:
+                    logging.warning("worker %s (pid %s) terminó (código %s); se relanza", idx, pid, code)
+                    self._spawn(idx)
+                break
+
+    def stats(self) -> dict:
+        """Suma de los últimos contadores recibidos de cada worker."""
+        total: dict = {"workers": len(self._latest)}
+        targets: dict[str, dict] = {}
+        for st in self._latest.values():
+            for k, v in st.items():
+                if k == "targets":
+                    continue
+                if k == "listeners":
+                    # Todos los workers escuchan los mismos puertos.
+                    total[k] = max(total.get(k, 0), v)
+                    continue
+                total[k] = total.get(k, 0) + v
+            for t in st.get("targets", []):
+                agg = targets.setdefault(
+                    t["target"],
+                    {"target": t["target"], "up": True, "srtt_ms": None, "replies": 0, "lost": 0, "flows": 0, "_rtts": []},
+                )
+                agg["up"] = agg["up"] and t["up"]
+                for k in ("replies", "lost", "flows"):
+                    agg[k] += t[k]
+                if t["srtt_ms"] is not None:
+                    agg["_rtts"].append(t["srtt_ms"])
+        for agg in targets.values():
+            rtts = agg.pop("_rtts")
+            if rtts:
+                agg["srtt_ms"] = round(sum(rtts) / len(rtts), 2)
+        total["targets"] = list(targets.values())
+        return total
+
+    def _log_stats(self) -> None:
+        st = self.stats()
+        logging.info(
+            "workers=%s/%s puertos=%s asociaciones: activas=%s creadas=%s expiradas=%s desalojadas=%s migradas=%s",
+            st["workers"],
+            self._n,
+            st.get("listeners", 0),
+            st.get("clients", 0),
+            st.get("created", 0),
+            st.get("expired", 0),
+            st.get("evicted", 0),
+            st.get("migrated", 0),
+        )
+        if len(st["targets"]) > 1:
+            for t in st["targets"]:
+                logging.info(
+                    "  %s %s srtt=%s ms respuestas=%s perdidas=%s clientes=%s",
+                    t["target"],
+                    "ok" if t["up"] else "APARTADO",
+                    t["srtt_ms"],
+                    t["replies"],
+                    t["lost"],
+                    t["flows"],
+                )
+
+
+class Target:
+    """Destino con su salud medida pasivamente (SRTT y pérdidas seguidas)."""
+
+    __slots__ = ("family", "sockaddr", "label", "srtt", "losses", "down_until",
+                 "replies", "lost", "flows")
+
+    def __init__(self, family: int, sockaddr: tuple) -> None:
+        self.family = family
+        self.sockaddr = sockaddr
+        host, port = sockaddr[0], sockaddr[1]
+        self.label = f"[{host}]:{port}" if family == socket.AF_INET6 else f"{host}:{port}"
+        self.srtt: Optional[float] = None
+        self.losses = 0
+        self.down_until = 0.0
+        self.replies = 0
+        self.lost = 0
+        self.flows = 0
+
+    def on_rtt(self, rtt: float) -> None:
+        # Mismo factor que SRTT en TCP.
+        self.srtt = rtt if self.srtt is None else self.srtt + 0.125 * (rtt - self.srtt)
+        self.replies += 1
+        if self.losses >= _DOWN_AFTER_LOSSES:
+            logging.info("destino %s responde de nuevo", self.label)
+        self.losses = 0
+        self.down_until = 0.0
+
+    def on_loss(self, now: float) -> None:
+        self.lost += 1
+        self.losses += 1
+        if self.losses == _DOWN_AFTER_LOSSES:
+            logging.warning(
+                "destino %s: %s envíos seguidos sin respuesta; apartado %.0f s",
+                self.label,
+                self.losses,
+                _DOWN_SECONDS,
+            )
+        if self.losses >= _DOWN_AFTER_LOSSES:
+            self.down_until = now + _DOWN_SECONDS
+
+    def up(self, now: float) -> bool:
+        return self.down_until <= now
+
+    def stats(self, now: float) -> dict:
+        return {
+            "target": self.label,
+            "up": self.up(now),
+            "srtt_ms": round(self.srtt * 1000, 2) if self.srtt is not None else None,
+            "replies": self.replies,
+            "lost": self.lost,
+            "flows": self.flows,
+        }
+
+
+class _Upstream:
+    """Socket conectado a un destino en nombre de un cliente."""
+
+    __slots__ = ("sock", "flow", "target", "probe_t")
+
+    def __init__(self, sock: socket.socket, flow: "_Flow", target: Target) -> None:
+        self.sock = sock
+        self.flow = flow
+        self.target = target
+        # Envío más antiguo aún sin respuesta (0 = ninguno); sirve de sonda RTT/pérdida.
+        self.probe_t = 0.0
+
+
+class _Listener:
+    """Puerto local de escucha con sus destinos y su anillo de hashing consistente."""
+
+    __slots__ = ("port", "sock", "targets", "key", "_ring", "_ring_targets")
+
+    def __init__(self, port: int, sock: socket.socket, targets: list[Target]) -> None:
+        self.port = port
+        self.sock = sock
+        self.targets = targets
+        # Identifica la regla para saber si cambió al recargar --map-file.
+        self.key = tuple((t.family, t.sockaddr) for t in targets)
+        points = []
+        for t in targets:
+            for i in range(_RING_VNODES):
+                points.append((_hash(f"{t.label}#{i}"), t))
+        points.sort(key=lambda p: p[0])
+        self._ring = [h for h, _ in points]
+        self._ring_targets = [t for _, t in points]
+
+    def pick_targets(self, client_addr: tuple, count: int, now: float) -> list[Target]:
+        """
+        Destinos del cliente recorriendo el anillo desde su hash: primero los
+        sanos y no lentos, luego los sanos. Los apartados solo se devuelven si
+        no queda ninguno sano.
+        """
+        if len(self.targets) == 1:
+            return self.targets
+        ring_t = self._ring_targets
+        start = bisect.bisect(self._ring, _hash(repr(client_addr[:2])))
+        order: list[Target] = []
+        for i in range(len(ring_t)):
+            t = ring_t[(start + i) % len(ring_t)]
+            if t not in order:
+                order.append(t)
+                if len(order) == len(self.targets):
+                    break
+        healthy = [t for t in order if t.up(now)]
+        if healthy:
+            order = healthy
+        rtts = [t.srtt for t in order if t.up(now) and t.srtt is not None]
+        slow_above = min(rtts) * _SLOW_FACTOR + _SLOW_SLACK if rtts else None
+
+        def rank(t: Target) -> int:
+            if not t.up(now):
+                return 2
+            if slow_above is not None and t.srtt is not None and t.srtt > slow_above:
+                return 1
+            return 0
+
+        # sorted es estable: a igual rango se respeta el orden del anillo.
+        return sorted(order, key=rank)[:count]
+
+
+class _Flow:
+    """Asociación de un cliente: uno o dos upstreams (--hedge) y su última actividad."""
+
+    __slots__ = ("key", "client", "listener", "last", "ups", "pending")
+
+    def __init__(self, key: tuple, client: tuple, listener: _Listener, now: float, hedge: bool) -> None:
+        # (puerto local, dirección del cliente): clave en la tabla de asociaciones.
+        self.key = key
+        self.client = client
+        self.listener = listener
+        self.last = now
+        self.ups: list[_Upstream] = []
+        # --hedge: ID de transacción -> pendiente; la primera respuesta lo retira.
+        self.pending: Optional[OrderedDict[bytes, None]] = OrderedDict() if hedge else None
+
+
 class UdpRelay:
     """
-    Un socket escucha clientes. Por cada cliente se mantiene un socket UDP conectado
-    al destino para demultiplexar las respuestas correctamente.
+    Uno o varios sockets escuchan clientes (uno por puerto local). Por cada
+    cliente se mantiene un socket UDP conectado al destino para demultiplexar
+    las respuestas correctamente.
+
+    Un solo hilo: todos los sockets quedan registrados en un selector (epoll en
+    Linux) desde que se crean, así que cada despertar cuesta O(sockets listos)
+    y no hay límite FD_SETSIZE.
+
+    _client_to_upstream está en orden de última actividad (move_to_end en cada
+    datagrama): las asociaciones inactivas y las víctimas LRU están siempre al
+    principio, así que expirar o desalojar es O(1) por asociación. Las sondas
+    pendientes van en una cola por orden de envío, igual de baratas de vencer.
+    Tabla, límite y salud de destinos son comunes a todos los puertos.
     """
 
     def __init__(
         self,
         bind_addr: str,
-        bind_port: int,
-        target_family: int,
-        target_sockaddr: tuple,
+        mapping: dict[int, list[tuple[int, tuple]]],
+        *,
+        loader: Optional[Callable[[], dict[int, list[tuple[int, tuple]]]]] = None,
+        hedge: bool = False,
+        idle_timeout: float = 0.0,
+        max_clients: int = 0,
+        stats_interval: float = 0.0,
+        reuse_port: bool = False,
+        stats_sink: Optional[Callable[[dict], None]] = None,
     ) -> None:
         self._bind_addr = bind_addr
-        self._bind_port = bind_port
-        self._target_family = target_family
-        self._target = target_sockaddr
-        self._lock = threading.Lock()
-        self._client_to_upstream: Dict[tuple, socket.socket] = {}
-        self._fd_to_client: Dict[int, tuple] = {}
-        self._inbound: socket.socket | None = None
+        self._mapping = mapping
+        # Relee el mapa (--map-file) con SIGHUP; None con --lport/--target.
+        self._loader = loader
+        self._hedge = hedge
+        self._idle_timeout = idle_timeout
+        self._max_clients = max_clients
+        self._stats_interval = stats_interval
+        self._reuse_port = reuse_port
+        # Con --workers, los contadores van al padre en vez de al log.
+        self._stats_sink = stats_sink
+        self._client_to_upstream: "OrderedDict[tuple, _Flow]" = OrderedDict()
+        self._listeners: dict[int, _Listener] = {}
+        # (familia, sockaddr) -> Target, compartido entre puertos y recargas.
+        self._targets: dict[tuple[int, tuple], Target] = {}
+        self._sel = selectors.DefaultSelector()
+        self._now = time.monotonic()
+        self._stats_due = False
+        self._reload_due = False
+        self._probes: deque[tuple[float, _Upstream]] = deque()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self.migrated = 0
+        self.hedge_dups = 0
 
-    def run(self) -> None:
-        inbound = socket.socket(self._target_family, socket.SOCK_DGRAM)
-        inbound.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    def _target(self, family: int, sockaddr: tuple) -> Target:
+        t = self._targets.get((family, sockaddr))
+        if t is None:
+            t = self._targets[(family, sockaddr)] = Target(family, sockaddr)
+        return t
+
+    def _open_listener(self, port: int, dests: list[tuple[int, tuple]]) -> _Listener:
+        targets = [self._target(f, a) for f, a in dests]
+        # El socket de escucha usa la familia del primer destino.
+        family = targets[0].family
+        inbound = socket.socket(family, socket.SOCK_DGRAM)
         try:
-            if self._target_family == socket.AF_INET6:
+            inbound.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self._reuse_port:
+                inbound.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            if family == socket.AF_INET6:
                 bind_ip = self._bind_addr
                 if bind_ip in ("0.0.0.0", ""):
                     bind_ip = "::"
-                inbound.bind((bind_ip, self._bind_port, 0, 0))
+                inbound.bind((bind_ip, port, 0, 0))
             else:
-                inbound.bind((self._bind_addr, self._bind_port))
-        except OSError as e:
-            logging.error("No se pudo enlazar %s:%s: %s", self._bind_addr, self._bind_port, e)
-            sys.exit(1)
-
-        self._inbound = inbound
-
-        logging.info(
+                inbound.bind((self._bind_addr, port))
+            inbound.setblocking(False)
+        except OSError:
+            inbound.close()
+            raise
+        listener = _Listener(port, inbound, targets)
+        self._sel.register(inbound, selectors.EVENT_READ, listener)
+        self._listeners[port] = listener
+        logging.debug(
             "Escuchando UDP %s -> %s",
             self._format_local(inbound),
-            self._format_peer(self._target),
+            ", ".join(t.label for t in targets),
         )
+        return listener
+
+    def _close_listener(self, listener: _Listener) -> None:
+        self._listeners.pop(listener.port, None)
+        for flow in [f for f in self._client_to_upstream.values() if f.listener is listener]:
+            self._close_flow(flow)
+        try:
+            self._sel.unregister(listener.sock)
+        except (KeyError, ValueError):
+            pass
+        listener.sock.close()
+
+    def _forget_unused_targets(self) -> None:
+        used = {id(t) for lst in self._listeners.values() for t in lst.targets}
+        for key, t in list(self._targets.items()):
+            if id(t) not in used and not t.flows:
+                del self._targets[key]
+
+    def _tick_interval(self) -> float:
+        timeout = _SELECT_TIMEOUT
+        if self._idle_timeout:
+            timeout = min(timeout, max(self._idle_timeout / 4, 0.5), _EXPIRE_CHECK_MAX)
+        if self._stats_interval:
+            timeout = min(timeout, self._stats_interval)
+        if any(len(lst.targets) > 1 for lst in self._listeners.values()):
+            timeout = min(timeout, _PROBE_TIMEOUT / 2)
+        return timeout
+
+    def run(self) -> None:
+        for port, dests in sorted(self._mapping.items()):
+            try:
+                self._open_listener(port, dests)
+            except OSError as e:
+                logging.error("No se pudo enlazar %s:%s: %s", self._bind_addr, port, e)
+                sys.exit(1)
+
+        if len(self._listeners) == 1:
+            lst = next(iter(self._listeners.values()))
+            logging.info(
+                "Escuchando UDP %s -> %s%s",
+                self._format_local(lst.sock),
+                ", ".join(t.label for t in lst.targets),
+                " (hedge)" if self._hedge and len(lst.targets) > 1 else "",
+            )
+        else:
+            logging.info(
+                "Escuchando UDP en %s puertos -> %s destinos%s",
+                len(self._listeners),
+                len(self._targets),
+                " (hedge)" if self._hedge else "",
+            )
+
+        timeout = self._tick_interval()
+        next_expire = self._now + timeout
+        next_stats = self._now + (self._stats_interval or _SELECT_TIMEOUT)
 
         while True:
-            with self._lock:
-                rlist = [inbound] + list(self._client_to_upstream.values())
             try:
-                readable, _, _ = select.select(rlist, [], [], 60.0)
+                events = self._sel.select(timeout)
             except InterruptedError:
+                events = []
+            self._now = now = time.monotonic()
+
+            for key, _ in events:
+                data = key.data
+                if data.__class__ is _Listener:
+                    self._drain_inbound(data)
+                else:
+                    self._forward_to_client(data)
+
+            if self._reload_due:
+                self._reload_due = False
+                self._reload()
+                timeout = self._tick_interval()
+            if now >= next_expire:
+                next_expire = now + timeout
+                self._expire_probes(now - _PROBE_TIMEOUT)
+                if self._idle_timeout:
+                    self._expire_idle(now - self._idle_timeout)
+            if self._stats_due or (self._stats_interval and now >= next_stats):
+                self._stats_due = False
+                next_stats = now + (self._stats_interval or _SELECT_TIMEOUT)
+                if self._stats_sink is not None:
+                    self._stats_sink(self.stats())
+                else:
+                    self._log_stats()
+
+    def request_reload(self) -> None:
+        """Desde el manejador de SIGHUP: releer --map-file en la próxima vuelta."""
+        self._reload_due = True
+
+    def _reload(self) -> None:
+        if self._loader is None:
+            logging.info("SIGHUP ignorado: sin --map-file")
+            return
+        # getaddrinfo bloquea el bucle mientras resuelve; es una operación puntual.
+        try:
+            mapping = self._loader()
+        except (OSError, ValueError) as e:
+            logging.error("recarga del mapa: %s; se mantiene el anterior", e)
+            return
+        kept = opened = removed = failed = 0
+        changed: set[int] = set()
+        for port, lst in list(self._listeners.items()):
+            dests = mapping.get(port)
+            if dests is None:
+                self._close_listener(lst)
+                removed += 1
+            elif tuple(dests) != lst.key:
+                self._close_listener(lst)
+                changed.add(port)
+            else:
+                kept += 1
+        for port, dests in sorted(mapping.items()):
+            if port in self._listeners:
                 continue
-            except ValueError:
+            try:
+                self._open_listener(port, dests)
+            except OSError as e:
+                logging.error("No se pudo enlazar %s:%s: %s", self._bind_addr, port, e)
+                failed += 1
                 continue
+            if port not in changed:
+                opened += 1
+        self._mapping = mapping
+        self._forget_unused_targets()
+        logging.info(
+            "mapa recargado: %s sin cambios, %s nuevos, %s cambiados, %s eliminados%s",
+            kept,
+            opened,
+            len(changed),
+            removed,
+            f", {failed} sin enlazar" if failed else "",
+        )
 
-            for s in readable:
-                if s is inbound:
-                    try:
-                        data, client_addr = s.recvfrom(65535)
-                    except OSError as e:
-                        logging.warning("recvfrom cliente: %s", e)
-                        continue
-                    self._forward_to_target(data, client_addr)
-                else:
-                    self._forward_to_client(s)
+    def request_stats(self) -> None:
+        """Desde el manejador de SIGUSR1: registrar contadores en la próxima vuelta."""
+        self._stats_due = True
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._client_to_upstream),
+            "created": self.created,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "migrated": self.migrated,
+            "hedge_dups": self.hedge_dups,
+            "listeners": len(self._listeners),
+            "targets": [t.stats(self._now) for t in self._targets.values()],
+        }
+
+    def _log_stats(self) -> None:
+        st = self.stats()
+        logging.info(
+            "asociaciones: activas=%s creadas=%s expiradas=%s desalojadas=%s migradas=%s",
+            st["clients"],
+            st["created"],
+            st["expired"],
+            st["evicted"],
+            st["migrated"],
+        )
+        if len(self._targets) > 1:
+            for t in st["targets"]:
+                logging.info(
+                    "  %s %s srtt=%s ms respuestas=%s perdidas=%s clientes=%s",
+                    t["target"],
+                    "ok" if t["up"] else "APARTADO",
+                    t["srtt_ms"],
+                    t["replies"],
+                    t["lost"],
+                    t["flows"],
+                )
+            if self._hedge:
+                logging.info("  hedge: respuestas duplicadas descartadas=%s", self.hedge_dups)
+
+    def _close_flow(self, flow: _Flow) -> None:
+        self._client_to_upstream.pop(flow.key, None)
+        for up in flow.ups:
+            self._close_upstream(up)
+        flow.ups = []
+
+    def _close_upstream(self, up: _Upstream) -> None:
+        up.probe_t = 0.0
+        up.target.flows -= 1
+        try:
+            self._sel.unregister(up.sock)
+        except (KeyError, ValueError):
+            pass
+        up.sock.close()
+
+    def _expire_idle(self, cutoff: float) -> None:
+        m = self._client_to_upstream
+        while m:
+            flow = next(iter(m.values()))
+            if flow.last > cutoff:
+                return
+            self._close_flow(flow)
+            self.expired += 1
+            logging.debug("upstream inactivo cerrado (cliente %s)", flow.client)
+
+    def _expire_probes(self, cutoff: float) -> None:
+        probes = self._probes
+        while probes and probes[0][0] <= cutoff:
+            t, up = probes.popleft()
+            # Si probe_t cambió, la sonda ya tuvo respuesta (o el socket se cerró).
+            if up.probe_t == t:
+                up.probe_t = 0.0
+                up.target.on_loss(self._now)
+
+    def _drain_inbound(self, listener: _Listener) -> None:
+        inbound = listener.sock
+        for _ in range(_RECV_BUDGET):
+            try:
+                data, client_addr = inbound.recvfrom(65535)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                logging.warning("recvfrom cliente: %s", e)
+                return
+            self._forward_to_target(data, client_addr, listener)
 
     def _format_local(self, sock: socket.socket) -> str:
         try:
@@ -159,66 +1059,152 @@ class UdpRelay:
             pass
         return "?"
 
-    def _format_peer(self, sockaddr) -> str:
-        if sockaddr is None:
-            return "?"
-        host, port = sockaddr[0], sockaddr[1]
-        return f"{host}:{port}"
-
-    def _get_upstream(self, client_addr: tuple) -> socket.socket:
-        with self._lock:
-            up = self._client_to_upstream.get(client_addr)
-            if up is not None:
-                return up
-            up = socket.socket(self._target_family, socket.SOCK_DGRAM)
-            try:
-                if self._target_family == socket.AF_INET6:
-                    up.bind(("::", 0, 0, 0))
-                else:
-                    up.bind(("", 0))
-            except OSError as e:
-                up.close()
-                raise e
-            try:
-                up.connect(self._target)
-            except OSError as e:
-                up.close()
-                raise e
-            self._client_to_upstream[client_addr] = up
-            self._fd_to_client[up.fileno()] = client_addr
-            logging.debug("Nuevo upstream para cliente %s (fd=%s)", client_addr, up.fileno())
-            return up
-
-    def _forward_to_target(self, data: bytes, client_addr: tuple) -> None:
+    def _open_upstream(self, flow: _Flow, target: Target) -> _Upstream:
+        sock = socket.socket(target.family, socket.SOCK_DGRAM)
         try:
-            up = self._get_upstream(client_addr)
+            if target.family == socket.AF_INET6:
+                sock.bind(("::", 0, 0, 0))
+            else:
+                sock.bind(("", 0))
+            sock.connect(target.sockaddr)
+            sock.setblocking(False)
         except OSError as e:
-            logging.error("upstream para %s: %s", client_addr, e)
-            return
+            sock.close()
+            raise e
+        up = _Upstream(sock, flow, target)
+        self._sel.register(sock, selectors.EVENT_READ, up)
+        target.flows += 1
+        logging.debug(
+            "Nuevo upstream para cliente %s -> %s (fd=%s)",
+            flow.client,
+            target.label,
+            sock.fileno(),
+        )
+        return up
+
+    def _get_flow(self, client_addr: tuple, listener: _Listener) -> _Flow:
+        m = self._client_to_upstream
+        key = (listener.port, client_addr)
+        flow = m.get(key)
+        if flow is not None:
+            flow.last = self._now
+            m.move_to_end(key)
+            if len(listener.targets) > 1 and not self._keep_flow(flow):
+                self._close_flow(flow)
+                self.migrated += 1
+            else:
+                return flow
+        if self._max_clients and len(m) >= self._max_clients:
+            victim = next(iter(m.values()))
+            self._close_flow(victim)
+            self.evicted += 1
+            logging.debug("máximo de clientes: se cierra el upstream de %s", victim.client)
+        hedge = self._hedge and len(listener.targets) > 1
+        flow = _Flow(key, client_addr, listener, self._now, hedge)
         try:
-            up.send(data)
-            logging.debug("%s bytes cliente %s -> destino", len(data), client_addr)
-        except OSError as e:
-            logging.warning("send a destino (cliente %s): %s", client_addr, e)
+            for target in listener.pick_targets(client_addr, 2 if hedge else 1, self._now):
+                flow.ups.append(self._open_upstream(flow, target))
+        except OSError:
+            for up in flow.ups:
+                self._close_upstream(up)
+            raise
+        m[key] = flow
+        self.created += 1
+        return flow
 
-    def _forward_to_client(self, upstream: socket.socket) -> None:
-        assert self._inbound is not None
-        with self._lock:
-            client_addr = self._fd_to_client.get(upstream.fileno())
-        if client_addr is None:
-            return
+    def _keep_flow(self, flow: _Flow) -> bool:
+        """
+        Un destino apartado suelta a sus clientes solo si el anillo los llevaría
+        a otro conjunto de destinos; con --hedge basta con que un upstream siga
+        sano, y si le falta uno y vuelve a haber otro destino sano, se añade.
+        """
+        now = self._now
+        listener = flow.listener
+        healthy = [up for up in flow.ups if up.target.up(now)]
+        if flow.pending is not None and healthy:
+            current = flow.ups[0].target
+            if len(flow.ups) < 2 and any(
+                t is not current and t.up(now) for t in listener.targets
+            ):
+                for t in listener.pick_targets(flow.client, 2, now):
+                    if t is not current:
+                        try:
+                            flow.ups.append(self._open_upstream(flow, t))
+                        except OSError as e:
+                            logging.warning("upstream para %s: %s", flow.client, e)
+                        break
+            return True
+        if len(healthy) == len(flow.ups):
+            return True
+        want = listener.pick_targets(flow.client, len(flow.ups), now)
+        return {id(t) for t in want} == {id(up.target) for up in flow.ups}
+
+    def _forward_to_target(self, data: bytes, client_addr: tuple, listener: _Listener) -> None:
         try:
-            data = upstream.recv(65535)
+            flow = self._get_flow(client_addr, listener)
         except OSError as e:
-            logging.warning("recv upstream: %s", e)
+            logging.error("upstream para %s: %s", client_addr, e)
             return
-        if not data:
+        if flow.pending is not None:
+            pending = flow.pending
+            pending[data[:2]] = None
+            pending.move_to_end(data[:2])
+            if len(pending) > _HEDGE_PENDING_MAX:
+                pending.popitem(last=False)
+        now = self._now
+        for up in flow.ups:
+            try:
+                up.sock.send(data)
+            except OSError as e:
+                logging.warning("send a %s (cliente %s): %s", up.target.label, client_addr, e)
+                continue
+            if not up.probe_t:
+                up.probe_t = now
+                self._probes.append((now, up))
+        logging.debug("%s bytes cliente %s -> destino", len(data), client_addr)
+
+    def _forward_to_client(self, up: _Upstream) -> None:
+        flow = up.flow
+        if not flow.ups:
+            # Asociación cerrada en este mismo despertar (desalojo o migración).
             return
-        try:
-            self._inbound.sendto(data, client_addr)
-            logging.debug("%s bytes destino -> cliente %s", len(data), client_addr)
-        except OSError as e:
-            logging.warning("sendto cliente %s: %s", client_addr, e)
+        upstream = up.sock
+        inbound = flow.listener.sock
+        client_addr = flow.client
+        if flow.last != self._now:
+            flow.last = self._now
+            self._client_to_upstream.move_to_end(flow.key)
+        pending = flow.pending
+        for _ in range(_RECV_BUDGET):
+            try:
+                data = upstream.recv(65535)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                # p. ej. ECONNREFUSED por ICMP del destino: seguir drenando.
+                logging.debug("recv upstream (cliente %s): %s", client_addr, e)
+                continue
+            if up.probe_t:
+                up.target.on_rtt(self._now - up.probe_t)
+                up.probe_t = 0.0
+            if pending is not None:
+                try:
+                    del pending[data[:2]]
+                except KeyError:
+                    # El otro destino ya respondió a esta petición.
+                    self.hedge_dups += 1
+                    continue
+            try:
+                inbound.sendto(data, client_addr)
+                logging.debug("%s bytes destino -> cliente %s", len(data), client_addr)
+            except BlockingIOError:
+                logging.debug("sendto cliente %s: buffer lleno, se descarta", client_addr)
+            except OSError as e:
+                logging.warning("sendto cliente %s: %s", client_addr, e)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
 
 
 if __name__ == "__main__":
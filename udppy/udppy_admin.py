@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Socket de administración local (Unix) para un udppy_server en ejecución.
+
+Protocolo: una petición por línea y una respuesta JSON por línea. La petición
+puede ser texto (`kill 3 17`) o JSON (`{"cmd": "kill", "session": 3, "conid": 17}`).
+
+Comandos:
+  sessions                 lista sesiones (peer, conids, cola, drops)
+  conids SID               conids de una sesión (destino, RTT)
+  kill SID [CONID]         cierra una sesión o solo un conid
+  loglevel NIVEL           debug | info | warning | error
+  logstats                 registros en cola, descartados y suprimidos por tasa
+  profile [SEG]            cProfile durante SEG segundos (default 10) -> archivo .prof
+  resolver                 tamaños de la caché de resolución / DNS
+  parked                   conexiones UDP aparcadas para reconexión (--park-seconds)
+  metrics                  histogramas de latencia (udppy_metrics)
+
+Uso como cliente:
+  python3 udppy_admin.py --socket /run/udppy/admin.sock sessions
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import cProfile
+import json
+import logging
+import math
+import os
+import socket
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Optional
+
+import udppy_log as L
+
+DEFAULT_SOCKET = "/run/udppy/admin.sock"
+# Límite de una línea de petición (las peticiones válidas son cortas).
+_MAX_LINE = 4096
+_PROFILE_MAX_SECONDS = 300.0
+
+_LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+}
+
+
+class AdminError(Exception):
+    pass
+
+
+def _parse_request(line: str) -> dict:
+    line = line.strip()
+    if not line:
+        raise AdminError("petición vacía")
+    if line.startswith("{"):
+        try:
+            req = json.loads(line)
+        except ValueError as e:
+            raise AdminError(f"JSON inválido: {e}") from e
+        if not isinstance(req, dict) or not isinstance(req.get("cmd"), str):
+            raise AdminError("falta 'cmd'")
+        return req
+    words = line.split()
+    cmd = words[0].lower()
+    args = words[1:]
+    req: dict[str, Any] = {"cmd": cmd}
+    try:
+        if cmd in ("conids", "kill") and args:
+            req["session"] = int(args[0])
+            if cmd == "kill" and len(args) > 1:
+                req["conid"] = int(args[1])
+        elif cmd == "loglevel" and args:
+            req["level"] = args[0]
+        elif cmd == "profile" and args:
+            req["seconds"] = float(args[0])
+    except ValueError as e:
+        raise AdminError(f"argumento inválido: {e}") from e
+    return req
+
+
+class AdminServer:
+    """
+    Atiende el socket de administración dentro del event loop del servidor.
+
+    `registry` es el SessionRegistry de udppy_server; `resolver_info` devuelve
+    un dict con tamaños de caché de resolución y `metrics_info` la misma
+    instantánea de métricas que vuelca --metrics-file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        registry: Any,
+        resolver_info: Callable[[], dict],
+        metrics_info: Callable[[], dict],
+        parking: Any = None,
+    ) -> None:
+        self.path = path
+        self._registry = registry
+        self._resolver_info = resolver_info
+        self._metrics_info = metrics_info
+        self._parking = parking
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._profiling: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        parent = os.path.dirname(self.path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._server = await asyncio.start_unix_server(
+            self._handle, path=self.path, limit=_MAX_LINE
+        )
+        os.chmod(self.path, 0o600)
+        logging.info("socket de administración en %s", self.path)
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    writer.write(b'{"ok":false,"error":"linea demasiado larga"}\n')
+                    break
+                if not line:
+                    break
+                try:
+                    req = _parse_request(line.decode("utf-8", "replace"))
+                    resp = await self.dispatch(req)
+                    resp["ok"] = True
+                except AdminError as e:
+                    resp = {"ok": False, "error": str(e)}
+                except (ValueError, TypeError) as e:
+                    # Argumentos JSON de tipo inesperado que no validó el comando.
+                    resp = {"ok": False, "error": f"argumento inválido: {e}"}
+                writer.write(
+                    json.dumps(resp, separators=(",", ":"), default=str).encode()
+                    + b"\n"
+                )
+                await writer.drain()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, req: dict) -> dict:
+        cmd = req["cmd"]
+        handler = getattr(self, f"_cmd_{cmd}", None)
+        if handler is None:
+            raise AdminError(f"comando desconocido: {cmd}")
+        return await handler(req)
+
+    def _session(self, req: dict) -> Any:
+        sid = req.get("session")
+        if not isinstance(sid, int) or isinstance(sid, bool):
+            raise AdminError("falta 'session'")
+        session = self._registry.get(sid)
+        if session is None:
+            raise AdminError(f"sesión {sid} no existe")
+        return session
+
+    async def _cmd_help(self, req: dict) -> dict:
+        return {"commands": sorted(n[5:] for n in dir(self) if n.startswith("_cmd_"))}
+
+    async def _cmd_sessions(self, req: dict) -> dict:
+        return {
+            "limits": self._registry.stats(),
+            "sessions": [s.admin_info() for s in self._registry],
+        }
+
+    async def _cmd_conids(self, req: dict) -> dict:
+        return {"conids": self._session(req).admin_conids()}
+
+    async def _cmd_kill(self, req: dict) -> dict:
+        session = self._session(req)
+        conid = req.get("conid")
+        if conid is not None and (not isinstance(conid, int) or isinstance(conid, bool)):
+            raise AdminError("'conid' debe ser un entero")
+        if conid is None:
+            session.abort()
+            logging.info("admin: sesión %s cerrada", session.sid)
+            return {"killed": session.sid}
+        if not await session.kill_conid(conid):
+            raise AdminError(f"conid {conid} no existe")
+        logging.info("admin: conid %s de la sesión %s cerrado", conid, session.sid)
+        return {"killed": session.sid, "conid": conid}
+
+    async def _cmd_loglevel(self, req: dict) -> dict:
+        name = str(req.get("level", "")).lower()
+        level = _LEVELS.get(name)
+        if level is None:
+            raise AdminError(f"nivel inválido: {name!r}")
+        L.set_level(level)
+        logging.warning("admin: nivel de log -> %s", name)
+        return {"level": name}
+
+    async def _cmd_logstats(self, req: dict) -> dict:
+        return {"logging": L.stats()}
+
+    async def _cmd_profile(self, req: dict) -> dict:
+        if self._profiling is not None and not self._profiling.done():
+            raise AdminError("ya hay un perfilado en curso")
+        seconds = req.get("seconds", 10.0)
+        if (
+            not isinstance(seconds, (int, float))
+            or isinstance(seconds, bool)
+            or not math.isfinite(seconds)
+        ):
+            raise AdminError("'seconds' debe ser un número finito")
+        seconds = min(max(float(seconds), 0.1), _PROFILE_MAX_SECONDS)
+        out = os.path.join(
+            tempfile.gettempdir(), f"udppy-{os.getpid()}-{int(time.time())}.prof"
+        )
+        self._profiling = asyncio.create_task(self._run_profile(seconds, out))
+        return {"seconds": seconds, "output": out}
+
+    async def _run_profile(self, seconds: float, out: str) -> None:
+        # cProfile mide el hilo actual, que es el del event loop.
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            prof.disable()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, prof.dump_stats, out)
+            logging.info("admin: perfil guardado en %s", out)
+        except OSError as e:
+            logging.warning("admin: no se pudo guardar el perfil %s: %s", out, e)
+
+    async def _cmd_resolver(self, req: dict) -> dict:
+        return {"resolver": self._resolver_info()}
+
+    async def _cmd_parked(self, req: dict) -> dict:
+        if self._parking is None:
+            raise AdminError("aparcamiento desactivado (--park-seconds)")
+        return {"parked": self._parking.stats()}
+
+    async def _cmd_metrics(self, req: dict) -> dict:
+        return {"metrics": self._metrics_info()}
+
+
+def _client(path: str, line: str) -> int:
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        s.sendall(line.encode() + b"\n")
+        buf = b""
+        while not buf.endswith(b"\n"):
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            buf += chunk
+    except OSError as e:
+        print(f"{path}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        s.close()
+    try:
+        resp = json.loads(buf)
+    except ValueError:
+        sys.stdout.write(buf.decode("utf-8", "replace"))
+        return 1
+    print(json.dumps(resp, indent=2, ensure_ascii=False))
+    return 0 if resp.get("ok") else 1
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(
+        description="Cliente del socket de administración de udppy_server"
+    )
+    ap.add_argument("--socket", default=DEFAULT_SOCKET, metavar="RUTA")
+    ap.add_argument("command", nargs="+", help="p. ej.: sessions | kill 3 | loglevel debug")
+    args = ap.parse_args()
+    sys.exit(_client(args.socket, " ".join(args.command)))
+
+
+if __name__ == "__main__":
+    main()
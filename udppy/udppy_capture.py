@@ -0,0 +1,142 @@
+# Proyecto udppy — captura binaria de mensajes PacketProto por sesión.
+#
+# Formato del archivo (little-endian):
+#   cabecera: b"UDPPYCAP" + uint16 versión + uint64 hora de inicio (µs epoch)
+#   registro: uint64 t_µs (desde el inicio) + uint32 sesión + uint8 dirección
+#             + uint16 longitud + payload udpgw (sin el prefijo PacketProto)
+#
+# El event loop solo encola tuplas; un hilo aparte empaqueta y escribe.
+
+from __future__ import annotations
+
+import logging
+import queue
+import struct
+import threading
+import time
+from typing import BinaryIO, Iterator, NamedTuple, Optional
+
+MAGIC = b"UDPPYCAP"
+VERSION = 1
+_FILE_HDR = struct.Struct("<8sHQ")
+_REC_HDR = struct.Struct("<QIBH")
+
+DIR_C2S = 0  # cliente (tun2socks) -> servidor
+DIR_S2C = 1  # servidor -> cliente
+
+# Registros pendientes hacia el hilo escritor; si se llena se descartan (se cuentan).
+_QUEUE_MAX = 65536
+_FLUSH_INTERVAL = 1.0
+
+
+class CaptureRecord(NamedTuple):
+    t: float  # segundos desde el inicio de la captura
+    session: int
+    direction: int
+    payload: bytes
+
+
+class CaptureWriter:
+    """Escritor de captura con hilo propio; record() es O(1) y no bloquea."""
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        peers: Optional[set[str]] = None,
+        limit_bytes: int = 0,
+    ) -> None:
+        self.path = path
+        self.peers = peers or None
+        self.limit_bytes = limit_bytes
+        self.dropped = 0
+        self.written = 0
+        self._t0 = time.monotonic()
+        self._q: "queue.Queue[Optional[tuple]]" = queue.Queue(_QUEUE_MAX)
+        self._f: BinaryIO = open(path, "wb")
+        self._f.write(_FILE_HDR.pack(MAGIC, VERSION, int(time.time() * 1_000_000)))
+        self._full = False
+        self._thread = threading.Thread(
+            target=self._run, name="udppy-capture", daemon=True
+        )
+        self._thread.start()
+
+    def wants(self, peer: object) -> bool:
+        """¿Capturar la sesión de este peer? (peername de asyncio o None)."""
+        if self._full:
+            return False
+        if self.peers is None:
+            return True
+        return isinstance(peer, tuple) and bool(peer) and peer[0] in self.peers
+
+    def record(self, session: int, direction: int, payload: bytes) -> None:
+        if self._full:
+            return
+        try:
+            self._q.put_nowait(
+                (time.monotonic() - self._t0, session, direction, payload)
+            )
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        f = self._f
+        pack = _REC_HDR.pack
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._q.get(timeout=_FLUSH_INTERVAL)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                t, session, direction, payload = item
+                n = _REC_HDR.size + len(payload)
+                if self.limit_bytes and self.written + n > self.limit_bytes:
+                    if not self._full:
+                        self._full = True
+                        logging.warning(
+                            "captura %s: límite de tamaño alcanzado; se detiene", self.path
+                        )
+                    continue
+                f.write(pack(int(t * 1_000_000), session, direction, len(payload)))
+                f.write(payload)
+                self.written += n
+            now = time.monotonic()
+            if now - last_flush >= _FLUSH_INTERVAL:
+                f.flush()
+                last_flush = now
+        f.close()
+
+    def close(self) -> None:
+        self._q.put(None)
+        self._thread.join(timeout=5.0)
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "bytes": self.written,
+            "queued": self._q.qsize(),
+            "dropped": self.dropped,
+            "stopped": self._full,
+        }
+
+
+def read_capture(f: BinaryIO) -> Iterator[CaptureRecord]:
+    """Itera los registros de una captura (ValueError si el archivo no es válido)."""
+    hdr = f.read(_FILE_HDR.size)
+    if len(hdr) != _FILE_HDR.size:
+        raise ValueError("captura: cabecera incompleta")
+    magic, version, _ = _FILE_HDR.unpack(hdr)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("captura: formato o versión no soportados")
+    while True:
+        rh = f.read(_REC_HDR.size)
+        if len(rh) < _REC_HDR.size:
+            return
+        t_us, session, direction, length = _REC_HDR.unpack(rh)
+        payload = f.read(length)
+        if len(payload) < length:
+            return
+        yield CaptureRecord(t_us / 1_000_000, session, direction, payload)
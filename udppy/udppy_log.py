@@ -0,0 +1,210 @@
+# Proyecto udppy — registro no bloqueante para el event loop.
+#
+# Los registros se encolan (QueueHandler) y un hilo aparte (QueueListener) los
+# formatea y escribe en stderr/journald. Un filtro limita la tasa por mensaje
+# (plantilla + nivel) y anota cuántos se suprimieron; el hilo escritor emite el
+# resumen pendiente cuando vence la ventana aunque no llegue otro registro igual.
+
+from __future__ import annotations
+
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Optional
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(message)s"
+# Registros pendientes hacia el hilo escritor; si se llena se descartan (se cuentan).
+_QUEUE_MAX = 10000
+# Claves distintas que sigue RateLimitFilter (plantillas de mensaje).
+_MAX_KEYS = 4096
+# Cada cuánto revisa el hilo escritor las ventanas vencidas con registros suprimidos.
+_FLUSH_CHECK = 1.0
+
+# Atajo para el hot path: `if L.debug_on: logging.debug(...)` no construye nada
+# ni entra en logging cuando DEBUG está desactivado.
+debug_on = False
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_qhandler: Optional["_DroppingQueueHandler"] = None
+_limiter: Optional["RateLimitFilter"] = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Deja pasar como mucho `burst` registros por clave cada `interval` segundos.
+    La clave es (plantilla sin formatear, nivel): "UDP error conid=%s" cuenta
+    como un único mensaje sea cual sea el conid. filter() corre en el hilo que
+    registra y flush() en el hilo escritor: el estado va bajo un lock.
+    """
+
+    def __init__(self, burst: int, interval: float) -> None:
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        # clave -> [inicio de ventana, emitidos, suprimidos, último suprimido]
+        self._keys: dict[tuple, list] = {}
+        # Resúmenes de claves desalojadas con supresiones pendientes (los emite flush).
+        self._pending: list[logging.LogRecord] = []
+        self._lock = threading.Lock()
+        self.suppressed_total = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0:
+            return True
+        key = (record.msg, record.levelno)
+        now = time.monotonic()
+        with self._lock:
+            st = self._keys.get(key)
+            if st is None:
+                if len(self._keys) >= _MAX_KEYS:
+                    self._evict(now)
+                self._keys[key] = [now, 1, 0, None]
+                return True
+            if now - st[0] >= self.interval:
+                suppressed = st[2]
+                st[0], st[1], st[2], st[3] = now, 1, 0, None
+                if suppressed:
+                    record.msg = f"{record.msg} [{suppressed} mensajes similares suprimidos]"
+                return True
+            if st[1] < self.burst:
+                st[1] += 1
+                return True
+            st[2] += 1
+            st[3] = record
+            self.suppressed_total += 1
+            return False
+
+    def _evict(self, now: float) -> None:
+        """
+        Con la tabla llena (bajo el lock): se olvidan las ventanas vencidas y, si
+        no basta, las más antiguas hasta 3/4 del límite. Las que tenían registros
+        suprimidos dejan su resumen en _pending en lugar de perderlo.
+        """
+        keys = self._keys
+        for key, st in list(keys.items()):
+            if now - st[0] >= self.interval:
+                self._drop(key, st)
+        while len(keys) > _MAX_KEYS * 3 // 4:
+            key = next(iter(keys))
+            self._drop(key, keys[key])
+
+    def _drop(self, key: tuple, st: list) -> None:
+        del self._keys[key]
+        if st[2]:
+            self._pending.append(self._summary(st))
+
+    @staticmethod
+    def _summary(st: list) -> logging.LogRecord:
+        """El último registro suprimido, con la cuenta añadida."""
+        rec = logging.makeLogRecord(st[3].__dict__)
+        rec.msg = f"{st[3].getMessage()} [{st[2]} mensajes similares suprimidos]"
+        rec.args = None
+        rec.created = time.time()
+        rec.msecs = (rec.created - int(rec.created)) * 1000
+        return rec
+
+    def flush(self, *, force: bool = False) -> list[logging.LogRecord]:
+        """
+        Resúmenes de las claves cuya ventana venció con registros suprimidos (todas
+        si force) y de las desalojadas. La clave se olvida y el siguiente registro
+        igual abre ventana nueva.
+        """
+        now = time.monotonic()
+        with self._lock:
+            out, self._pending = self._pending, []
+            for key, st in list(self._keys.items()):
+                if not st[2] or (not force and now - st[0] < self.interval):
+                    continue
+                del self._keys[key]
+                out.append(self._summary(st))
+        return out
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que no bloquea ni lanza si la cola está llena."""
+
+    def __init__(self, q: "queue.Queue") -> None:
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El formateo (getMessage, asctime, traceback) se hace en el hilo escritor:
+        # la cola es local al proceso y el registro no se serializa.
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _FlushingQueueListener(logging.handlers.QueueListener):
+    """QueueListener que además emite los resúmenes de supresión vencidos."""
+
+    def __init__(
+        self, q: "queue.Queue", handler: logging.Handler, limiter: RateLimitFilter
+    ) -> None:
+        super().__init__(q, handler)
+        self._limiter = limiter
+        self._next_flush = time.monotonic() + _FLUSH_CHECK
+
+    def dequeue(self, block: bool):
+        while True:
+            now = time.monotonic()
+            if now >= self._next_flush:
+                self._next_flush = now + _FLUSH_CHECK
+                for rec in self._limiter.flush():
+                    self.handle(rec)
+            try:
+                return self.queue.get(block, max(0.0, self._next_flush - now))
+            except queue.Empty:
+                if not block:
+                    raise
+
+
+def setup(level: int, *, rate_burst: int = 20, rate_interval: float = 10.0) -> None:
+    """Sustituye a logging.basicConfig: handler en cola + hilo escritor."""
+    global _listener, _qhandler, _limiter
+    shutdown()
+    target = logging.StreamHandler()
+    target.setFormatter(logging.Formatter(LOG_FORMAT))
+    q: "queue.Queue" = queue.Queue(_QUEUE_MAX)
+    _qhandler = _DroppingQueueHandler(q)
+    _limiter = RateLimitFilter(rate_burst, rate_interval)
+    _qhandler.addFilter(_limiter)
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(_qhandler)
+    _listener = _FlushingQueueListener(q, target, _limiter)
+    _listener.start()
+    set_level(level)
+
+
+def set_level(level: int) -> None:
+    global debug_on
+    logging.getLogger().setLevel(level)
+    debug_on = level <= logging.DEBUG
+
+
+def stats() -> dict:
+    return {
+        "level": logging.getLevelName(logging.getLogger().level).lower(),
+        "queued": 0 if _qhandler is None else _qhandler.queue.qsize(),
+        "dropped": 0 if _qhandler is None else _qhandler.dropped,
+        "suppressed": 0 if _limiter is None else _limiter.suppressed_total,
+    }
+
+
+def shutdown() -> None:
+    """Vacía la cola y detiene el hilo escritor (llamar al salir)."""
+    global _listener
+    if _listener is not None:
+        if _limiter is not None and _qhandler is not None:
+            for rec in _limiter.flush(force=True):
+                _qhandler.enqueue(rec)
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,180 @@
+# Proyecto udppy — métricas de latencia del relé (histogramas estilo HDR).
+#
+# Todo se actualiza desde el hilo del event loop: sin locks y con coste O(1)
+# por muestra (un bit_length y un incremento en lista).
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from typing import Optional
+
+# Histograma log-lineal: 2**_SUB_BITS sub-cubetas por potencia de 2 (~12 % de error).
+_SUB_BITS = 3
+_SUB = 1 << _SUB_BITS
+_LINEAR = _SUB * 2
+# Máximo representable: 2**28 µs (~268 s); valores mayores se saturan.
+_MAX_BITS = 28
+_MAX_US = (1 << _MAX_BITS) - 1
+_NBUCKETS = _LINEAR + (_MAX_BITS - _SUB_BITS - 1) * _SUB
+
+# Rangos de puerto destino para agrupar latencias (juegos suelen usar 10000+).
+PORT_RANGES: tuple[tuple[int, int, str], ...] = (
+    (0, 1023, "0-1023"),
+    (1024, 9999, "1024-9999"),
+    (10000, 19999, "10000-19999"),
+    (20000, 65535, "20000-65535"),
+)
+
+# Una conexión se considera inactiva (y se abre una nueva sonda RTT) tras este hueco.
+RTT_IDLE_GAP = 0.5
+# Sondas sin respuesta tras este tiempo se cuentan como perdidas y se descartan.
+RTT_PROBE_TIMEOUT = 10.0
+
+
+def _bucket_index(us: int) -> int:
+    if us < _LINEAR:
+        return us
+    e = us.bit_length() - (_SUB_BITS + 1)
+    return _LINEAR + (e - 1) * _SUB + ((us >> e) - _SUB)
+
+
+def _bucket_high(idx: int) -> int:
+    """Mayor valor (µs) que cae en la cubeta idx."""
+    if idx < _LINEAR:
+        return idx
+    e = (idx - _LINEAR) // _SUB + 1
+    top = (idx - _LINEAR) % _SUB + _SUB
+    return ((top + 1) << e) - 1
+
+
+def port_range_label(port: int) -> str:
+    for lo, hi, label in PORT_RANGES:
+        if lo <= port <= hi:
+            return label
+    return "?"
+
+
+class LatencyHistogram:
+    """Histograma de latencias en microsegundos (precisión relativa fija, memoria fija)."""
+
+    __slots__ = ("_counts", "count", "total_us", "min_us", "max_us")
+
+    def __init__(self) -> None:
+        self._counts = [0] * _NBUCKETS
+        self.count = 0
+        self.total_us = 0
+        self.min_us = 0
+        self.max_us = 0
+
+    def record(self, seconds: float) -> None:
+        us = int(seconds * 1_000_000)
+        if us < 0:
+            us = 0
+        elif us > _MAX_US:
+            us = _MAX_US
+        self._counts[_bucket_index(us)] += 1
+        if not self.count or us < self.min_us:
+            self.min_us = us
+        if us > self.max_us:
+            self.max_us = us
+        self.count += 1
+        self.total_us += us
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        """Suma las muestras de otro histograma (misma rejilla de cubetas)."""
+        if not other.count:
+            return
+        for idx, n in enumerate(other._counts):
+            if n:
+                self._counts[idx] += n
+        if not self.count or other.min_us < self.min_us:
+            self.min_us = other.min_us
+        if other.max_us > self.max_us:
+            self.max_us = other.max_us
+        self.count += other.count
+        self.total_us += other.total_us
+
+    def percentile(self, q: float) -> int:
+        """Valor (µs) bajo el que queda la fracción q de las muestras."""
+        if not self.count:
+            return 0
+        target = max(1, int(q * self.count + 0.999999))
+        seen = 0
+        for idx, n in enumerate(self._counts):
+            if n:
+                seen += n
+                if seen >= target:
+                    return min(_bucket_high(idx), self.max_us)
+        return self.max_us
+
+    def snapshot(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "min_us": self.min_us,
+            "mean_us": self.total_us // self.count,
+            "p50_us": self.percentile(0.50),
+            "p90_us": self.percentile(0.90),
+            "p99_us": self.percentile(0.99),
+            "p999_us": self.percentile(0.999),
+            "max_us": self.max_us,
+        }
+
+
+class RelayMetrics:
+    """Métricas globales del proceso: primera respuesta por destino y cola hacia TCP."""
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        # Clave "dns/<rango>" o "udp/<rango>".
+        self.first_reply: dict[str, LatencyHistogram] = {}
+        self.queue_delay = LatencyHistogram()
+        self.probes_lost = 0
+        # Clientes lentos (cola de envío del kernel creciendo) y bulk descartado por ello.
+        self.slow_events = 0
+        self.slow_drops = 0
+
+    def record_first_reply(self, port: int, dns: bool, seconds: float) -> None:
+        key = ("dns/" if dns else "udp/") + port_range_label(port)
+        h = self.first_reply.get(key)
+        if h is None:
+            h = self.first_reply[key] = LatencyHistogram()
+        h.record(seconds)
+
+    def record_queue_delay(self, seconds: float) -> None:
+        self.queue_delay.record(seconds)
+
+    def snapshot(self) -> dict:
+        return {
+            "time": time.time(),
+            "uptime": time.time() - self.started,
+            "first_reply": {
+                k: h.snapshot() for k, h in sorted(self.first_reply.items())
+            },
+            "queue_delay": self.queue_delay.snapshot(),
+            "probes_lost": self.probes_lost,
+            "slow_events": self.slow_events,
+            "slow_drops": self.slow_drops,
+        }
+
+
+METRICS = RelayMetrics()
+
+
+def write_json_atomic(path: str, data: dict) -> None:
+    """Escribe JSON vía archivo temporal + rename (pensado para run_in_executor)."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+        f.write("\n")
+    os.replace(tmp, path)
+
+
+def ewma(prev: Optional[float], sample: float, alpha: float = 0.125) -> float:
+    """Media móvil exponencial (mismo factor que SRTT en TCP)."""
+    if prev is None:
+        return sample
+    return prev + alpha * (sample - prev)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Reproduce una captura de udppy_server (--capture-file) contra cualquier servidor
+compatible con udpgw (udppy, udpgw de badvpn, udp-py) y compara con lo grabado.
+
+Cada sesión capturada abre su propia conexión TCP y envía los mensajes
+cliente->servidor respetando los tiempos originales (divididos por --speed).
+Las respuestas se emparejan por conid: la latencia es el tiempo desde el primer
+envío pendiente de un conid hasta su siguiente respuesta (igual que las sondas
+RTT de udppy_metrics), tanto en la captura como en la reproducción.
+
+Atención: los datagramas salen hacia los destinos reales grabados en la captura.
+
+Uso:
+  python3 udppy_replay.py captura.bin --target 127.0.0.1:7300
+  python3 udppy_replay.py captura.bin --target 127.0.0.1:7300 --speed 4 --json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import struct
+import sys
+import time
+from collections import defaultdict
+from typing import Optional
+
+import udppy_capture as C
+import udppy_metrics as M
+import udppy_proto as P
+from udppy_server import PacketProtoReader, parse_listen_addr
+
+
+class FlowStats:
+    """Latencias y conteos por conid para un lado (captura o reproducción)."""
+
+    def __init__(self) -> None:
+        self.latency = M.LatencyHistogram()
+        self.sent: dict[int, int] = defaultdict(int)
+        self.replies: dict[int, int] = defaultdict(int)
+        self._pending: dict[int, float] = {}
+        # Error que cortó la reproducción (las cuentas hasta ese punto valen).
+        self.error: Optional[str] = None
+
+    def on_send(self, conid: int, t: float) -> None:
+        self.sent[conid] += 1
+        self._pending.setdefault(conid, t)
+
+    def on_reply(self, conid: int, t: float) -> None:
+        self.replies[conid] += 1
+        t0 = self._pending.pop(conid, None)
+        if t0 is not None:
+            self.latency.record(t - t0)
+
+
+def _conid(payload: bytes) -> Optional[int]:
+    try:
+        flags, conid, _ = P.parse_udppy_header(payload)
+    except ValueError:
+        return None
+    if flags & P.UDPPY_FLAG_KEEPALIVE:
+        return None
+    return conid
+
+
+def load_capture(path: str, max_sessions: int) -> dict[int, list[C.CaptureRecord]]:
+    sessions: dict[int, list[C.CaptureRecord]] = {}
+    with open(path, "rb") as f:
+        for rec in C.read_capture(f):
+            lst = sessions.get(rec.session)
+            if lst is None:
+                if max_sessions and len(sessions) >= max_sessions:
+                    continue
+                lst = sessions[rec.session] = []
+            lst.append(rec)
+    return sessions
+
+
+def captured_stats(records: list[C.CaptureRecord]) -> FlowStats:
+    st = FlowStats()
+    for rec in records:
+        conid = _conid(rec.payload)
+        if conid is None:
+            continue
+        if rec.direction == C.DIR_C2S:
+            st.on_send(conid, rec.t)
+        else:
+            st.on_reply(conid, rec.t)
+    return st
+
+
+async def replay_session(
+    records: list[C.CaptureRecord],
+    host: str,
+    port: int,
+    *,
+    speed: float,
+    grace: float,
+) -> FlowStats:
+    st = FlowStats()
+    reader, writer = await asyncio.open_connection(host, port)
+    loop = asyncio.get_running_loop()
+
+    async def _read() -> None:
+        pp = PacketProtoReader()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    return
+                pp.feed(data)
+                now = loop.time()
+                for pkt in pp.pop_packets():
+                    conid = _conid(pkt)
+                    if conid is not None:
+                        st.on_reply(conid, now)
+        except (OSError, ValueError) as e:
+            st.error = f"lectura: {e}"
+
+    rtask = asyncio.create_task(_read())
+    try:
+        c2s = [r for r in records if r.direction == C.DIR_C2S]
+        if c2s:
+            t_first = c2s[0].t
+            start = loop.time()
+            for rec in c2s:
+                due = start + (rec.t - t_first) / speed
+                delay = due - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if rtask.done():
+                    # El servidor cortó la conexión: se devuelve lo medido.
+                    break
+                writer.write(struct.pack("<H", len(rec.payload)) + rec.payload)
+                conid = _conid(rec.payload)
+                if conid is not None:
+                    st.on_send(conid, loop.time())
+            await writer.drain()
+        try:
+            await asyncio.wait_for(asyncio.shield(rtask), grace)
+        except asyncio.TimeoutError:
+            pass
+    except OSError as e:
+        if st.error is None:
+            st.error = f"envío: {e}"
+    finally:
+        rtask.cancel()
+        writer.close()
+    return st
+
+
+def _divergence(cap: FlowStats, rep: FlowStats) -> dict:
+    conids = set(cap.sent) | set(cap.replies) | set(rep.replies)
+    missing = extra = 0
+    silent: list[int] = []
+    for c in sorted(conids):
+        a, b = cap.replies.get(c, 0), rep.replies.get(c, 0)
+        if b < a:
+            missing += a - b
+        else:
+            extra += b - a
+        if a and not b:
+            silent.append(c)
+    total = sum(cap.replies.values())
+    return {
+        "replies_captured": total,
+        "replies_replayed": sum(rep.replies.values()),
+        "missing": missing,
+        "extra": extra,
+        "reply_ratio": round(sum(rep.replies.values()) / total, 4) if total else None,
+        "silent_conids": silent,
+    }
+
+
+async def _amain(args: argparse.Namespace, host: str, port: int) -> int:
+    try:
+        sessions = load_capture(args.capture, args.sessions)
+    except (OSError, ValueError) as e:
+        print(f"{args.capture}: {e}", file=sys.stderr)
+        return 1
+    if not sessions:
+        print("captura vacía", file=sys.stderr)
+        return 1
+
+    t0 = time.monotonic()
+    results = await asyncio.gather(
+        *(
+            replay_session(recs, host, port, speed=args.speed, grace=args.grace)
+            for recs in sessions.values()
+        ),
+        return_exceptions=True,
+    )
+    report: dict = {
+        "target": f"{host}:{port}",
+        "speed": args.speed,
+        "elapsed": round(time.monotonic() - t0, 3),
+        "sessions": {},
+    }
+    cap_all = M.LatencyHistogram()
+    rep_all = M.LatencyHistogram()
+    for (sid, recs), res in zip(sessions.items(), results):
+        if isinstance(res, BaseException):
+            report["sessions"][sid] = {"error": str(res)}
+            continue
+        cap = captured_stats(recs)
+        cap_all.merge(cap.latency)
+        rep_all.merge(res.latency)
+        report["sessions"][sid] = {
+            "frames": len(recs),
+            "latency_captured": cap.latency.snapshot(),
+            "latency_replayed": res.latency.snapshot(),
+            "divergence": _divergence(cap, res),
+        }
+        if res.error is not None:
+            report["sessions"][sid]["error"] = res.error
+    report["latency_captured"] = cap_all.snapshot()
+    report["latency_replayed"] = rep_all.snapshot()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    print(f"destino {report['target']}  velocidad x{args.speed}  {report['elapsed']} s")
+    for sid, r in report["sessions"].items():
+        if "divergence" not in r:
+            print(f"  sesión {sid}: error {r['error']}")
+            continue
+        d = r["divergence"]
+        print(
+            f"  sesión {sid}: {r['frames']} frames, respuestas "
+            f"{d['replies_replayed']}/{d['replies_captured']} "
+            f"(faltan {d['missing']}, sobran {d['extra']}, conids mudos {len(d['silent_conids'])})"
+            + (f"; cortada: {r['error']}" if "error" in r else "")
+        )
+    for name in ("latency_captured", "latency_replayed"):
+        h = report[name]
+        if h.get("count"):
+            print(
+                f"  {name}: n={h['count']} p50={h['p50_us'] / 1000:.2f} ms "
+                f"p99={h['p99_us'] / 1000:.2f} ms max={h['max_us'] / 1000:.2f} ms"
+            )
+    return 0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(
+        description="Reproduce una captura de udppy contra un servidor udpgw y compara latencias"
+    )
+    ap.add_argument("capture", help="Archivo generado con udppy_server.py --capture-file")
+    ap.add_argument(
+        "--target",
+        required=True,
+        metavar="HOST:PUERTO",
+        help="Servidor udpgw a probar (IPv4 a.b.c.d:puerto o [ipv6]:puerto)",
+    )
+    ap.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Factor de aceleración (1 = tiempo real, 4 = cuatro veces más rápido)",
+    )
+    ap.add_argument(
+        "--sessions",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Reproducir solo las primeras N sesiones (0 = todas)",
+    )
+    ap.add_argument(
+        "--grace",
+        type=float,
+        default=2.0,
+        metavar="SEG",
+        help="Espera de respuestas tras el último envío (default: 2)",
+    )
+    ap.add_argument("--json", action="store_true", help="Informe completo en JSON")
+    args = ap.parse_args()
+    if args.speed <= 0:
+        ap.error("--speed debe ser > 0")
+    try:
+        host, port = parse_listen_addr(args.target)
+    except argparse.ArgumentTypeError as e:
+        ap.error(f"--target: {e}")
+    sys.exit(asyncio.run(_amain(args, host, port)))
+
+
+if __name__ == "__main__":
+    main()
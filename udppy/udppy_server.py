@@ -19,7 +19,9 @@ from __future__ import annotations
 
 import argparse
 import asyncio
+import itertools
 import logging
+import signal
 import socket
 import struct
 import sys
@@ -28,6 +30,10 @@ from collections import OrderedDict, deque
 from typing import TYPE_CHECKING, Optional
 
 import linux_tune
+import udppy_admin
+import udppy_capture
+import udppy_log as L
+import udppy_metrics as M
 import udppy_proto as P
 
 if TYPE_CHECKING:
@@ -42,6 +48,20 @@ _PP_COMPACT_THRESHOLD = 65536
 _TCP_DRAIN_WATERMARK = 65536
 # Límite de frames pendientes hacia el cliente (protege memoria bajo ráfagas).
 _OUT_QUEUE_MAX = 4096
+# Cliente lento: muestreo de la cola de envío del kernel (SIOCOUTQNSD) cada
+# _SLOW_SAMPLE_INTERVAL s; se marca lento si supera _SLOW_BACKLOG_MIN bytes y
+# sigue creciendo _SLOW_STREAK muestras seguidas, y se desmarca por debajo de
+# _SLOW_BACKLOG_CLEAR.
+_SLOW_SAMPLE_INTERVAL = 1.0
+_SLOW_BACKLOG_MIN = 64 * 1024
+_SLOW_BACKLOG_CLEAR = 16 * 1024
+_SLOW_STREAK = 3
+# Con cliente lento: los datagramas "bulk" (no DNS y más grandes que esto) se
+# descartan con la cola a partir de _OUT_QUEUE_MAX_SLOW, y el flush espera
+# _SLOW_COALESCE s para agrupar más frames por escritura.
+_SLOW_BULK_BYTES = 512
+_OUT_QUEUE_MAX_SLOW = 256
+_SLOW_COALESCE = 0.02
 
 # En main() se fija si uvloop.install() se aplicó antes de asyncio.run
 _uvloop_installed = False
@@ -49,6 +69,16 @@ _uvloop_installed = False
 # PacketProto: uint16 LE longitud + payload (protocol/packetproto.h)
 PACKETPROTO_MAXPAYLOAD = 0xFFFF
 
+# Caché de getaddrinfo para destinos no literales (p. ej. --dns con nombre).
+_RESOLVE_TTL = 60.0
+_RESOLVE_CACHE_MAX = 1024
+_resolve_cache: "OrderedDict[tuple[str, int], tuple[float, tuple[str, int, bool]]]" = (
+    OrderedDict()
+)
+
+# Marcado por defecto (DSCP 0, prioridad 0) para quitar la clase de un socket heredado.
+_NO_CLASS = linux_tune.TrafficClass("", 0, 0)
+
 
 class PacketProtoReader:
     """Decodifica flujo TCP en mensajes PacketProto (buffer con offset, sin del O(n) por paquete)."""
@@ -113,6 +143,27 @@ def _try_literal_udp(host: str, port: int) -> Optional[tuple[str, int, bool]]:
         return None
 
 
+def _dual_stack_udp_socket() -> socket.socket:
+    """Socket UDP AF_INET6 con IPV6_V6ONLY=0: sirve destinos IPv4 (::ffff:a.b.c.d) e IPv6."""
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        sock.setblocking(False)
+        sock.bind(("::", 0))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _dual_stack_supported() -> bool:
+    try:
+        _dual_stack_udp_socket().close()
+    except (OSError, AttributeError):
+        return False
+    return True
+
+
 class UdppyConnection:
     """Conexión lógica udppy (conid) con un socket UDP hacia el destino (protocolo udpgw)."""
 
@@ -130,6 +181,9 @@ class UdppyConnection:
         udp_mtu: int,
         udppy_mtu: int,
         linux_tune_sockets: bool,
+        is_dns: bool = False,
+        dual_stack: bool = False,
+        traffic_class: Optional[linux_tune.TrafficClass] = None,
     ) -> None:
         self.client = client
         self.conid = conid
@@ -141,6 +195,9 @@ class UdppyConnection:
         self.target_ipv6 = target_ipv6
         self.udp_mtu = udp_mtu
         self.udppy_mtu = udppy_mtu
+        self.is_dns = is_dns
+        self.dual_stack = dual_stack
+        self.traffic_class = traffic_class
         self._linux_tune_sockets = linux_tune_sockets
 
         self._orig_bin = _ip_to_bin(orig_ip, ipv6=orig_ipv6)
@@ -153,7 +210,16 @@ class UdppyConnection:
         self._protocol: Optional[asyncio.DatagramProtocol] = None
         self._closed = False
         self._last_use = time.monotonic()
-        self._dest = (target_ip, target_port)
+        if dual_stack and not target_ipv6:
+            # Socket AF_INET6 único: el destino IPv4 va como dirección mapeada.
+            self._dest = ("::ffff:" + target_ip, target_port)
+        else:
+            self._dest = (target_ip, target_port)
+        # Sonda RTT: instante del primer send_udp tras inactividad (None = sin sonda).
+        self._probe_t: Optional[float] = None
+        self._replies = 0
+        self.last_rtt: Optional[float] = None
+        self.srtt: Optional[float] = None
 
     def touch(self) -> None:
         self._last_use = time.monotonic()
@@ -161,22 +227,38 @@ class UdppyConnection:
     async def setup_udp(self) -> None:
         loop = asyncio.get_running_loop()
         # Socket UDP sin connect() (como badvpn/udp-py): evita EACCES con SELinux en AlmaLinux.
-        local_addr = ("::", 0) if self.target_ipv6 else ("0.0.0.0", 0)
-        t, p = await loop.create_datagram_endpoint(
-            lambda: _UdppyUdpProtocol(self),
-            local_addr=local_addr,
-        )
+        if self.dual_stack:
+            t, p = await loop.create_datagram_endpoint(
+                lambda: _UdppyUdpProtocol(self),
+                sock=_dual_stack_udp_socket(),
+            )
+        else:
+            local_addr = ("::", 0) if self.target_ipv6 else ("0.0.0.0", 0)
+            t, p = await loop.create_datagram_endpoint(
+                lambda: _UdppyUdpProtocol(self),
+                local_addr=local_addr,
+            )
         self._transport = t
         self._protocol = p
-        if self._linux_tune_sockets:
-            usock = t.get_extra_info("socket")
-            if usock is not None:
+        usock = t.get_extra_info("socket")
+        if usock is not None:
+            if self._linux_tune_sockets:
                 linux_tune.tune_udp_relay_socket(usock)
+            if self.traffic_class is not None:
+                linux_tune.apply_traffic_class(usock, self.traffic_class)
 
     def send_udp(self, data: bytes) -> None:
         if self._closed or not self._transport:
             return
-        self.touch()
+        now = time.monotonic()
+        probe = self._probe_t
+        if probe is None:
+            if not self._replies or now - self._last_use >= M.RTT_IDLE_GAP:
+                self._probe_t = now
+        elif now - probe > M.RTT_PROBE_TIMEOUT:
+            M.METRICS.probes_lost += 1
+            self._probe_t = now
+        self._last_use = now
         trans = self._transport
         sendto = getattr(trans, "sendto", None)
         if sendto is not None:
@@ -188,19 +270,161 @@ class UdppyConnection:
         """Callback síncrono desde el protocolo UDP (sin create_task por paquete)."""
         if self._closed:
             return
-        self.touch()
+        now = time.monotonic()
+        probe = self._probe_t
+        if probe is not None:
+            self._probe_t = None
+            rtt = now - probe
+            self.last_rtt = rtt
+            self.srtt = M.ewma(self.srtt, rtt)
+            M.METRICS.record_first_reply(self.target_port, self.is_dns, rtt)
+        self._replies += 1
+        self._last_use = now
         self.client.enqueue_udppy_reply(self, data)
 
-    async def close(self) -> None:
-        if self._closed:
-            return
+    def discard(self) -> None:
+        """Cierra el socket sin tocar la sesión (conexiones aparcadas)."""
         self._closed = True
         if self._transport:
             self._transport.close()
             self._transport = None
+
+    def adopt(
+        self,
+        client: "TcpClientSession",
+        conid: int,
+        traffic_class: Optional[linux_tune.TrafficClass] = None,
+    ) -> None:
+        """Pasa una conexión aparcada a la sesión que reconectó (mismo socket UDP)."""
+        self.client = client
+        if traffic_class is not None or self.traffic_class is not None:
+            usock = self._transport.get_extra_info("socket") if self._transport else None
+            if usock is not None:
+                linux_tune.apply_traffic_class(usock, traffic_class or _NO_CLASS)
+        self.traffic_class = traffic_class
+        if conid != self.conid:
+            self.conid = conid
+            self._reply_prefix = P.pack_udppy_to_client(
+                0, conid, self.orig_ip, self.orig_port, b"", ipv6=self.orig_ipv6
+            )
+        self._probe_t = None
+        self._last_use = time.monotonic()
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self.discard()
         await self.client.remove_connection(self.conid)
 
 
+# Identidad de una conexión udppy: (conid, addr orig binaria, puerto, es DNS).
+_ConKey = tuple[int, bytes, int, bool]
+
+
+class _ParkedBatch:
+    __slots__ = ("key", "by_dest", "count", "handle")
+
+    def __init__(self, key: tuple[str, _ConKey]) -> None:
+        self.key = key
+        self.by_dest: dict[_ConKey, UdppyConnection] = {}
+        self.count = 0
+        self.handle: Optional[asyncio.TimerHandle] = None
+
+
+class ParkingLot:
+    """
+    Conexiones UDP de sesiones TCP cerradas, retenidas `ttl` segundos bajo la
+    identidad del cliente: IP + primer conid de la sesión (conid y destino). Solo
+    una sesión de la misma IP cuyo primer conid coincida hereda el lote, y cada
+    socket pasa únicamente al mismo conid hacia el mismo destino (mismo puerto
+    origen / mapeo NAT, sin setup_udp). Con la IP sola, dos usuarios tras el
+    mismo CGNAT podrían heredarse los sockets.
+    """
+
+    def __init__(self, ttl: float, max_conns: int) -> None:
+        self.ttl = ttl
+        self.max_conns = max_conns
+        self.conns = 0
+        self.adopted = 0
+        self.expired = 0
+        self._by_key: dict[tuple[str, _ConKey], _ParkedBatch] = {}
+        # Orden de aparcamiento para desalojar primero lo más antiguo.
+        self._order: "OrderedDict[int, _ParkedBatch]" = OrderedDict()
+
+    def park(self, ip: str, first: _ConKey, conns: list[UdppyConnection]) -> int:
+        # conns llega en orden LRU: se conservan las usadas más recientemente.
+        if len(conns) > self.max_conns:
+            for con in conns[: len(conns) - self.max_conns]:
+                con.discard()
+            conns = conns[len(conns) - self.max_conns :]
+        old = self._by_key.get((ip, first))
+        if old is not None:
+            self._expire(old)
+        while self._order and self.conns + len(conns) > self.max_conns:
+            self._expire(next(iter(self._order.values())))
+        batch = _ParkedBatch((ip, first))
+        for con in conns:
+            batch.by_dest[(con.conid, con._orig_bin, con.orig_port, con.is_dns)] = con
+        batch.count = len(batch.by_dest)
+        if not batch.count:
+            return 0
+        batch.handle = asyncio.get_running_loop().call_later(
+            self.ttl, self._expire, batch
+        )
+        self._by_key[batch.key] = batch
+        self._order[id(batch)] = batch
+        self.conns += batch.count
+        return batch.count
+
+    def claim(
+        self, ip: str, first: _ConKey, key: _ConKey
+    ) -> Optional[UdppyConnection]:
+        batch = self._by_key.get((ip, first))
+        if batch is None:
+            return None
+        con = batch.by_dest.pop(key, None)
+        if con is None:
+            return None
+        batch.count -= 1
+        self.conns -= 1
+        self.adopted += 1
+        if not batch.count:
+            self._remove(batch)
+        return con
+
+    def _remove(self, batch: _ParkedBatch) -> None:
+        if batch.handle is not None:
+            batch.handle.cancel()
+            batch.handle = None
+        self._order.pop(id(batch), None)
+        if self._by_key.get(batch.key) is batch:
+            del self._by_key[batch.key]
+
+    def _expire(self, batch: _ParkedBatch) -> None:
+        self._remove(batch)
+        for con in batch.by_dest.values():
+            con.discard()
+        self.conns -= batch.count
+        self.expired += batch.count
+        batch.by_dest.clear()
+        batch.count = 0
+
+    def close(self) -> None:
+        for batch in list(self._order.values()):
+            self._expire(batch)
+
+    def stats(self) -> dict:
+        return {
+            "ttl": self.ttl,
+            "conns": self.conns,
+            "max_conns": self.max_conns,
+            "batches": len(self._order),
+            "ips": len({ip for ip, _ in self._by_key}),
+            "adopted": self.adopted,
+            "expired": self.expired,
+        }
+
+
 class _UdppyUdpProtocol(asyncio.DatagramProtocol):
     def __init__(self, con: UdppyConnection) -> None:
         self._con = con
@@ -209,7 +433,8 @@ class _UdppyUdpProtocol(asyncio.DatagramProtocol):
         self._con.on_udp_datagram(data)
 
     def error_received(self, exc: Exception) -> None:
-        logging.debug("UDP error conid=%s: %s", self._con.conid, exc)
+        if L.debug_on:
+            logging.debug("UDP error conid=%s: %s", self._con.conid, exc)
 
 
 class TcpClientSession:
@@ -226,6 +451,13 @@ class TcpClientSession:
         dns_port: Optional[int],
         max_connections: int,
         linux_tune_sockets: bool,
+        dual_stack: bool = False,
+        capture: Optional[udppy_capture.CaptureWriter] = None,
+        parking: Optional[ParkingLot] = None,
+        adaptive_buffers: bool = False,
+        marking_rules: Optional[list[linux_tune.MarkingRule]] = None,
+        tcp_class: Optional[linux_tune.TrafficClass] = None,
+        tcp_class_auto: bool = False,
     ) -> None:
         self.reader = reader
         self.writer = writer
@@ -234,31 +466,73 @@ class TcpClientSession:
         self.dns_host = dns_host
         self.dns_port = dns_port
         self.max_connections = max_connections
+        self.dual_stack = dual_stack
         self._linux_tune_sockets = linux_tune_sockets
+        self._capture = capture
+        self._parking = parking
+        # Identidad para el lote aparcado: primer conid de la sesión y su destino.
+        self._first_key: Optional[_ConKey] = None
+        self._aborted = False
+        self._adaptive = adaptive_buffers and linux_tune_sockets
+        self._tsock: Optional[socket.socket] = None
+        self._sndbuf = 0
+        self._drain_watermark = _TCP_DRAIN_WATERMARK
+        self._tcp_info: Optional[linux_tune.TcpInfo] = None
+        self._marking_rules = marking_rules or []
+        # Clase del socket TCP: fija (--tcp-dscp) o, en modo auto, la más alta
+        # de los conids abiertos hasta ahora.
+        self._tcp_class_auto = tcp_class_auto and tcp_class is None
+        self._tcp_class = tcp_class
+        self.slow = False
+        self._backlog = 0
+        self._backlog_streak = 0
+        # SO_SNDBUF efectivo antes de marcar la sesión lenta (se restaura al recuperarse).
+        self._sndbuf_before_slow = 0
+        self._slow_drops = 0
+        # Captura activa para esta sesión (se decide en run(), cuando ya hay sid).
+        self._cap: Optional[udppy_capture.CaptureWriter] = None
 
         self._pp = PacketProtoReader()
         # conid -> conexión (LRU: OrderedDict move_to_end en uso)
         self._by_conid: "OrderedDict[int, UdppyConnection]" = OrderedDict()
         self._closed = False
 
-        self._out_q: deque[bytes] = deque()
+        # (frame, instante de encolado) para medir el retardo de cola hasta write().
+        self._out_q: deque[tuple[bytes, float]] = deque()
         self._out_wake = asyncio.Event()
         self._writer_task: Optional[asyncio.Task] = None
         self._idle_task: Optional[asyncio.Task] = None
         self._drops = 0
 
+        self.sid = 0
+        self.peer = writer.get_extra_info("peername")
+        self.peer_ip: Optional[str] = (
+            self.peer[0] if isinstance(self.peer, tuple) and self.peer else None
+        )
+        self.started = time.monotonic()
+        self.last_rx = self.started
+
     async def _resolve_target(
         self, host: str, port: int
     ) -> tuple[str, int, bool]:
         return await _resolve_udp(host, port)
 
     async def run(self) -> None:
-        peer = self.writer.get_extra_info("peername")
-        logging.info("Cliente TCP conectado: %s", peer)
-        if self._linux_tune_sockets:
-            tsock = self.writer.get_extra_info("socket")
-            if tsock is not None:
+        logging.info("Cliente TCP conectado: %s", self.peer)
+        if self._capture is not None and self._capture.wants(self.peer):
+            self._cap = self._capture
+        tsock = self.writer.get_extra_info("socket")
+        if tsock is not None:
+            self._tsock = tsock
+            # El marcado (--tcp-dscp) no depende de --no-linux-tune, como en UDP.
+            if self._tcp_class is not None:
+                linux_tune.apply_traffic_class(tsock, self._tcp_class)
+            if self._linux_tune_sockets:
                 linux_tune.tune_tcp_client_for_udppy(tsock)
+                try:
+                    self._sndbuf = tsock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+                except OSError:
+                    pass
         self._writer_task = asyncio.create_task(self._flush_loop())
         self._idle_task = asyncio.create_task(self._idle_sweeper())
         try:
@@ -266,13 +540,17 @@ class TcpClientSession:
                 data = await self.reader.read(65536)
                 if not data:
                     break
+                self.last_rx = time.monotonic()
                 self._pp.feed(data)
                 try:
                     packets = self._pp.pop_packets()
                 except ValueError as e:
                     logging.error("PacketProto: %s", e)
                     break
+                cap = self._cap
                 for pkt in packets:
+                    if cap is not None:
+                        cap.record(self.sid, udppy_capture.DIR_C2S, pkt)
                     await self._handle_udppy_payload(pkt)
         finally:
             await self.close_all()
@@ -285,6 +563,24 @@ class TcpClientSession:
                 task.cancel()
         self._writer_task = None
         self._idle_task = None
+        if (
+            self._parking is not None
+            and self._by_conid
+            and not self._aborted
+            and self.peer_ip is not None
+            and self._first_key is not None
+        ):
+            conns = [c for c in self._by_conid.values() if not c._closed]
+            self._by_conid.clear()
+            n = self._parking.park(self.peer_ip, self._first_key, conns)
+            if n:
+                logging.info(
+                    "sesión %s cerrada: %s conids aparcados %.0f s",
+                    self.peer,
+                    n,
+                    self._parking.ttl,
+                )
+            return
         for conid in list(self._by_conid.keys()):
             con = self._by_conid.get(conid)
             if con:
@@ -293,6 +589,56 @@ class TcpClientSession:
     async def remove_connection(self, conid: int) -> None:
         self._by_conid.pop(conid, None)
 
+    def abort(self, *, park: bool = False) -> None:
+        """Corta la conexión TCP; run() termina y libera (o aparca) los conids."""
+        if not park:
+            self._aborted = True
+        transport = self.writer.transport
+        if transport is not None and not transport.is_closing():
+            transport.abort()
+
+    async def kill_conid(self, conid: int) -> bool:
+        con = self._by_conid.get(conid)
+        if con is None:
+            return False
+        await con.close()
+        return True
+
+    def admin_info(self) -> dict:
+        now = time.monotonic()
+        return {
+            "session": self.sid,
+            "peer": self.peer,
+            "conids": len(self._by_conid),
+            "queue": len(self._out_q),
+            "drops": self._drops,
+            "slow": self.slow,
+            "slow_drops": self._slow_drops,
+            "backlog": self._backlog,
+            "uptime": round(now - self.started, 1),
+            "idle": round(now - self.last_rx, 1),
+            "sndbuf": self._sndbuf,
+            "drain_watermark": self._drain_watermark,
+            "tcp_rtt_ms": None
+            if self._tcp_info is None
+            else round(self._tcp_info.rtt_us / 1000, 2),
+            "tcp_dscp": None if self._tcp_class is None else self._tcp_class.name,
+        }
+
+    def admin_conids(self) -> list[dict]:
+        now = time.monotonic()
+        return [
+            {
+                "conid": con.conid,
+                "target": f"{con.target_ip}:{con.target_port}",
+                "dns": con.is_dns,
+                "idle": round(now - con._last_use, 1),
+                "srtt_ms": None if con.srtt is None else round(con.srtt * 1000, 2),
+                "dscp": None if con.traffic_class is None else con.traffic_class.name,
+            }
+            for con in self._by_conid.values()
+        ]
+
     def _touch_lru(self, con: UdppyConnection) -> None:
         self._by_conid.move_to_end(con.conid, last=True)
 
@@ -301,17 +647,29 @@ class TcpClientSession:
             return
         oldest = next(iter(self._by_conid))
         con = self._by_conid[oldest]
-        logging.debug("Límite de conexiones: cerrando conid=%s", oldest)
+        if L.debug_on:
+            logging.debug("Límite de conexiones: cerrando conid=%s", oldest)
         await con.close()
 
     async def _idle_sweeper(self) -> None:
-        """Una tarea por cliente TCP: cierra conids idle (antes: 1 tarea por conid)."""
+        """
+        Una tarea por cliente TCP: muestrea la cola de envío cada
+        _SLOW_SAMPLE_INTERVAL s y cierra conids idle cada IDLE_SWEEP_INTERVAL s
+        (antes: 1 tarea por conid).
+        """
+        interval = _SLOW_SAMPLE_INTERVAL if self._tsock is not None else IDLE_SWEEP_INTERVAL
+        next_sweep = time.monotonic() + IDLE_SWEEP_INTERVAL
         try:
             while not self._closed:
-                await asyncio.sleep(IDLE_SWEEP_INTERVAL)
+                await asyncio.sleep(interval)
                 if self._closed:
                     return
+                if self._tsock is not None:
+                    self._sample_backlog()
                 now = time.monotonic()
+                if now < next_sweep:
+                    continue
+                next_sweep = now + IDLE_SWEEP_INTERVAL
                 stale = [
                     con
                     for con in list(self._by_conid.values())
@@ -319,9 +677,94 @@ class TcpClientSession:
                 ]
                 for con in stale:
                     await con.close()
+                if self._adaptive and not self.slow:
+                    self._adapt_tcp_buffers()
         except asyncio.CancelledError:
             return
 
+    def _raise_tcp_class(self, tclass: linux_tune.TrafficClass) -> None:
+        """Modo auto: el túnel TCP lleva la clase más prioritaria de sus conids."""
+        if not self._tcp_class_auto or self._tsock is None:
+            return
+        cur = self._tcp_class
+        if cur is not None and (cur.priority, cur.dscp) >= (tclass.priority, tclass.dscp):
+            return
+        self._tcp_class = tclass
+        linux_tune.apply_traffic_class(self._tsock, tclass)
+
+    def _sample_backlog(self) -> None:
+        """Marca/desmarca la sesión como lenta según la cola de envío (kernel + asyncio)."""
+        kq = linux_tune.send_queue_bytes(self._tsock)
+        if kq is None:
+            return
+        transport = self.writer.transport
+        backlog = kq + (transport.get_write_buffer_size() if transport is not None else 0)
+        prev = self._backlog
+        self._backlog = backlog
+        if not self.slow:
+            if backlog >= _SLOW_BACKLOG_MIN and backlog >= prev:
+                self._backlog_streak += 1
+                if self._backlog_streak >= _SLOW_STREAK:
+                    self.slow = True
+                    M.METRICS.slow_events += 1
+                    # No dejar megabytes retenidos en el kernel para un cliente atascado.
+                    if self._linux_tune_sockets:
+                        self._sndbuf_before_slow = self._sndbuf
+                        try:
+                            self._sndbuf = linux_tune.set_sndbuf(
+                                self._tsock, linux_tune.TCP_SNDBUF_MIN
+                            )
+                        except OSError:
+                            pass
+                    logging.info(
+                        "sesión %s %s: cliente lento (%s bytes sin enviar)",
+                        self.sid,
+                        self.peer,
+                        backlog,
+                    )
+            else:
+                self._backlog_streak = 0
+        elif backlog < _SLOW_BACKLOG_CLEAR:
+            self.slow = False
+            self._backlog_streak = 0
+            if self._sndbuf_before_slow:
+                # getsockopt devuelve el doble de lo pedido: se pide la mitad.
+                try:
+                    self._sndbuf = linux_tune.set_sndbuf(
+                        self._tsock, self._sndbuf_before_slow // 2
+                    )
+                except OSError:
+                    pass
+                self._sndbuf_before_slow = 0
+            logging.info("sesión %s %s: cliente recuperado", self.sid, self.peer)
+
+    def _adapt_tcp_buffers(self) -> None:
+        """Ajusta SO_SNDBUF y la marca de drain del cliente según TCP_INFO (RTT, caudal)."""
+        tsock = self._tsock
+        if tsock is None:
+            return
+        info = linux_tune.tcp_info(tsock)
+        if info is None:
+            return
+        self._tcp_info = info
+        adj = linux_tune.adapt_tcp_client(tsock, info, self._sndbuf)
+        if adj is None:
+            return
+        self._sndbuf = adj.sndbuf
+        self._drain_watermark = adj.drain_watermark
+        transport = self.writer.transport
+        if transport is not None and not transport.is_closing():
+            transport.set_write_buffer_limits(high=adj.drain_watermark)
+        if L.debug_on:
+            logging.debug(
+                "sesión %s: rtt=%.1f ms caudal=%.0f B/s -> sndbuf=%s drain=%s",
+                self.sid,
+                info.rtt_us / 1000,
+                info.throughput(),
+                adj.sndbuf,
+                adj.drain_watermark,
+            )
+
     def enqueue_udppy_reply(self, con: UdppyConnection, payload: bytes) -> None:
         """Encola respuesta hacia el cliente (llamado desde el hilo del event loop)."""
         if self._closed:
@@ -330,6 +773,15 @@ class TcpClientSession:
         if len(body) > self.udppy_mtu:
             logging.warning("respuesta udppy demasiado grande (protocolo udpgw)")
             return
+        if (
+            self.slow
+            and len(self._out_q) >= _OUT_QUEUE_MAX_SLOW
+            and not con.is_dns
+            and len(payload) > _SLOW_BULK_BYTES
+        ):
+            self._slow_drops += 1
+            M.METRICS.slow_drops += 1
+            return
         if len(self._out_q) >= _OUT_QUEUE_MAX:
             self._drops += 1
             if self._drops == 1 or self._drops % 1000 == 0:
@@ -338,25 +790,34 @@ class TcpClientSession:
                     self._drops,
                 )
             return
+        if self._cap is not None:
+            self._cap.record(self.sid, udppy_capture.DIR_S2C, body)
         frame = struct.pack("<H", len(body)) + body
-        self._out_q.append(frame)
+        self._out_q.append((frame, time.monotonic()))
         self._out_wake.set()
 
     async def _flush_loop(self) -> None:
         """Escribe frames en lotes y solo hace drain cuando hace falta."""
         writer = self.writer
+        record_delay = M.METRICS.record_queue_delay
         try:
             while not self._closed:
                 await self._out_wake.wait()
+                if self.slow:
+                    # Cliente lento: agrupar más frames por escritura.
+                    await asyncio.sleep(_SLOW_COALESCE)
                 self._out_wake.clear()
                 written = 0
+                now = time.monotonic()
                 while self._out_q:
-                    frame = self._out_q.popleft()
+                    frame, t_enq = self._out_q.popleft()
+                    record_delay(now - t_enq)
                     writer.write(frame)
                     written += len(frame)
-                    if written >= _TCP_DRAIN_WATERMARK:
+                    if written >= self._drain_watermark:
                         await writer.drain()
                         written = 0
+                        now = time.monotonic()
                 if written:
                     await writer.drain()
         except asyncio.CancelledError:
@@ -373,7 +834,8 @@ class TcpClientSession:
         rest = data[pos:]
 
         if flags & P.UDPPY_FLAG_KEEPALIVE:
-            logging.debug("keepalive")
+            if L.debug_on:
+                logging.debug("keepalive")
             return
 
         ipv6 = bool(flags & P.UDPPY_FLAG_IPV6)
@@ -409,6 +871,31 @@ class TcpClientSession:
             con.send_udp(rest)
             return
 
+        is_dns = bool(flags & P.UDPPY_FLAG_DNS)
+        key = (conid, orig_bin, orig_port, is_dns)
+        if self._first_key is None:
+            self._first_key = key
+
+        tclass = None
+        if self._marking_rules:
+            tclass = linux_tune.match_traffic_class(
+                self._marking_rules, orig_port, is_dns
+            )
+
+        if self._parking is not None and self._parking.conns and self.peer_ip:
+            con = self._parking.claim(self.peer_ip, self._first_key, key)
+            if con is not None:
+                if len(self._by_conid) >= self.max_connections:
+                    await self._evict_lru()
+                con.adopt(self, conid, tclass)
+                if tclass is not None:
+                    self._raise_tcp_class(tclass)
+                self._by_conid[conid] = con
+                if L.debug_on:
+                    logging.debug("conid=%s hereda socket UDP aparcado", conid)
+                con.send_udp(rest)
+                return
+
         target_ip, target_port = orig_ip, orig_port
         if flags & P.UDPPY_FLAG_DNS:
             if self.dns_host is None or self.dns_port is None:
@@ -424,6 +911,8 @@ class TcpClientSession:
             logging.error("resolución destino %s:%s: %s", target_ip, target_port, e)
             return
 
+        if tclass is not None:
+            self._raise_tcp_class(tclass)
         if len(self._by_conid) >= self.max_connections:
             await self._evict_lru()
         con = UdppyConnection(
@@ -438,6 +927,9 @@ class TcpClientSession:
             udp_mtu=self.udp_mtu,
             udppy_mtu=self.udppy_mtu,
             linux_tune_sockets=self._linux_tune_sockets,
+            is_dns=is_dns,
+            dual_stack=self.dual_stack,
+            traffic_class=tclass,
         )
         self._by_conid[conid] = con
         try:
@@ -452,6 +944,95 @@ class TcpClientSession:
         con.send_udp(rest)
 
 
+class SessionRegistry:
+    """
+    Sesiones TCP activas por id y por IP de origen: límites --max-clients y
+    --max-sessions-per-ip, y listado para el socket de administración.
+    """
+
+    def __init__(self, *, max_clients: int = 0, max_per_ip: int = 0) -> None:
+        self.max_clients = max_clients
+        self.max_per_ip = max_per_ip
+        self.refused = 0
+        self.evicted = 0
+        self._by_sid: dict[int, TcpClientSession] = {}
+        self._by_ip: dict[str, dict[int, TcpClientSession]] = {}
+        self._next_sid = itertools.count(1)
+
+    def admit(self, peer_ip: Optional[str]) -> bool:
+        """
+        Decide si se acepta una conexión nueva (antes de crear la sesión).
+        Con el cupo por IP lleno se desaloja la sesión más inactiva de esa IP.
+        """
+        if self.max_per_ip and peer_ip is not None:
+            same = self._by_ip.get(peer_ip)
+            if same is not None and len(same) >= self.max_per_ip:
+                victim = max(same.values(), key=lambda s: time.monotonic() - s.last_rx)
+                logging.info(
+                    "máximo de sesiones por IP (%s) para %s: se cierra la sesión %s",
+                    self.max_per_ip,
+                    peer_ip,
+                    victim.sid,
+                )
+                self.remove(victim)
+                # Sin marcar como abortada: sus conids pueden aparcarse para la nueva.
+                victim.abort(park=True)
+                self.evicted += 1
+        if self.max_clients and len(self._by_sid) >= self.max_clients:
+            self.refused += 1
+            return False
+        return True
+
+    def add(self, session: TcpClientSession) -> None:
+        session.sid = next(self._next_sid)
+        self._by_sid[session.sid] = session
+        if session.peer_ip is not None:
+            self._by_ip.setdefault(session.peer_ip, {})[session.sid] = session
+
+    def remove(self, session: TcpClientSession) -> None:
+        if self._by_sid.pop(session.sid, None) is None:
+            return
+        same = self._by_ip.get(session.peer_ip) if session.peer_ip else None
+        if same is not None:
+            same.pop(session.sid, None)
+            if not same:
+                del self._by_ip[session.peer_ip]
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._by_sid),
+            "ips": len(self._by_ip),
+            "max_clients": self.max_clients,
+            "max_sessions_per_ip": self.max_per_ip,
+            "refused": self.refused,
+            "evicted": self.evicted,
+        }
+
+    def get(self, sid: int) -> Optional[TcpClientSession]:
+        return self._by_sid.get(sid)
+
+    def __iter__(self):
+        return iter(list(self._by_sid.values()))
+
+    def __len__(self) -> int:
+        return len(self._by_sid)
+
+
+def _resolver_info(
+    registry: SessionRegistry, dns_host: Optional[str], dns_port: Optional[int]
+) -> dict:
+    dns_conids = 0
+    for session in registry:
+        dns_conids += sum(1 for c in session._by_conid.values() if c.is_dns)
+    return {
+        "cache_entries": len(_resolve_cache),
+        "cache_max": _RESOLVE_CACHE_MAX,
+        "cache_ttl": _RESOLVE_TTL,
+        "dns_upstream": None if dns_host is None else f"{dns_host}:{dns_port}",
+        "dns_conids": dns_conids,
+    }
+
+
 async def _resolve_udp(
     host: str, port: int
 ) -> tuple[str, int, bool]:
@@ -459,6 +1040,20 @@ async def _resolve_udp(
     lit = _try_literal_udp(host, port)
     if lit is not None:
         return lit
+    key = (host, port)
+    hit = _resolve_cache.get(key)
+    now = time.monotonic()
+    if hit is not None and hit[0] > now:
+        return hit[1]
+    res = await _getaddrinfo_udp(host, port)
+    _resolve_cache[key] = (now + _RESOLVE_TTL, res)
+    _resolve_cache.move_to_end(key)
+    while len(_resolve_cache) > _RESOLVE_CACHE_MAX:
+        _resolve_cache.popitem(last=False)
+    return res
+
+
+async def _getaddrinfo_udp(host: str, port: int) -> tuple[str, int, bool]:
     loop = asyncio.get_running_loop()
     addrinfos = await loop.getaddrinfo(
         host,
@@ -476,7 +1071,29 @@ async def _resolve_udp(
     raise OSError(f"familia no soportada: {fam}")
 
 
-def _parse_listen_addr(s: str) -> tuple[str, int]:
+def _metrics_snapshot(registry: "SessionRegistry") -> dict:
+    snap = M.METRICS.snapshot()
+    snap["sessions"] = len(registry)
+    snap["slow_sessions"] = sum(1 for s in registry if s.slow)
+    return snap
+
+
+async def _metrics_writer(
+    path: str, interval: float, registry: "SessionRegistry"
+) -> None:
+    """Vuelca M.METRICS a un JSON cada `interval` s (escritura fuera del event loop)."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        snap = _metrics_snapshot(registry)
+        try:
+            await loop.run_in_executor(None, M.write_json_atomic, path, snap)
+        except OSError as e:
+            logging.warning("no se pudo escribir métricas en %s: %s", path, e)
+
+
+def parse_listen_addr(s: str) -> tuple[str, int]:
+    """host:puerto o [ipv6]:puerto (también lo usa udppy_replay para --target)."""
     try:
         if s.startswith("["):
             # [::1]:7300
@@ -518,7 +1135,24 @@ async def _client_connected(
     dns_port: Optional[int],
     max_connections: int,
     linux_tune_sockets: bool,
+    registry: SessionRegistry,
+    dual_stack: bool,
+    capture: Optional[udppy_capture.CaptureWriter],
+    parking: Optional[ParkingLot],
+    adaptive_buffers: bool,
+    marking_rules: list[linux_tune.MarkingRule],
+    tcp_class: Optional[linux_tune.TrafficClass],
+    tcp_class_auto: bool,
 ) -> None:
+    peer = writer.get_extra_info("peername")
+    if not registry.admit(peer[0] if isinstance(peer, tuple) and peer else None):
+        logging.warning(
+            "máximo de clientes (%s) alcanzado; se rechaza %s",
+            registry.max_clients,
+            peer,
+        )
+        writer.transport.abort()
+        return
     session = TcpClientSession(
         reader,
         writer,
@@ -528,10 +1162,19 @@ async def _client_connected(
         dns_port=dns_port,
         max_connections=max_connections,
         linux_tune_sockets=linux_tune_sockets,
+        dual_stack=dual_stack,
+        capture=capture,
+        parking=parking,
+        adaptive_buffers=adaptive_buffers,
+        marking_rules=marking_rules,
+        tcp_class=tcp_class,
+        tcp_class_auto=tcp_class_auto,
     )
+    registry.add(session)
     try:
         await session.run()
     finally:
+        registry.remove(session)
         try:
             writer.close()
             await writer.wait_closed()
@@ -561,6 +1204,21 @@ async def _amain() -> None:
         default=256,
         help="Máximo de conexiones UDP lógicas por cliente TCP",
     )
+    ap.add_argument(
+        "--max-clients",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Máximo de sesiones TCP simultáneas; las demás se rechazan (0 = sin límite)",
+    )
+    ap.add_argument(
+        "--max-sessions-per-ip",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Máximo de sesiones TCP por IP de origen; al superarlo se cierra la más "
+        "inactiva de esa IP (0 = sin límite; ojo con CGNAT)",
+    )
     ap.add_argument(
         "--dns",
         type=str,
@@ -568,12 +1226,115 @@ async def _amain() -> None:
         metavar="HOST:PUERTO",
         help="Reenvío DNS cuando el cliente marca el flag DNS (recomendado en Windows)",
     )
+    ap.add_argument(
+        "--dual-stack",
+        action="store_true",
+        help="Un solo tipo de socket UDP (AF_INET6, IPV6_V6ONLY=0) para destinos IPv4 e IPv6",
+    )
+    ap.add_argument(
+        "--park-seconds",
+        type=float,
+        default=0.0,
+        metavar="SEG",
+        help="Retener los sockets UDP de una sesión cerrada SEG segundos para que el "
+        "cliente los herede al reconectar (0 = desactivado)",
+    )
+    ap.add_argument(
+        "--park-max-conns",
+        type=int,
+        default=4096,
+        metavar="N",
+        help="Máximo de conexiones UDP aparcadas en total (default: 4096)",
+    )
+    ap.add_argument(
+        "--metrics-file",
+        type=str,
+        default=None,
+        metavar="RUTA",
+        help="Escribir periódicamente histogramas de latencia (RTT primera respuesta, cola TCP) en JSON",
+    )
+    ap.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=10.0,
+        metavar="SEG",
+        help="Intervalo de volcado de --metrics-file (default: 10)",
+    )
+    ap.add_argument(
+        "--capture-file",
+        type=str,
+        default=None,
+        metavar="RUTA",
+        help="Grabar mensajes PacketProto (con marca de tiempo y dirección) para udppy_replay.py",
+    )
+    ap.add_argument(
+        "--capture-peer",
+        action="append",
+        default=None,
+        metavar="IP",
+        help="Capturar solo sesiones de esta IP (repetible; por defecto todas)",
+    )
+    ap.add_argument(
+        "--capture-limit-mb",
+        type=int,
+        default=512,
+        metavar="MB",
+        help="Detener la captura al alcanzar este tamaño (0 = sin límite; default: 512)",
+    )
+    ap.add_argument(
+        "--admin-socket",
+        type=str,
+        default=None,
+        metavar="RUTA",
+        help="Socket Unix de administración (sesiones, kill, loglevel, profile); "
+        "cliente: python3 udppy_admin.py --socket RUTA sessions",
+    )
     ap.add_argument("-v", "--verbose", action="store_true")
+    ap.add_argument(
+        "--log-rate",
+        type=int,
+        default=20,
+        metavar="N",
+        help="Máximo de registros iguales (misma plantilla y nivel) por intervalo; 0 = sin límite",
+    )
+    ap.add_argument(
+        "--log-rate-interval",
+        type=float,
+        default=10.0,
+        metavar="SEG",
+        help="Ventana de --log-rate en segundos (default: 10)",
+    )
     ap.add_argument(
         "--no-linux-tune",
         action="store_true",
         help="Desactivar TCP_NODELAY/buffers en Linux (solo depuración)",
     )
+    ap.add_argument(
+        "--no-adaptive-buffers",
+        action="store_true",
+        help="No ajustar SO_SNDBUF/drain por cliente según TCP_INFO (RTT y caudal)",
+    )
+    ap.add_argument(
+        "--force-buffers",
+        action="store_true",
+        help="Como root, usar SO_RCVBUFFORCE/SO_SNDBUFFORCE (ignora net.core.rmem_max/wmem_max)",
+    )
+    ap.add_argument(
+        "--dscp-rule",
+        action="append",
+        default=None,
+        metavar="SELECTOR=CLASE",
+        help="Marcado DSCP/SO_PRIORITY por conid: 'dns=AF41', '10000-20000=EF', "
+        "'443=AF21:3' (prioridad explícita). Repetible; gana la primera que coincide",
+    )
+    ap.add_argument(
+        "--tcp-dscp",
+        type=str,
+        default="auto",
+        metavar="CLASE",
+        help="Clase del socket TCP del cliente: 'auto' (la más alta de sus conids), "
+        "'none' o una clase (EF, AF41, 46...)",
+    )
     ap.add_argument(
         "--backlog",
         type=int,
@@ -593,9 +1354,10 @@ async def _amain() -> None:
     )
     args = ap.parse_args()
 
-    logging.basicConfig(
-        level=logging.DEBUG if args.verbose else logging.INFO,
-        format="%(asctime)s %(levelname)s %(message)s",
+    L.setup(
+        logging.DEBUG if args.verbose else logging.INFO,
+        rate_burst=args.log_rate,
+        rate_interval=args.log_rate_interval,
     )
 
     if linux_tune.is_linux():
@@ -617,7 +1379,7 @@ async def _amain() -> None:
         return
 
     try:
-        host, port = _parse_listen_addr(args.listen_addr)
+        host, port = parse_listen_addr(args.listen_addr)
     except argparse.ArgumentTypeError as e:
         logging.error("%s", e)
         return
@@ -625,7 +1387,78 @@ async def _amain() -> None:
     linux_tune_sockets = (
         linux_tune.is_linux() and not args.no_linux_tune
     )
+    if linux_tune_sockets:
+        rep = linux_tune.init(force_buffers=args.force_buffers)
+        logging.info(
+            "linux_tune: rmem_max=%s wmem_max=%s%s; buffers efectivos TCP %s/%s, UDP %s/%s (rcv/snd)%s",
+            rep.get("rmem_max"),
+            rep.get("wmem_max"),
+            " (SO_*BUFFORCE)" if rep.get("force") else "",
+            rep.get("tcp_rcvbuf"),
+            rep.get("tcp_sndbuf"),
+            rep.get("udp_rcvbuf"),
+            rep.get("udp_sndbuf"),
+            "" if args.no_adaptive_buffers else "; SO_SNDBUF adaptativo por cliente",
+        )
 
+    try:
+        marking_rules = [linux_tune.parse_marking_rule(r) for r in args.dscp_rule or []]
+        tcp_dscp = args.tcp_dscp.strip().lower()
+        tcp_class = (
+            None
+            if tcp_dscp in ("auto", "none")
+            else linux_tune.parse_traffic_class(args.tcp_dscp)
+        )
+    except ValueError as e:
+        logging.error("%s", e)
+        return
+    if marking_rules or tcp_class is not None:
+        logging.info(
+            "marcado DSCP: %s; TCP: %s",
+            ", ".join(
+                ("dns" if r.dns else f"{r.port_lo}-{r.port_hi}") + f"={r.tclass.name}"
+                for r in marking_rules
+            )
+            or "-",
+            tcp_class.name if tcp_class is not None else tcp_dscp,
+        )
+        if not linux_tune.is_linux():
+            logging.warning(
+                "marcado DSCP/SO_PRIORITY solo en Linux: --dscp-rule/--tcp-dscp se ignoran"
+            )
+
+    dual_stack = args.dual_stack
+    if dual_stack and not _dual_stack_supported():
+        logging.warning(
+            "--dual-stack no disponible (sin IPv6 o IPV6_V6ONLY); se usan sockets por familia"
+        )
+        dual_stack = False
+
+    capture: Optional[udppy_capture.CaptureWriter] = None
+    if args.capture_file:
+        try:
+            capture = udppy_capture.CaptureWriter(
+                args.capture_file,
+                peers=set(args.capture_peer) if args.capture_peer else None,
+                limit_bytes=max(0, args.capture_limit_mb) * 1024 * 1024,
+            )
+        except OSError as e:
+            logging.error("captura %s: %s", args.capture_file, e)
+            return
+        logging.info(
+            "capturando PacketProto en %s (%s)",
+            args.capture_file,
+            ", ".join(args.capture_peer) if args.capture_peer else "todas las sesiones",
+        )
+
+    parking: Optional[ParkingLot] = None
+    if args.park_seconds > 0 and args.park_max_conns > 0:
+        parking = ParkingLot(args.park_seconds, args.park_max_conns)
+
+    registry = SessionRegistry(
+        max_clients=max(0, args.max_clients),
+        max_per_ip=max(0, args.max_sessions_per_ip),
+    )
     server = await asyncio.start_server(
         lambda r, w: _client_connected(
             r,
@@ -636,16 +1469,78 @@ async def _amain() -> None:
             dns_port=dns_port,
             max_connections=args.max_connections,
             linux_tune_sockets=linux_tune_sockets,
+            registry=registry,
+            dual_stack=dual_stack,
+            capture=capture,
+            parking=parking,
+            adaptive_buffers=not args.no_adaptive_buffers,
+            marking_rules=marking_rules,
+            tcp_class=tcp_class,
+            tcp_class_auto=tcp_dscp == "auto",
         ),
         host=host,
         port=port,
         backlog=args.backlog,
     )
     addrs = ", ".join(str(s.getsockname()) for s in server.sockets or [])
-    logging.info("udppy escuchando en %s (udppy_mtu=%s)", addrs, udppy_mtu)
+    logging.info(
+        "udppy escuchando en %s (udppy_mtu=%s%s)",
+        addrs,
+        udppy_mtu,
+        ", UDP dual-stack" if dual_stack else "",
+    )
+
+    metrics_task: Optional[asyncio.Task] = None
+    if args.metrics_file:
+        metrics_task = asyncio.create_task(
+            _metrics_writer(
+                args.metrics_file, max(1.0, args.metrics_interval), registry
+            )
+        )
+        logging.info("métricas de latencia en %s", args.metrics_file)
+
+    admin: Optional[udppy_admin.AdminServer] = None
+    if args.admin_socket:
+        admin = udppy_admin.AdminServer(
+            args.admin_socket,
+            registry=registry,
+            resolver_info=lambda: _resolver_info(registry, dns_host, dns_port),
+            metrics_info=lambda: _metrics_snapshot(registry),
+            parking=parking,
+        )
+        try:
+            await admin.start()
+        except OSError as e:
+            logging.error("socket de administración %s: %s", args.admin_socket, e)
+            admin = None
 
-    async with server:
-        await server.serve_forever()
+    # SIGTERM (systemd stop) termina igual que Ctrl+C: pasando por el finally.
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    except (NotImplementedError, AttributeError):
+        pass
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        if metrics_task is not None:
+            metrics_task.cancel()
+            try:
+                await metrics_task
+            except asyncio.CancelledError:
+                pass
+            # Última instantánea al salir (escritura síncrona: el loop está cerrando).
+            try:
+                M.write_json_atomic(args.metrics_file, _metrics_snapshot(registry))
+            except OSError as e:
+                logging.warning("no se pudo escribir métricas en %s: %s", args.metrics_file, e)
+        if admin is not None:
+            await admin.close()
+        if capture is not None:
+            capture.close()
+        if parking is not None:
+            parking.close()
 
 
 def main() -> None:
@@ -663,7 +1558,10 @@ def main() -> None:
             _uvloop_installed = True
         except ImportError:
             pass
-    asyncio.run(_amain())
+    try:
+        asyncio.run(_amain())
+    finally:
+        L.shutdown()
 
 
 if __name__ == "__main__":